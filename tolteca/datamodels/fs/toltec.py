@@ -6,129 +6,140 @@ conventions.
 
 """
 
+import functools
 import re
 from datetime import datetime
+from pathlib import PurePosixPath
 from tollan.utils.log import get_logger
 from astropy.time import Time
 from tollan.utils.registry import Registry, register_to
 from tollan.utils import fileloc, dict_from_regex_match
 from ..io.toltec.kidsdata import KidsDataKind
 from ..io.toltec.table import TableKind
+from .toltec_index import ToltecDataFileIndex
 
 
 __all__ = ['meta_from_source', 'ToltecDataFileStore', ]
 
 
 _filepath_meta_parsers = Registry.create()
-"""A registry to hold functions that extract info from file path."""
+"""A registry to hold functions that extract info from file path.
 
+The parsers take the file path and return the meta data dict, in which
+the ut is a `~datetime.datetime` object.
+"""
+
+_filepath_meta_parser_prefixes = dict()
+"""The filename prefixes that each of the parsers can handle."""
+
+
+def _register_parser(label, prefixes):
+    def decorator(func):
+        _filepath_meta_parser_prefixes[label] = prefixes
+        return register_to(_filepath_meta_parsers, label)(func)
+    return decorator
 
-@register_to(_filepath_meta_parsers, 'basic_obs_data')
-def _meta_from_bod_filename(file_loc):
-    """Return the meta data parsed from the filename of BOD file."""
 
-    path = file_loc.path
-    filename = path.name
+def _parse_ut_underscore(v):
+    # this is much faster than datetime.strptime with
+    # format '%Y_%m_%d_%H_%M_%S'
+    return datetime(*map(int, v.split('_')))
 
-    re_toltec_file = re.compile(
-        r'^(?P<interface>toltec(?P<roachid>\d+))_(?P<obsnum>\d+)_'
-        r'(?P<subobsnum>\d+)_(?P<scannum>\d+)_'
-        r'(?P<ut>\d{4}_\d{2}_\d{2}(?:_\d{2}_\d{2}_\d{2}))'
-        r'(?:_(?P<filesuffix>[^\/.]+))?'
-        r'\.(?P<fileext>.+)$')
 
-    def parse_ut(v):
-        result = Time(
-            datetime.strptime(v, '%Y_%m_%d_%H_%M_%S'),
-            scale='utc')
-        result.format = 'isot'
-        return result
+def _parse_ut_dash(v):
+    # '%Y-%m-%d'
+    return datetime(*map(int, v.split('-')))
+
+
+def _infer_master_name(path, meta):
+    # one can infer the master if the immediate parent of the file is
+    # the interface
+    if path.parent.name == meta['interface']:
+        master_name = path.parent.parent.name
+        if master_name in ['ics', 'tcs', 'clip']:
+            meta['master_name'] = master_name
+
+
+_re_bod_file = re.compile(
+    r'^(?P<interface>toltec(?P<roachid>\d+))_(?P<obsnum>\d+)_'
+    r'(?P<subobsnum>\d+)_(?P<scannum>\d+)_'
+    r'(?P<ut>\d{4}_\d{2}_\d{2}(?:_\d{2}_\d{2}_\d{2}))'
+    r'(?:_(?P<filesuffix>[^\/.]+))?'
+    r'\.(?P<fileext>.+)$')
+
+_bod_data_kind_mapper = {
+        ('vnasweep', 'nc'): KidsDataKind.VnaSweep,
+        ('targsweep', 'nc'): KidsDataKind.TargetSweep,
+        ('tune', 'nc'): KidsDataKind.Tune,
+        ('timestream', 'nc'): KidsDataKind.RawTimeStream,
+        ('vnasweep_processed', 'nc'):
+        KidsDataKind.ReducedSweep,
+        ('targsweep_processed', 'nc'):
+        KidsDataKind.ReducedSweep,
+        ('tune_processed', 'nc'):
+        KidsDataKind.ReducedSweep,
+        ('timestream_processed', 'nc'):
+        KidsDataKind.SolvedTimeStream,
+        ('vnasweep', 'txt'):
+        TableKind.KidsModelParams,
+        ('targsweep', 'txt'):
+        TableKind.KidsModelParams,
+        ('tune', 'txt'):
+        TableKind.KidsModelParams,
+    }
+
+
+@_register_parser('basic_obs_data', ('toltec', ))
+def _meta_from_bod_filename(path):
+    """Return the meta data parsed from the filename of BOD file."""
 
     type_dispatcher = {
         'roachid': int,
         'obsnum': int,
         'subobsnum': int,
         'scannum': int,
-        'ut': parse_ut,
+        'ut': _parse_ut_underscore,
         'fileext': lambda s: s.lower()
         }
 
     meta = dict_from_regex_match(
-            re_toltec_file, filename, type_dispatcher)
+            _re_bod_file, path.name, type_dispatcher)
     if meta is None:
         return None
 
     # add more items to the meta
-    meta['file_loc'] = file_loc
     meta['instru'] = 'toltec'
-
-    data_kind_mapper = {
-            ('vnasweep', 'nc'): KidsDataKind.VnaSweep,
-            ('targsweep', 'nc'): KidsDataKind.TargetSweep,
-            ('tune', 'nc'): KidsDataKind.Tune,
-            ('timestream', 'nc'): KidsDataKind.RawTimeStream,
-            ('vnasweep_processed', 'nc'):
-            KidsDataKind.ReducedSweep,
-            ('targsweep_processed', 'nc'):
-            KidsDataKind.ReducedSweep,
-            ('tune_processed', 'nc'):
-            KidsDataKind.ReducedSweep,
-            ('timestream_processed', 'nc'):
-            KidsDataKind.SolvedTimeStream,
-            ('vnasweep', 'txt'):
-            TableKind.KidsModelParams,
-            ('targsweep', 'txt'):
-            TableKind.KidsModelParams,
-            ('tune', 'txt'):
-            TableKind.KidsModelParams,
-        }
-    meta['data_kind'] = data_kind_mapper.get(
+    meta['data_kind'] = _bod_data_kind_mapper.get(
             (meta['filesuffix'], meta['fileext']), None)
-
-    # one can infer the master if the immediate parent of the file is
-    # the interface
-    if path.parent.name == meta['interface']:
-        master_name = path.parent.parent.name
-        if master_name in ['ics', 'tcs', 'clip']:
-            meta['master_name'] = master_name
+    _infer_master_name(path, meta)
     return meta
 
 
-@register_to(_filepath_meta_parsers, 'wyatt')
-def _meta_from_wyatt_filename(file_loc):
-    """Return the meta data parsed from the Wyatt filename."""
-
-    path = file_loc.path
-    filename = path.name
+_re_wyatt_file = re.compile(
+    r'^(?P<interface>wyatt)'
+    r'_(?P<ut>\d{4}-\d{2}-\d{2})'
+    r'_(?P<obsnum>\d+)_(?P<subobsnum>\d+)_(?P<scannum>\d+)'
+    r'\.(?P<fileext>.+)$')
 
-    re_wyatt_file = (
-        r'^(?P<interface>wyatt)'
-        r'_(?P<ut>\d{4}-\d{2}-\d{2})'
-        r'_(?P<obsnum>\d+)_(?P<subobsnum>\d+)_(?P<scannum>\d+)'
-        r'\.(?P<fileext>.+)$')
 
-    def parse_ut(v):
-        result = Time(
-            datetime.strptime(v, '%Y-%m-%d'),
-            scale='utc')
-        result.format = 'isot'
-        return result
+@_register_parser('wyatt', ('wyatt', ))
+def _meta_from_wyatt_filename(path):
+    """Return the meta data parsed from the Wyatt filename."""
 
     type_dispatcher = {
         'obsnum': int,
         'subobsnum': int,
         'scannum': int,
-        'ut': parse_ut,
+        'ut': _parse_ut_dash,
         'fileext': lambda s: s.lower()
         }
 
     meta = dict_from_regex_match(
-            re_wyatt_file, filename, type_dispatcher)
+            _re_wyatt_file, path.name, type_dispatcher)
     if meta is None:
         return None
 
     # add more items to the meta
-    meta['file_loc'] = file_loc
     meta['interface'] = 'wyatt'
     meta['instru'] = 'wyatt'
     meta['master_name'] = 'ics'
@@ -136,42 +147,31 @@ def _meta_from_wyatt_filename(file_loc):
     return meta
 
 
+_re_hk_file = re.compile(
+    r'^(?P<interface>toltec_hk)'
+    r'_(?P<ut>\d{4}-\d{2}-\d{2})'
+    r'_(?P<obsnum>\d+)_(?P<subobsnum>\d+)_(?P<scannum>\d+)'
+    r'\.(?P<fileext>.+)$')
 
-@register_to(_filepath_meta_parsers, 'toltec_hk')
-def _meta_from_hk_filename(file_loc):
-    """Return the meta data parsed from the HK filename."""
-
-    path = file_loc.path
-    filename = path.name
-
-    re_hk_file = (
-        r'^(?P<interface>toltec_hk)'
-        r'_(?P<ut>\d{4}-\d{2}-\d{2})'
-        r'_(?P<obsnum>\d+)_(?P<subobsnum>\d+)_(?P<scannum>\d+)'
-        r'\.(?P<fileext>.+)$')
 
-    def parse_ut(v):
-        result = Time(
-            datetime.strptime(v, '%Y-%m-%d'),
-            scale='utc')
-        result.format = 'isot'
-        return result
+@_register_parser('toltec_hk', ('toltec', ))
+def _meta_from_hk_filename(path):
+    """Return the meta data parsed from the HK filename."""
 
     type_dispatcher = {
         'obsnum': int,
         'subobsnum': int,
         'scannum': int,
-        'ut': parse_ut,
+        'ut': _parse_ut_dash,
         'fileext': lambda s: s.lower()
         }
 
     meta = dict_from_regex_match(
-            re_hk_file, filename, type_dispatcher)
+            _re_hk_file, path.name, type_dispatcher)
     if meta is None:
         return None
 
     # add more items to the meta
-    meta['file_loc'] = file_loc
     meta['interface'] = 'hk'
     meta['instru'] = 'toltec'
     meta['master_name'] = 'ics'
@@ -179,141 +179,142 @@ def _meta_from_hk_filename(file_loc):
     return meta
 
 
-@register_to(_filepath_meta_parsers, 'hwpr')
-def _meta_from_hwpr_filename(file_loc):
-    """Return the meta data parsed from the HWPR filename."""
+_re_hwpr_file = re.compile(
+    r'^(?P<interface>hwpr)'
+    r'_(?P<obsnum>\d+)_(?P<subobsnum>\d+)_(?P<scannum>\d+)'
+    r'_(?P<ut>\d{4}_\d{2}_\d{2}(?:_\d{2}_\d{2}_\d{2}))'
+    r'(?:_(?P<filesuffix>[^\/.]+))?'
+    r'\.(?P<fileext>.+)$')
 
-    path = file_loc.path
-    filename = path.name
 
-    re_hwpr_file = (
-        r'^(?P<interface>hwpr)'
-        r'_(?P<obsnum>\d+)_(?P<subobsnum>\d+)_(?P<scannum>\d+)'
-        r'_(?P<ut>\d{4}_\d{2}_\d{2}(?:_\d{2}_\d{2}_\d{2}))'
-        r'(?:_(?P<filesuffix>[^\/.]+))?'
-        r'\.(?P<fileext>.+)$')
-
-    def parse_ut(v):
-        result = Time(
-            datetime.strptime(v, '%Y_%m_%d_%H_%M_%S'),
-            scale='utc')
-        result.format = 'isot'
-        return result
+@_register_parser('hwpr', ('hwpr', ))
+def _meta_from_hwpr_filename(path):
+    """Return the meta data parsed from the HWPR filename."""
 
     type_dispatcher = {
         'obsnum': int,
         'subobsnum': int,
         'scannum': int,
-        'ut': parse_ut,
+        'ut': _parse_ut_underscore,
         'fileext': lambda s: s.lower()
         }
 
     meta = dict_from_regex_match(
-            re_hwpr_file, filename, type_dispatcher)
+            _re_hwpr_file, path.name, type_dispatcher)
     if meta is None:
         return None
 
     # add more items to the meta
-    meta['file_loc'] = file_loc
     meta['interface'] = 'hwpr'
     meta['instru'] = 'toltec'
     meta['filesuffix'] = ''
-
-    # one can infer the master if the immediate parent of the file is
-    # the interface
-    if path.parent.name == meta['interface']:
-        master_name = path.parent.parent.name
-        if master_name in ['ics', 'tcs', 'clip']:
-            meta['master_name'] = master_name
-
+    _infer_master_name(path, meta)
     return meta
 
 
+_re_lmt_tel_file = re.compile(
+    r'^(?P<interface>tel_\w+)'
+    r'_(?P<ut>\d{4}-\d{2}-\d{2})'
+    r'_(?P<obsnum>\d+)_(?P<subobsnum>\d+)_(?P<scannum>\d+)'
+    r'\.(?P<fileext>.+)$')
 
-@register_to(_filepath_meta_parsers, 'lmt_tel')
-def _meta_from_lmt_tel_filename(file_loc):
-    """Return the meta data parsed from the LMT telescope filename."""
-
-    path = file_loc.path
-    filename = path.name
-
-    re_lmt_tel_file = (
-        r'^(?P<interface>tel_\w+)'
-        r'_(?P<ut>\d{4}-\d{2}-\d{2})'
-        r'_(?P<obsnum>\d+)_(?P<subobsnum>\d+)_(?P<scannum>\d+)'
-        r'\.(?P<fileext>.+)$')
 
-    def parse_ut(v):
-        result = Time(
-            datetime.strptime(v, '%Y-%m-%d'),
-            scale='utc')
-        result.format = 'isot'
-        return result
+@_register_parser('lmt_tel', ('tel', ))
+def _meta_from_lmt_tel_filename(path):
+    """Return the meta data parsed from the LMT telescope filename."""
 
     type_dispatcher = {
         'obsnum': int,
         'subobsnum': int,
         'scannum': int,
-        'ut': parse_ut,
+        'ut': _parse_ut_dash,
         'fileext': lambda s: s.lower(),
         'interface': lambda s: ('lmt' if s in ['tel', 'tel_toltec'] else 'tel2')
         }
 
     meta = dict_from_regex_match(
-            re_lmt_tel_file, filename, type_dispatcher)
+            _re_lmt_tel_file, path.name, type_dispatcher)
     if meta is None:
         return None
 
     # add more items to the meta
-    meta['file_loc'] = file_loc
     meta['instru'] = 'lmt'
     meta['master_name'] = 'tcs'
     meta['filesuffix'] = ''
     return meta
 
 
-@register_to(_filepath_meta_parsers, 'tolteca.simu')
-def _meta_from_simu_filename(file_loc):
-    """Return the meta data parsed from the tolteca.simu results."""
-
-    path = file_loc.path
-    filename = path.name
+_re_simu_file = re.compile(
+    r'^(?P<interface>tel|apt)_(?P<obsnum>\d+)_'
+    r'(?P<subobsnum>\d+)_(?P<scannum>\d+)_'
+    r'(?P<ut>\d{4}_\d{2}_\d{2}(?:_\d{2}_\d{2}_\d{2}))'
+    r'\.(?P<fileext>.+)$')
 
-    re_simu = re.compile(
-        r'^(?P<interface>tel|apt)_(?P<obsnum>\d+)_'
-        r'(?P<subobsnum>\d+)_(?P<scannum>\d+)_'
-        r'(?P<ut>\d{4}_\d{2}_\d{2}(?:_\d{2}_\d{2}_\d{2}))'
-        r'\.(?P<fileext>.+)$')
 
-    def parse_ut(v):
-        result = Time(
-            datetime.strptime(v, '%Y_%m_%d_%H_%M_%S'),
-            scale='utc')
-        result.format = 'isot'
-        return result
+@_register_parser('tolteca.simu', ('tel', 'apt'))
+def _meta_from_simu_filename(path):
+    """Return the meta data parsed from the tolteca.simu results."""
 
     type_dispatcher = {
         'obsnum': int,
         'subobsnum': int,
         'scannum': int,
-        'ut': parse_ut,
+        'ut': _parse_ut_underscore,
         'fileext': lambda s: s.lower(),
         'interface': lambda s: ('lmt' if s == 'tel' else s)
         }
 
     meta = dict_from_regex_match(
-            re_simu, filename, type_dispatcher)
+            _re_simu_file, path.name, type_dispatcher)
     if meta is None:
         return None
 
     # add more items to the meta
-    meta['file_loc'] = file_loc
     meta['instru'] = 'tolteca.simu'
     meta['filesuffix'] = ''
     return meta
 
 
-def meta_from_source(source):
+_re_filename_prefix = re.compile(r'^([a-z]+)')
+
+
+@functools.lru_cache(maxsize=None)
+def _get_filename_parsers(prefix):
+    """Return the parsers to try for filenames with `prefix`."""
+    result = [
+        parser for label, parser in _filepath_meta_parsers.items()
+        if prefix in _filepath_meta_parser_prefixes.get(label, (prefix, ))
+        ]
+    if not result:
+        # try all parsers
+        result = list(_filepath_meta_parsers.values())
+    return result
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _meta_from_filepath(filepath):
+    """Return the meta data parsed from `filepath`, or None if failed.
+
+    The parsers are dispatched by the prefix of the filename, and the
+    results are cached.
+    """
+    path = PurePosixPath(filepath)
+    m = _re_filename_prefix.match(path.name)
+    prefix = m.group(1) if m is not None else ''
+    for parser in _get_filename_parsers(prefix):
+        meta = parser(path)
+        if meta is not None:
+            return meta
+    return None
+
+
+def _make_ut_time(ut):
+    result = Time(ut, scale='utc')
+    result.format = 'isot'
+    return result
+
+
+def meta_from_source(source, ut_as_time=True):
     """Extract meta data from `source` according to the file naming
     conventions.
 
@@ -321,27 +322,40 @@ def meta_from_source(source):
     ----------
     source : str, `~pathlib.Path`, `~tollan.utils.FileLoc`
         The location of the file.
+    ut_as_time : bool
+        If True, the ut is returned as `~astropy.time.Time`, otherwise
+        `~datetime.datetime`, which is much cheaper to create.
     """
 
     file_loc = fileloc(source)
-    for type_, parser in _filepath_meta_parsers.items():
-        meta = parser(file_loc)
-        if meta is None:
-            continue
-        break
+    meta = _meta_from_filepath(file_loc.path.as_posix())
     if meta is None:
         raise ValueError(f"unable to parse meta from source {source}")
+    # the cached meta is shared so we make a copy
+    meta = dict(meta, file_loc=file_loc)
+    if ut_as_time:
+        meta['ut'] = _make_ut_time(meta['ut'])
     return meta
 
 
 class ToltecDataFileStore(object):
     """A helper class to work with directories that store the
     TolTEC data files.
+
+    Parameters
+    ----------
+    root : str, `~pathlib.Path`, `~tollan.utils.FileLoc`
+        The root directory.
+    index_path : str, `~pathlib.Path`, optional
+        The path of the SQLite file index. If None, the index is kept
+        in memory.
     """
     logger = get_logger()
 
-    def __init__(self, root):
+    def __init__(self, root, index_path=None):
         self._root_loc = fileloc(root)
+        self._index_path = index_path
+        self._index = None
 
     @property
     def rootpath(self):
@@ -350,3 +364,35 @@ class ToltecDataFileStore(object):
     @property
     def is_local(self):
         return self._root_loc.is_local
+
+    @property
+    def index(self):
+        """The `ToltecDataFileIndex` of the files in the store."""
+        if self._index is None:
+            if not self.is_local:
+                raise ValueError(
+                    "file index is not available for remote data store.")
+            self._index = ToltecDataFileIndex(
+                self.rootpath, index_path=self._index_path)
+        return self._index
+
+    def update_index(self, full=False):
+        """Update the file index.
+
+        See :meth:`ToltecDataFileIndex.update` for details.
+        """
+        return self.index.update(full=full)
+
+    def query_files(self, update=True, **kwargs):
+        """Return the file entries found in the file index.
+
+        Parameters
+        ----------
+        update : bool
+            If True, the index is updated before the query.
+        **kwargs :
+            The query arguments passed to :meth:`ToltecDataFileIndex.query`.
+        """
+        if update:
+            self.update_index()
+        return self.index.query(**kwargs)
@@ -0,0 +1,292 @@
+#! /usr/bin/env python
+
+"""
+This module provides a persistent index of the TolTEC data files.
+
+"""
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from tollan.utils.log import get_logger, timeit
+
+
+__all__ = ['ToltecDataFileIndex', ]
+
+
+class ToltecDataFileIndex(object):
+    """A SQLite index of the data files in a directory tree.
+
+    The files are identified with :func:`meta_from_source`, and the
+    entries are updated incrementally: only directories whose mtime
+    has changed since the last update are listed.
+
+    Note that the mtime of a directory only changes when entries are
+    added to or removed from it, so the size and mtime of files that
+    are being written may be outdated until ``update(full=True)``.
+
+    Parameters
+    ----------
+    rootpath : str, `pathlib.Path`
+        The root directory of the data files.
+    index_path : str, `pathlib.Path`, optional
+        The path of the SQLite database. If None, the index is kept in
+        memory. The database file can be shared by multiple processes,
+        in which case typically only one of them updates the index.
+    """
+
+    logger = get_logger()
+
+    _file_columns = [
+        ('path', 'TEXT PRIMARY KEY'),
+        ('dirpath', 'TEXT'),
+        ('interface', 'TEXT'),
+        ('obsnum', 'INTEGER'),
+        ('subobsnum', 'INTEGER'),
+        ('scannum', 'INTEGER'),
+        ('ut', 'TEXT'),
+        ('data_kind', 'TEXT'),
+        ('master_name', 'TEXT'),
+        ('filesuffix', 'TEXT'),
+        ('fileext', 'TEXT'),
+        ('mtime', 'REAL'),
+        ('size', 'INTEGER'),
+        ]
+
+    def __init__(self, rootpath, index_path=None):
+        self._rootpath = Path(rootpath)
+        self._index_path = index_path
+        if index_path is None:
+            index_path = ':memory:'
+        else:
+            Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+        # the connection is shared by the threads and guarded by the lock
+        self._conn = sqlite3.connect(
+            str(index_path), check_same_thread=False, timeout=30.)
+        if self._index_path is not None:
+            # allow the processes sharing the index file to query while
+            # it is being updated.
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        self._lock = threading.RLock()
+        self._create_tables()
+
+    @property
+    def rootpath(self):
+        return self._rootpath
+
+    @property
+    def index_path(self):
+        return self._index_path
+
+    def _create_tables(self):
+        cols = ', '.join(f'{n} {t}' for n, t in self._file_columns)
+        with self._lock, self._conn:
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS files ({cols})')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS dirs '
+                '(path TEXT PRIMARY KEY, parent TEXT, mtime REAL)')
+            for cols in [
+                    ('obsnum', ),
+                    ('interface', 'obsnum'),
+                    ('data_kind', 'obsnum'),
+                    ('dirpath', ),
+                    ]:
+                name = '_'.join(cols)
+                self._conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS files_{name} '
+                    f'ON files ({", ".join(cols)})')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _data_kind_to_str(data_kind):
+        if data_kind is None:
+            return None
+        return f'{data_kind.__class__.__name__}.{data_kind.name}'
+
+    def _make_file_entry(self, entry):
+        from .toltec import meta_from_source
+        try:
+            meta = meta_from_source(entry.path, ut_as_time=False)
+        except ValueError:
+            return None
+        st = entry.stat()
+        ut = meta.get('ut', None)
+        return (
+            entry.path,
+            os.path.dirname(entry.path),
+            meta.get('interface', None),
+            meta.get('obsnum', None),
+            meta.get('subobsnum', None),
+            meta.get('scannum', None),
+            None if ut is None else ut.isoformat(),
+            self._data_kind_to_str(meta.get('data_kind', None)),
+            meta.get('master_name', None),
+            meta.get('filesuffix', None),
+            meta.get('fileext', None),
+            st.st_mtime,
+            st.st_size,
+            )
+
+    def update(self, full=False):
+        """Update the index.
+
+        Parameters
+        ----------
+        full : bool
+            If True, all directories are listed regardless of their mtime.
+
+        Returns
+        -------
+        int
+            The number of directories listed.
+        """
+        with self._lock, timeit(f"update file index of {self.rootpath}"):
+            with self._conn:
+                n_dirs = self._update_dir(
+                    os.fspath(self.rootpath), None, full=full)
+        self.logger.debug(f"listed {n_dirs} directories")
+        return n_dirs
+
+    def _update_dir(self, path, parent, full=False):
+        conn = self._conn
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            self._remove_dir(path)
+            return 0
+        row = conn.execute(
+            'SELECT mtime FROM dirs WHERE path = ?', (path, )).fetchone()
+        if row is not None and row[0] == mtime and not full:
+            # the entries are not changed, but the sub directories
+            # may have changed.
+            n_dirs = 0
+            for subpath, in conn.execute(
+                    'SELECT path FROM dirs WHERE parent = ?',
+                    (path, )).fetchall():
+                n_dirs += self._update_dir(subpath, path, full=full)
+            return n_dirs
+        # list the directory
+        file_entries = list()
+        subpaths = list()
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    subpaths.append(entry.path)
+                elif entry.is_file():
+                    e = self._make_file_entry(entry)
+                    if e is not None:
+                        file_entries.append(e)
+        # replace the file entries of this directory
+        conn.execute('DELETE FROM files WHERE dirpath = ?', (path, ))
+        conn.executemany(
+            f'INSERT INTO files VALUES '
+            f'({", ".join("?" * len(self._file_columns))})',
+            file_entries)
+        # remove the sub directories that no longer exist
+        subpaths_set = set(subpaths)
+        for subpath, in conn.execute(
+                'SELECT path FROM dirs WHERE parent = ?',
+                (path, )).fetchall():
+            if subpath not in subpaths_set:
+                self._remove_dir(subpath)
+        conn.execute(
+            'INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)',
+            (path, parent, mtime))
+        n_dirs = 1
+        for subpath in subpaths:
+            n_dirs += self._update_dir(subpath, path, full=full)
+        return n_dirs
+
+    def _remove_dir(self, path):
+        conn = self._conn
+        for subpath, in conn.execute(
+                'SELECT path FROM dirs WHERE parent = ?',
+                (path, )).fetchall():
+            self._remove_dir(subpath)
+        conn.execute('DELETE FROM files WHERE dirpath = ?', (path, ))
+        conn.execute('DELETE FROM dirs WHERE path = ?', (path, ))
+
+    def query(
+            self, obsnum=None, subobsnum=None, scannum=None,
+            interface=None, data_kind=None, master_name=None, subdir=None):
+        """Return the list of file entries that match the given values.
+
+        Parameters
+        ----------
+        obsnum : int, tuple, optional
+            The obsnum, or the inclusive (min, max) range of obsnum.
+            The min or max can be None.
+        subobsnum, scannum : int, optional
+            The subobsnum and scannum.
+        interface : str, list, optional
+            The interface or a list of interfaces.
+        data_kind : `~enum.Flag`, optional
+            The data kind, e.g., ``KidsDataKind.RawSweep``, which matches
+            all the data kinds included in the flag.
+        master_name : str, optional
+            The master name.
+        subdir : str, `pathlib.Path`, optional
+            The directory relative to the root directory. Only the files
+            in it and its sub directories are returned.
+
+        Returns
+        -------
+        list
+            The list of dicts of the file entries, sorted by path.
+        """
+        where = list()
+        args = list()
+        if isinstance(obsnum, (tuple, list)):
+            obsnum_min, obsnum_max = obsnum
+            if obsnum_min is not None:
+                where.append('obsnum >= ?')
+                args.append(obsnum_min)
+            if obsnum_max is not None:
+                where.append('obsnum <= ?')
+                args.append(obsnum_max)
+        elif obsnum is not None:
+            where.append('obsnum = ?')
+            args.append(obsnum)
+        for name, value in [
+                ('subobsnum', subobsnum),
+                ('scannum', scannum),
+                ('master_name', master_name),
+                ]:
+            if value is not None:
+                where.append(f'{name} = ?')
+                args.append(value)
+        if subdir is not None:
+            path = os.fspath(self.rootpath.joinpath(subdir))
+            # escape the wildcards of LIKE in the path
+            prefix = path.replace(
+                '\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            where.append("(dirpath = ? OR dirpath LIKE ? ESCAPE '\\')")
+            args.extend([path, prefix + os.sep + '%'])
+        if interface is not None:
+            if isinstance(interface, str):
+                interface = [interface]
+            where.append(f'interface IN ({", ".join("?" * len(interface))})')
+            args.extend(interface)
+        if data_kind is not None:
+            kinds = [
+                self._data_kind_to_str(k)
+                for k in data_kind.__class__.__members__.values()
+                if k and (k & data_kind) == k
+                ]
+            where.append(f'data_kind IN ({", ".join("?" * len(kinds))})')
+            args.extend(kinds)
+        sql = 'SELECT * FROM files'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY path'
+        names = [n for n, _ in self._file_columns]
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [dict(zip(names, row)) for row in rows]
@@ -12,14 +12,14 @@ from astropy.table import QTable
 import astropy.units as u
 import functools
 from abc import ABCMeta
-from collections import defaultdict
+from collections import ChainMap, defaultdict
 from tollan.utils.fmt import pformat_dict, pformat_fancy_index
 import warnings
 import kidsproc.kidsdata as kd
 from tollan.utils.np import to_complex
 from tollan.utils.nc import ncstr
 from astropy.nddata import StdDevUncertainty
-from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 
 
 __all__ = ['NcFileIO', ]
@@ -237,6 +237,285 @@ def identify_toltec_nc_file(filepath):
     return True
 
 
+def plan_tone_reads(tone_slice, n_tones, max_gap=16, min_density=0.5):
+    """Return the list of contiguous reads to load the tones in `tone_slice`.
+
+    Parameters
+    ----------
+    tone_slice : int, slice, array_like
+        The tone selection, which can be an index, a slice, a boolean
+        mask, or an array of indices.
+    n_tones : int
+        The number of tones in the file.
+    max_gap : int
+        Runs of selected tones separated by no more than `max_gap`
+        unselected tones are merged into one read.
+    min_density : float
+        If the fraction of selected tones in the bounding range is no
+        less than `min_density`, the bounding range is read at once.
+
+    Returns
+    -------
+    list
+        The list of ``(start, stop, sel)``, where ``start:stop`` is
+        the range of tones to read, and `sel` is the index array of the
+        selected tones relative to `start`, or None if all tones in the
+        range are selected.
+    """
+    if tone_slice is None:
+        tone_slice = slice(None)
+    if isinstance(tone_slice, slice):
+        start, stop, step = tone_slice.indices(n_tones)
+        if step == 1:
+            if stop <= start:
+                return list()
+            return [(start, stop, None)]
+    index = np.arange(n_tones)[tone_slice]
+    index = np.atleast_1d(index)
+    if index.size == 0:
+        return list()
+    start, stop = index.min(), index.max() + 1
+    d_index = np.diff(index)
+    if np.any(d_index <= 0) or index.size >= min_density * (stop - start):
+        # read the bounding range and select in memory. This also handles
+        # unsorted or repeated indices.
+        if index.size == stop - start and np.all(d_index == 1):
+            return [(start, stop, None)]
+        return [(start, stop, index - start)]
+    # split into runs at the large gaps
+    breaks = np.where(d_index > max_gap + 1)[0] + 1
+    result = list()
+    for run in np.split(index, breaks):
+        r0, r1 = run[0], run[-1] + 1
+        sel = None if run.size == r1 - r0 else run - r0
+        result.append((r0, r1, sel))
+    return result
+
+
+def read_tone_sliced(var, sample_slice, tone_slice, tone_major=True):
+    """Read the data of `var` for the given sample and tone selections.
+
+    The tone selection is converted to a small number of contiguous reads
+    with :func:`plan_tone_reads`, which avoids the slow fancy indexing
+    in the netCDF library.
+
+    Parameters
+    ----------
+    var : `netCDF4.Variable`
+        The variable of shape (n_samples, n_tones).
+    sample_slice : slice
+        The sample selection.
+    tone_slice : int, slice, array_like
+        The tone selection.
+    tone_major : bool
+        If True, the returned array is of shape (n_tones, n_samples).
+        Otherwise it is of shape (n_samples, n_tones).
+
+    Returns
+    -------
+    `numpy.ndarray`
+        The C-contiguous data array. A masked array is returned if any
+        of the data are masked.
+    """
+    n_tones = var.shape[1]
+    reads = plan_tone_reads(tone_slice, n_tones)
+    n_out = sum(
+        (r1 - r0) if sel is None else len(sel) for r0, r1, sel in reads)
+    n_samples = len(range(*sample_slice.indices(var.shape[0])))
+    shape = (n_out, n_samples) if tone_major else (n_samples, n_out)
+    out = None
+    mask = None
+    i = 0
+    for r0, r1, sel in reads:
+        d = var[sample_slice, r0:r1]
+        if sel is not None:
+            d = d[:, sel]
+        if tone_major:
+            d = d.T
+        if out is None:
+            out = np.empty(shape, dtype=d.dtype)
+        n = d.shape[0] if tone_major else d.shape[1]
+        if tone_major:
+            sl = (slice(i, i + n), )
+        else:
+            sl = (slice(None), slice(i, i + n))
+        out[sl] = np.ma.getdata(d)
+        if np.ma.is_masked(d):
+            if mask is None:
+                mask = np.zeros(shape, dtype=bool)
+            mask[sl] = np.ma.getmaskarray(d)
+        i += n
+    if out is None:
+        out = np.empty(shape, dtype=var.dtype)
+    if isinstance(tone_slice, (int, np.integer)):
+        out = out[0] if tone_major else out[:, 0]
+        if mask is not None:
+            mask = mask[0] if tone_major else mask[:, 0]
+    if mask is not None:
+        return np.ma.array(out, mask=mask)
+    return out
+
+
+def memmap_nc_var(filepath, var):
+    """Return a `numpy.memmap` of the netCDF variable `var`.
+
+    This is only possible for variables in a local netCDF4 (HDF5) file,
+    which are stored contiguously without filters or scaling. None is
+    returned otherwise, and the caller should fall back to reading the
+    variable with netCDF4.
+
+    Variables with an unlimited dimension are always chunked in HDF5, so
+    the raw timestream files, which have an unlimited time dimension,
+    always take the fallback path.
+
+    Note that the fill values are not masked in the returned array.
+
+    Parameters
+    ----------
+    filepath : str, `pathlib.Path`
+        The path of the netCDF file.
+    var : `netCDF4.Variable`
+        The variable to map.
+    """
+    nc = var.group()
+    if not nc.data_model.startswith('NETCDF4'):
+        return None
+    if var.chunking() != 'contiguous':
+        return None
+    if any(v for v in (var.filters() or dict()).values()):
+        return None
+    if any(
+            a in var.ncattrs()
+            for a in ('scale_factor', 'add_offset')):
+        return None
+    try:
+        import h5py
+    except ImportError:
+        return None
+    h5path = f"{nc.path.rstrip('/')}/{var.name}"
+    with h5py.File(filepath, 'r') as f:
+        ds = f[h5path]
+        offset = ds.id.get_offset()
+        shape = ds.shape
+        dtype = ds.dtype
+    if offset is None or 0 in shape:
+        # no storage allocated
+        return None
+    return np.memmap(
+        filepath, mode='r', dtype=dtype, offset=offset, shape=shape,
+        order='C')
+
+
+class NcVarToneMajorView(object):
+    """A lazy tone-major view of a netCDF variable of shape
+    (n_samples, n_tones).
+
+    The data are only read for the window specified by the indexing
+    of this view, via :func:`read_tone_sliced`.
+
+    Parameters
+    ----------
+    var : `netCDF4.Variable`
+        The variable to view.
+    """
+
+    def __init__(self, var):
+        self._var = var
+
+    @property
+    def shape(self):
+        return self._var.shape[::-1]
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def dtype(self):
+        return self._var.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, )
+        if len(key) > 2:
+            raise IndexError("too many indices for tone-major view.")
+        tone_slice, sample_slice = (key + (slice(None), ))[:2]
+        if isinstance(sample_slice, (int, np.integer)):
+            if sample_slice < 0:
+                sample_slice += self.shape[1]
+            result = read_tone_sliced(
+                self._var, slice(sample_slice, sample_slice + 1),
+                tone_slice)
+            return result[..., 0]
+        if not isinstance(sample_slice, slice):
+            raise IndexError("sample index of the view can only be slice.")
+        return read_tone_sliced(self._var, sample_slice, tone_slice)
+
+    def __array__(self, dtype=None):
+        result = self[:, :]
+        if dtype is not None:
+            result = result.astype(dtype)
+        return result
+
+
+def reduce_sweep_steps(data, sample_start, sample_end, dtype='f8'):
+    """Return the mean and standard deviation of `data` for each sweep step.
+
+    Parameters
+    ----------
+    data : list of `numpy.ndarray`
+        The data arrays of shape (n_samples, n_chans), which are reduced
+        together.
+    sample_start : array_like
+        The start sample indices of the sweep steps.
+    sample_end : array_like
+        The end sample indices (exclusive) of the sweep steps.
+    dtype : str, `numpy.dtype`
+        The dtype used to accumulate the sums.
+
+    Returns
+    -------
+    mean, std : list of `numpy.ndarray`
+        The arrays of shape (n_chans, n_steps) for each item in `data`.
+    """
+    # The data are stored with the sample axis first in the files. The
+    # sums for each step are computed over the contiguous block of rows,
+    # which is much faster than `np.add.reduceat` along the sample axis,
+    # or transposing the data to make the sample axis contiguous.
+    dtype = np.dtype(dtype)
+    sample_start = np.asarray(sample_start, dtype=int)
+    sample_end = np.asarray(sample_end, dtype=int)
+    n_steps = len(sample_start)
+    n = (sample_end - sample_start).astype(dtype)
+    data = [np.ma.getdata(d) for d in data]
+    s1 = [np.zeros((n_steps, d.shape[1]), dtype=dtype) for d in data]
+    s2 = [np.zeros_like(a) for a in s1]
+    # the first sample of each channel is subtracted so the sums of
+    # squares do not lose precision to the large DC values.
+    x0 = [d[:1].astype(dtype) for d in data]
+    for i, (i0, i1) in enumerate(zip(sample_start, sample_end)):
+        for d, dc, a1, a2 in zip(data, x0, s1, s2):
+            x = d[i0:i1].astype(dtype)
+            x -= dc
+            np.add.reduce(x, axis=0, out=a1[i])
+            a2[i] = np.einsum('ij,ij->j', x, x)
+    mean = list()
+    std = list()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for dc, a1, a2 in zip(x0, s1, s2):
+            m = a1 / n[:, np.newaxis]
+            v = np.maximum(a2 / n[:, np.newaxis] - m ** 2, 0)
+            # empty steps
+            m[n <= 0] = np.nan
+            v[n <= 0] = np.nan
+            mean.append((m + dc).T)
+            std.append(np.sqrt(v).T)
+    return mean, std
+
+
 class NcFileIO(DataFileIO, _NcFileIOKidsDataAxisSlicerMixin):
     """A class to read data from TolTEC netCDF files.
 
@@ -253,6 +532,9 @@ class NcFileIO(DataFileIO, _NcFileIOKidsDataAxisSlicerMixin):
     auto_close_on_pickle : bool
         If True, the dataset is automatically closed when pickling.
         This is ignored if `source` is None.
+    sweep_reduce_dtype : str, `numpy.dtype`
+        The dtype used to accumulate the samples when reducing raw sweep
+        data to sweep steps. Use "f4" to trade accuracy for speed.
     """
 
     logger = get_logger()
@@ -380,12 +662,16 @@ class NcFileIO(DataFileIO, _NcFileIOKidsDataAxisSlicerMixin):
 
     def __init__(
             self, source=None, open_=True, load_meta_on_open=True,
-            auto_close_on_pickle=True
+            auto_close_on_pickle=True, sweep_reduce_dtype='f8'
             ):
         source = self._normalize_file_loc(source)
         self._source = source
         self._load_meta_on_open = load_meta_on_open
         self._auto_close_on_pickle = auto_close_on_pickle
+        self._sweep_reduce_dtype = np.dtype(sweep_reduce_dtype)
+        # caches for the pandas queries on the axis tables
+        self._axis_df_cache = dict()
+        self._axis_query_cache = dict()
         # setup the mapper for read meta data
         self._node_mappers = self._create_node_mappers(self._node_maps)
         # init the exit stack
@@ -441,6 +727,8 @@ class NcFileIO(DataFileIO, _NcFileIOKidsDataAxisSlicerMixin):
                     _open_sub_node(v)
 
         _open_sub_node(self.node_mappers)
+        # the file content may have changed since last open
+        self._clear_axis_query_cache()
         # trigger loading the meta on open if requested
         if self._load_meta_on_open:
             _ = self.meta  # noqa: F841
@@ -516,6 +804,7 @@ class NcFileIO(DataFileIO, _NcFileIOKidsDataAxisSlicerMixin):
     def _reset_instance_state(self):
         """Reset the instance state."""
         self._meta_cached.clear()
+        self._clear_axis_query_cache()
 
     @cached_property
     def data_kind(self):
@@ -855,6 +1144,161 @@ class NcFileIO(DataFileIO, _NcFileIOKidsDataAxisSlicerMixin):
             slicer = getattr(slicer, f'{t}_loc')(arg)
         return self._read_sliced(slicer)
 
+    def iter_chunks(self, chunk_len, tone=None, overlap=0, prefetch=True):
+        """Iterate over the timestream data in chunks of `chunk_len`.
+
+        The slice plan is resolved once, and the next chunk is read in a
+        background thread while the current one is being processed. Note
+        that the dataset should not be accessed by other threads during
+        the iteration.
+
+        Parameters
+        ----------
+        chunk_len : int, `astropy.units.Quantity`
+            The number of samples, or the time length of each chunk.
+        tone : optional
+            The tone selection, which is passed to :meth:`tone_loc`.
+        overlap : int, `astropy.units.Quantity`
+            The number of samples, or the time length of data from the
+            next chunk to be included in each chunk.
+        prefetch : bool
+            If True, read the next chunk in a background thread.
+
+        Yields
+        ------
+        `kidsproc.kidsdata.TimeStream`
+            The timestream of the chunk. The sample range of the chunk
+            is stored in the meta as ``sample_slice``.
+        """
+        if 'time' not in self.axis_types:
+            raise ValueError(
+                f"chunk iteration is not available for {self.data_kind}")
+        fsmp_Hz = self.meta['fsmp']
+
+        def _to_n_samples(n):
+            if isinstance(n, u.Quantity):
+                return int(np.round(n.to_value(u.s) * fsmp_Hz))
+            return int(n)
+
+        chunk_len = _to_n_samples(chunk_len)
+        overlap = _to_n_samples(overlap)
+        if chunk_len <= 0 or overlap < 0:
+            raise ValueError("invalid chunk length or overlap.")
+
+        slicer = self.block_loc(None)
+        if tone is not None:
+            slicer = slicer.tone_loc(tone)
+        s = self._resolve_slice(slicer)
+        data_kind = self.data_kind
+        meta = ChainMap(dict(), self.meta)
+        meta.update(s)
+        tone_slice = s['tone_slice']
+        tones = s['tone_axis_data']['f_tone']
+        data_vars = dict()
+        for k, m in self.node_mappers['data'].items():
+            if data_kind & k:
+                for key in m.nc_node_map.keys():
+                    data_vars[key] = m.getvar(key)
+        # the psd info are per file so are loaded only once.
+        if data_kind & KidsDataKind.SolvedTimeStream:
+            m = self.node_mappers['data_extra']['psd']
+            for key in m.nc_node_map.keys():
+                if m.hasvar(key):
+                    v = m.getvar(key)
+                    if len(v.shape) == 1:
+                        meta[key] = v[:]
+                    else:
+                        meta[key] = read_tone_sliced(
+                            v, slice(None), tone_slice)
+        n_samples = next(iter(data_vars.values())).shape[0]
+        chunk_starts = range(0, n_samples, chunk_len)
+        self.logger.debug(
+            f"iterate {len(chunk_starts)} chunks of {chunk_len} samples "
+            f"with overlap={overlap}")
+
+        def _read_chunk(i0):
+            sample_slice = slice(i0, min(i0 + chunk_len + overlap, n_samples))
+            return sample_slice, {
+                key: read_tone_sliced(v, sample_slice, tone_slice)
+                for key, v in data_vars.items()
+                }
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            future = None
+            for i, i0 in enumerate(chunk_starts):
+                if executor is None:
+                    sample_slice, data = _read_chunk(i0)
+                else:
+                    if future is None:
+                        future = executor.submit(_read_chunk, i0)
+                    sample_slice, data = future.result()
+                    if i + 1 < len(chunk_starts):
+                        future = executor.submit(
+                            _read_chunk, chunk_starts[i + 1])
+                # the chunk meta shares the items with the file meta.
+                chunk_meta = meta.new_child({
+                    'sample_slice': sample_slice,
+                    'chunk_index': i,
+                    })
+                yield kd.TimeStream(meta=chunk_meta, tones=tones, **data)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    def get_data_view(self, key):
+        """Return a lazy tone-major view of the data `key`, e.g., "I".
+
+        For uncompressed contiguous variables in a local netCDF4 file,
+        a `numpy.memmap` view of shape (n_tones, n_samples) is returned,
+        which requires the optional package ``h5py``. Otherwise, a
+        `NcVarToneMajorView` is returned, which reads the data of the
+        indexed window on access.
+        """
+        data_kind = self.data_kind
+        for k, m in self.node_mappers['data'].items():
+            if data_kind & k and key in m.nc_node_map:
+                break
+        else:
+            raise ValueError(
+                f"data {key} is not available for {data_kind}")
+        var = m.getvar(key)
+        file_loc = self.file_loc
+        if file_loc is not None and file_loc.is_local:
+            data = memmap_nc_var(file_loc.path, var)
+            if data is not None:
+                self.logger.debug(f"memory map {key} of {self}")
+                return data.T
+        return NcVarToneMajorView(var)
+
+    def _eval_axis_query(self, axis_type, block_index, tbl, expr):
+        """Return the mask of the pandas query `expr` on axis table `tbl`.
+
+        The pandas dataframe of the table and the query results are cached
+        per block, and are invalidated when the file is reopened.
+        """
+        key = (axis_type, block_index, expr)
+        mask = self._axis_query_cache.get(key, None)
+        if mask is not None:
+            return mask
+        with warnings.catch_warnings():
+            # this is to supress the ufunc size warning
+            # and the numexpr
+            warnings.simplefilter("ignore")
+            df_key = (axis_type, block_index)
+            df = self._axis_df_cache.get(df_key, None)
+            if df is None:
+                df = self._axis_df_cache[df_key] = tbl.to_pandas()
+            mask = df.eval(expr).to_numpy(dtype=bool)
+        # the mask is shared by the reads so make it read-only
+        mask.flags.writeable = False
+        self._axis_query_cache[key] = mask
+        return mask
+
+    def _clear_axis_query_cache(self):
+        self._axis_df_cache.clear()
+        self._axis_query_cache.clear()
+
     def _resolve_slice(self, slicer):
         """Read the file for data specified by the `slicer`."""
 
@@ -875,26 +1319,23 @@ class NcFileIO(DataFileIO, _NcFileIOKidsDataAxisSlicerMixin):
 
         self.logger.debug(f"slicer_ops:\n{pformat_dict(ops)}")
 
+        result['block_index'] = block_index = ops['block']
+        iblock, _, _ = self._resolve_block_index(block_index)
+
         # apply the slicer ops
-        def slice_table(tbl, op):
+        def slice_table(tbl, op, axis_type):
             if op is None:
                 return tbl, slice(None, None)
             if isinstance(op, str):
                 # slice the table with pandas query
-                with warnings.catch_warnings():
-                    # this is to supress the ufunc size warning
-                    # and the numexpr
-                    warnings.simplefilter("ignore")
-                    df = tbl.to_pandas()
-                    op = df.eval(op).to_numpy(dtype=bool)
+                op = self._eval_axis_query(axis_type, iblock, tbl, op)
             tbl = tbl[op]
             tbl.meta['_slice_op'] = op
             return tbl, op
 
-        result['block_index'] = block_index = ops['block']
         tone_axis_data, tone_op = slice_table(
                 self.get_tone_axis_data(block_index=block_index),
-                ops['tone'])
+                ops['tone'], 'tone')
         # self.logger.debug(f"sliced tone axis data:\n{tone_axis_data}")
         self.logger.debug(
                 f"sliced {len(tone_axis_data)} "
@@ -910,7 +1351,7 @@ class NcFileIO(DataFileIO, _NcFileIOKidsDataAxisSlicerMixin):
             # sweep table
             sweep_axis_data, sweep_op = slice_table(
                 self.get_sweep_axis_data(block_index=block_index),
-                ops['sweep'])
+                ops['sweep'], 'sweep')
             # self.logger.debug(f"sliced sweep axis data:\n{sweep_axis_data}")
             self.logger.debug(
                 f"sliced {len(sweep_axis_data)} "
@@ -974,9 +1415,9 @@ class NcFileIO(DataFileIO, _NcFileIOKidsDataAxisSlicerMixin):
         # now that we have the tone slice and sample slice
         # we can read the data
         data_kind = self.data_kind
-        # we create a copy of meta data here to store the sliced
-        # info
-        meta = deepcopy(self.meta)
+        # we create a copy-on-write view of the meta data here to store
+        # the sliced info
+        meta = ChainMap(dict(), self.meta)
         meta.update(s)
         data = dict()
         for k, m in self.node_mappers['data'].items():
@@ -989,11 +1430,13 @@ class NcFileIO(DataFileIO, _NcFileIOKidsDataAxisSlicerMixin):
                 for key in m.nc_node_map.keys():
                     # we arrange the data so that the data
                     # tone axis is first, as required by the
-                    # kidsproc.kidsdata containers
-                    data[key] = m.getvar(key)[
-                            s['sample_slice'],
-                            s['tone_slice'],
-                            ].T
+                    # kidsproc.kidsdata containers. The raw sweep data
+                    # are kept sample-first for the reduction later.
+                    data[key] = read_tone_sliced(
+                        m.getvar(key),
+                        s['sample_slice'],
+                        s['tone_slice'],
+                        tone_major=not (data_kind & KidsDataKind.RawSweep))
 
         # for reduced sweep if may have d21 data
         if data_kind & KidsDataKind.ReducedSweep:
@@ -1036,26 +1479,21 @@ class NcFileIO(DataFileIO, _NcFileIOKidsDataAxisSlicerMixin):
                         # the psd_fs is vector so skip the slice
                         v = v[:]
                     else:
-                        v = v[:, s['tone_slice']].T
+                        v = read_tone_sliced(
+                            v, slice(None), s['tone_slice'])
                     data[key] = v
         # for the raw sweeps we do the reduction for each step
         if data_kind & KidsDataKind.RawSweep:
             sweep_axis_data = s['sweep_axis_data']
             b0 = s['sample_slice'].start  # this is the ref index
-            for k in ('I', 'Q'):
-                a = np.empty(
-                        (
-                            len(s['tone_axis_data']),
-                            len(sweep_axis_data)),
-                        dtype=float)
-                unc_a = np.empty_like(a)
-                for i, row in enumerate(sweep_axis_data):
-                    i0 = row['sample_start'] - b0
-                    i1 = row['sample_end'] - b0
-                    a[:, i] = np.mean(data[k][:, i0:i1], axis=-1)
-                    unc_a[:, i] = np.std(data[k][:, i0:i1], axis=-1)
-                data[k] = a
-                data[f'unc_{k}'] = unc_a
+            # I and Q are reduced together, in the sample-first layout
+            # as read by read_tone_sliced.
+            (data['I'], data['Q']), (data['unc_I'], data['unc_Q']) = \
+                reduce_sweep_steps(
+                    [data['I'], data['Q']],
+                    sweep_axis_data['sample_start'] - b0,
+                    sweep_axis_data['sample_end'] - b0,
+                    dtype=self._sweep_reduce_dtype)
         for k, m in self._kidsdata_obj_makers.items():
             if data_kind & k:
                 return m(self.__class__, data_kind, meta, data)
@@ -1126,7 +1564,7 @@ class NcFileIO(DataFileIO, _NcFileIOKidsDataAxisSlicerMixin):
     def _make_kidsdata_sts(cls, data_kind, meta, data):
         tones = meta['tone_axis_data']['f_tone']
         # add the psd data to the meta
-        meta = deepcopy(meta)
+        meta = ChainMap(dict(), meta)
         for k, v in data.items():
             if k.endswith("_psd"):
                 meta[k] = v
@@ -1,8 +1,16 @@
 #! /usr/bin/env python
 
-from ..fs.toltec import meta_from_source, ToltecDataFileStore
+from ..fs.toltec import (
+    meta_from_source, ToltecDataFileStore, _meta_from_filepath)
 from ..io.toltec.kidsdata import KidsDataKind
 from ...utils import get_pkg_data_path
+from tollan.utils.log import get_logger
+from astropy.time import Time
+from datetime import datetime
+import os
+import time
+
+import pytest
 
 
 def test_meta_from_source():
@@ -19,6 +27,11 @@ def test_meta_from_source():
     assert meta['obsnum'] == 10943
     assert meta['data_kind'] == KidsDataKind.TargetSweep
     assert meta['file_loc'].netloc == ''
+    assert isinstance(meta['ut'], Time)
+    assert meta['ut'].isot == '2020-07-13T22:32:19.000'
+
+    meta = meta_from_source(filepath, ut_as_time=False)
+    assert meta['ut'] == datetime(2020, 7, 13, 22, 32, 19)
 
 
 def test_meta_from_source_remote():
@@ -45,3 +58,117 @@ def test_toltec_data_file_store():
     d = ToltecDataFileStore(get_pkg_data_path())
     assert d.is_local
     assert d.rootpath.name == 'data'
+
+
+def test_toltec_data_file_store_index(tmp_path):
+    rootpath = tmp_path.joinpath('data_toltec')
+    filenames = [
+        'ics/toltec0/toltec0_010943_000_0000_2020_07_13_22_32_19_targsweep.nc',
+        'ics/toltec1/toltec1_010943_000_0000_2020_07_13_22_32_19_targsweep.nc',
+        'ics/toltec0/toltec0_010944_000_0001_2020_07_13_22_40_19_timestream.nc',
+        'tcs/toltec0/toltec0_010945_000_0001_2020_07_13_22_50_19_timestream.nc',
+        'ics/toltec0/not_a_data_file.txt',
+        ]
+    for f in filenames:
+        p = rootpath.joinpath(f)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.touch()
+    d = ToltecDataFileStore(
+        rootpath, index_path=tmp_path.joinpath('index.sqlite'))
+    assert d.update_index() == 6
+    # nothing changed so no directory is listed
+    assert d.update_index() == 0
+
+    files = d.query_files(obsnum=10943)
+    assert [f['interface'] for f in files] == ['toltec0', 'toltec1']
+    files = d.query_files(
+        obsnum=(10944, None), interface='toltec0',
+        data_kind=KidsDataKind.RawTimeStream)
+    assert [f['obsnum'] for f in files] == [10944, 10945]
+    assert files[0]['master_name'] == 'ics'
+    assert len(d.query_files(data_kind=KidsDataKind.RawSweep)) == 2
+
+    # add and remove files
+    rootpath.joinpath(filenames[1]).unlink()
+    rootpath.joinpath(
+        'ics/toltec2/toltec2_010946_000_0000_2020_07_13_23_32_19_tune.nc'
+        ).parent.mkdir()
+    rootpath.joinpath(
+        'ics/toltec2/toltec2_010946_000_0000_2020_07_13_23_32_19_tune.nc'
+        ).touch()
+    d.update_index()
+    assert [f['obsnum'] for f in d.query_files(master_name='ics')] == [
+        10943, 10944, 10946]
+
+    # the index is persistent
+    d2 = ToltecDataFileStore(
+        rootpath, index_path=tmp_path.joinpath('index.sqlite'))
+    assert len(d2.query_files(update=False)) == 4
+
+
+_filename_templates = [
+    'ics/toltec{i}/toltec{i}_{obsnum:06d}_000_{scannum:04d}_'
+    '2022_03_04_05_06_07_timestream.nc',
+    'ics/toltec{i}/toltec{i}_{obsnum:06d}_000_{scannum:04d}_'
+    '2022_03_04_05_06_07_tune.txt',
+    'ics/wyatt/wyatt_2022-03-04_{obsnum:06d}_00_{scannum:04d}.nc',
+    'ics/toltec_hk/toltec_hk_2022-03-04_{obsnum:06d}_00_{scannum:04d}.nc',
+    'tel/tel_toltec_2022-03-04_{obsnum:06d}_00_{scannum:04d}.nc',
+    'ics/hwpr/hwpr_{obsnum:06d}_000_{scannum:04d}_'
+    '2022_03_04_05_06_07.nc',
+    ]
+
+
+def _make_filepaths(n_files):
+    return [
+        '/data/data_toltec/' + _filename_templates[k % 6].format(
+            i=k % 13, obsnum=10000 + k // 1000, scannum=k % 1000)
+        for k in range(n_files)]
+
+
+def test_meta_from_filepath():
+    filepaths = _make_filepaths(12)
+    _meta_from_filepath.cache_clear()
+    metas = [_meta_from_filepath(f) for f in filepaths]
+    # the parsers are dispatched by the filename prefix
+    assert [m['interface'] for m in metas[:6]] == [
+        'toltec0', 'toltec1', 'wyatt', 'hk', 'lmt', 'hwpr']
+    assert [m['interface'] for m in metas[6:]] == [
+        'toltec6', 'toltec7', 'wyatt', 'hk', 'lmt', 'hwpr']
+    assert [m['obsnum'] for m in metas] == [10000] * 12
+    assert [m['scannum'] for m in metas] == list(range(12))
+    assert all(isinstance(m['ut'], datetime) for m in metas)
+    assert _meta_from_filepath('/data/not_a_data_file.nc') is None
+    # the results are cached
+    for f, m in zip(filepaths, metas):
+        assert _meta_from_filepath(f) is m
+    # the cached meta is not modified by meta_from_source
+    meta = meta_from_source(filepaths[0])
+    assert isinstance(meta['ut'], Time)
+    assert isinstance(_meta_from_filepath(filepaths[0])['ut'], datetime)
+
+
+@pytest.mark.skipif(
+    not os.environ.get('TOLTECA_TEST_BENCHMARK', None),
+    reason='set TOLTECA_TEST_BENCHMARK to run the benchmark')
+def test_meta_from_source_benchmark():
+    logger = get_logger()
+    n_files = 10 ** 6
+    filepaths = _make_filepaths(n_files)
+    _meta_from_filepath.cache_clear()
+    t0 = time.perf_counter()
+    metas = [_meta_from_filepath(f) for f in filepaths]
+    elapsed = time.perf_counter() - t0
+    logger.info(
+        f"parsed {n_files} filenames in {elapsed:.2f}s "
+        f"({elapsed / n_files * 1e6:.2f}us per file)")
+    assert all(m is not None for m in metas)
+    assert [m['interface'] for m in metas[:6]] == [
+        'toltec0', 'toltec1', 'wyatt', 'hk', 'lmt', 'hwpr']
+    # cached lookups
+    t0 = time.perf_counter()
+    for f, m in zip(filepaths[-1000:], metas[-1000:]):
+        assert _meta_from_filepath(f) is m
+    logger.info(
+        f"cached lookup takes "
+        f"{(time.perf_counter() - t0) / 1000 * 1e6:.2f}us per file")
@@ -2,10 +2,14 @@
 
 
 from ..io.toltec.kidsdata import (
-        NcFileIO, KidsDataKind, _KidsDataAxisSlicer)
+        NcFileIO, KidsDataKind, _KidsDataAxisSlicer, reduce_sweep_steps,
+        plan_tone_reads, read_tone_sliced, memmap_nc_var,
+        NcVarToneMajorView)
 from ...utils import get_pkg_data_path
 from tollan.utils.nc import NcNodeMapper, NcNodeMapperError
+from tollan.utils.log import get_logger
 import netCDF4
+import time
 import pytest
 import pickle
 import numpy as np
@@ -794,3 +798,184 @@ def test_nc_file_io_kids_data_slicer_vna_processed():
         assert d.frequency.shape == (10, )
         assert d.D21.shape == (10, )
         assert d.D21_cov.shape == (10, )
+
+
+def test_reduce_sweep_steps():
+    rng = np.random.default_rng(0)
+    n_tones = 20
+    # steps with gaps between them
+    sample_start = np.arange(0, 1000, 100) + 5
+    sample_end = sample_start + 90
+    I = (rng.normal(0, 10, (1000, n_tones)) + 1e6).astype('i4')  # noqa: E741
+    Q = (rng.normal(0, 10, (1000, n_tones)) - 1e6).astype('i4')
+    (I_mean, Q_mean), (I_std, Q_std) = reduce_sweep_steps(
+        [I, Q], sample_start, sample_end)
+    assert I_mean.shape == I_std.shape == (n_tones, len(sample_start))
+    for d, m, s in [(I, I_mean, I_std), (Q, Q_mean, Q_std)]:
+        for i, (i0, i1) in enumerate(zip(sample_start, sample_end)):
+            np.testing.assert_allclose(m[:, i], np.mean(d[i0:i1], axis=0))
+            np.testing.assert_allclose(
+                s[:, i], np.std(d[i0:i1], axis=0), rtol=1e-8)
+    (I_mean32, _), (I_std32, _) = reduce_sweep_steps(
+        [I, Q], sample_start, sample_end, dtype='f4')
+    assert I_mean32.dtype == np.float32
+    np.testing.assert_allclose(I_mean32, I_mean, rtol=1e-6)
+    np.testing.assert_allclose(I_std32, I_std, rtol=1e-3)
+
+
+@pytest.mark.parametrize('sweep_reduce_dtype', ['f8', 'f4'])
+def test_nc_file_io_raw_sweep_reduce_benchmark(sweep_reduce_dtype):
+
+    logger = get_logger()
+    # local file
+    filepath = get_pkg_data_path().joinpath(
+            'tests/basic_obs_data/'
+            'toltec0_011536_000_0000_2020_07_18_18_02_31_tune.nc')
+
+    with NcFileIO(source=filepath) as df:
+        swp_ref = df.read()
+    with NcFileIO(
+            source=filepath, sweep_reduce_dtype=sweep_reduce_dtype) as df:
+        t0 = time.perf_counter()
+        swp = df.read()
+        elapsed = time.perf_counter() - t0
+    logger.info(
+        f"read {swp.S21.shape} raw sweep with {sweep_reduce_dtype} "
+        f"reduction in {elapsed:.3f}s")
+    rtol = 1e-6 if sweep_reduce_dtype == 'f4' else 1e-12
+    np.testing.assert_allclose(
+        swp.S21.value, swp_ref.S21.value, rtol=rtol)
+
+
+def test_plan_tone_reads():
+    n_tones = 1000
+    assert plan_tone_reads(None, n_tones) == [(0, n_tones, None)]
+    assert plan_tone_reads(slice(10, 20), n_tones) == [(10, 20, None)]
+    assert plan_tone_reads(slice(20, 10), n_tones) == []
+    mask = np.zeros((n_tones, ), dtype=bool)
+    assert plan_tone_reads(mask, n_tones) == []
+    mask[np.r_[0:10, 500:520, 900]] = True
+    assert [r[:2] for r in plan_tone_reads(mask, n_tones)] == [
+        (0, 10), (500, 520), (900, 901)]
+    # dense selection is read as the bounding range
+    (r0, r1, sel), = plan_tone_reads(slice(10, 500, 2), n_tones)
+    assert (r0, r1) == (10, 499)
+    np.testing.assert_array_equal(sel, np.arange(0, 489, 2))
+    # unsorted indices
+    (r0, r1, sel), = plan_tone_reads([3, 1, 1], n_tones)
+    assert (r0, r1) == (1, 4)
+    np.testing.assert_array_equal(sel, [2, 0, 0])
+
+
+def test_read_tone_sliced(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.integers(-1000, 1000, size=(200, 100), dtype='i4')
+    with netCDF4.Dataset(tmp_path.joinpath('test.nc'), 'w') as nc:
+        nc.createDimension('time', None)
+        nc.createDimension('iqlen', data.shape[1])
+        v = nc.createVariable('Data.Toltec.Is', 'i4', ('time', 'iqlen'))
+        v[:] = data
+        for tone_slice in [
+                slice(None), slice(5, 80, 3), 7, [3, 1, 1],
+                np.arange(100) % 7 == 0, np.r_[0:10, 50:60, 90]]:
+            for sample_slice in [slice(None), slice(10, 150, 2)]:
+                a = read_tone_sliced(v, sample_slice, tone_slice)
+                np.testing.assert_array_equal(
+                    a, data[sample_slice][:, tone_slice].T)
+                if a.ndim == 2:
+                    assert a.flags.c_contiguous
+                a = read_tone_sliced(
+                    v, sample_slice, tone_slice, tone_major=False)
+                np.testing.assert_array_equal(
+                    a, data[sample_slice][:, tone_slice])
+
+
+def test_memmap_nc_var(tmp_path):
+    pytest.importorskip('h5py')
+    rng = np.random.default_rng(0)
+    data = rng.integers(-1000, 1000, size=(200, 100), dtype='i4')
+    filepath = tmp_path.joinpath('test.nc')
+    with netCDF4.Dataset(filepath, 'w') as nc:
+        nc.createDimension('time', data.shape[0])
+        nc.createDimension('time_unlimited', None)
+        nc.createDimension('iqlen', data.shape[1])
+        v = nc.createVariable(
+            'Data.Toltec.Is', 'i4', ('time', 'iqlen'), contiguous=True)
+        v[:] = data
+        v = nc.createVariable(
+            'Data.Toltec.Qs', 'i4', ('time_unlimited', 'iqlen'))
+        v[:] = data
+    with netCDF4.Dataset(filepath, 'r') as nc:
+        a = memmap_nc_var(filepath, nc.variables['Data.Toltec.Is'])
+        assert isinstance(a, np.memmap)
+        np.testing.assert_array_equal(a.T[10:20, 5:50], data.T[10:20, 5:50])
+        # chunked variables cannot be mapped
+        assert memmap_nc_var(filepath, nc.variables['Data.Toltec.Qs']) is None
+
+
+def test_nc_var_tone_major_view(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.integers(-1000, 1000, size=(200, 100), dtype='i4')
+    with netCDF4.Dataset(tmp_path.joinpath('test.nc'), 'w') as nc:
+        nc.createDimension('time', None)
+        nc.createDimension('iqlen', data.shape[1])
+        v = nc.createVariable('Data.Toltec.Is', 'i4', ('time', 'iqlen'))
+        v[:] = data
+        view = NcVarToneMajorView(v)
+        assert view.shape == (100, 200)
+        np.testing.assert_array_equal(view[3], data[:, 3])
+        np.testing.assert_array_equal(view[:10, 20:40], data[20:40, :10].T)
+        np.testing.assert_array_equal(view[[1, 5], -1], data[-1, [1, 5]])
+        np.testing.assert_array_equal(np.asarray(view), data.T)
+
+
+@pytest.mark.parametrize('prefetch', [True, False])
+def test_nc_file_io_iter_chunks(prefetch):
+
+    # local file
+    filepath = get_pkg_data_path().joinpath(
+            'tests/basic_obs_data/'
+            'toltec0_011367_000_0000_2020_07_16_20_41_03_timestream.nc')
+
+    with NcFileIO(source=filepath) as df:
+        ts = df.tone_loc[:10].read()
+        n_samples = ts.I.shape[-1]
+        chunks = list(df.iter_chunks(
+            chunk_len=100, tone=slice(None, 10), overlap=5,
+            prefetch=prefetch))
+        with pytest.raises(ValueError, match='invalid chunk length'):
+            next(df.iter_chunks(chunk_len=0))
+
+    assert len(chunks) == (n_samples + 99) // 100
+    for i, chunk in enumerate(chunks):
+        assert isinstance(chunk, kd.TimeStream)
+        sample_slice = chunk.meta['sample_slice']
+        assert chunk.meta['chunk_index'] == i
+        assert sample_slice.start == i * 100
+        assert sample_slice.stop == min(i * 100 + 105, n_samples)
+        np.testing.assert_array_equal(chunk.I, ts.I[:, sample_slice])
+        np.testing.assert_array_equal(chunk.Q, ts.Q[:, sample_slice])
+
+
+def test_nc_file_io_meta_view_and_query_cache():
+
+    # local file
+    filepath = get_pkg_data_path().joinpath(
+            'tests/basic_obs_data/'
+            'toltec0_011536_000_0000_2020_07_18_18_02_31_tune.nc')
+
+    with NcFileIO(source=filepath) as df:
+        slicer = df.tone_loc['id < 10'].sweep_loc['id < 20']
+        mask = df._resolve_slice(slicer)['tone_slice']
+        # the query result is memoized and read-only
+        assert df._resolve_slice(slicer)['tone_slice'] is mask
+        assert not mask.flags.writeable
+        assert ('tone', 1, 'id < 10') in df._axis_query_cache
+        swp = df.tone_loc['id < 10'].sweep_loc['id < 20'].read()
+        # the meta of the data is a copy-on-write view of the file meta
+        swp.meta['some_key'] = 1
+        assert 'some_key' not in df.meta
+        assert swp.meta['file_loc'] == df.meta['file_loc']
+    # the caches are invalidated when the file is reopened
+    with df.open():
+        assert len(df._axis_query_cache) == 0
@@ -89,6 +89,68 @@ def test_basic_obs_dataset_from_files():
         print(kd)
 
 
+def test_basic_obs_dataset_from_files_lazy():
+
+    filepaths = sorted(get_pkg_data_path().joinpath(
+            'tests/basic_obs_data/').glob("*.nc"))
+    dataset = BasicObsDataset.from_files(
+            filepaths, lazy=True, include_meta_cols='intersection')
+    assert dataset.is_lazy
+    assert dataset['obsnum'][0] == 11367
+    colnames = set(dataset.index_table.colnames)
+
+    dataset_loaded = BasicObsDataset.from_files(
+            filepaths, n_workers=2, include_meta_cols='intersection')
+    assert not dataset_loaded.is_lazy
+    key = next(iter(
+        set(dataset_loaded.index_table.colnames).difference(colnames)))
+    # accessing a column not in the index table loads the files
+    assert dataset[key].tolist() == dataset_loaded[key].tolist()
+    assert not dataset.is_lazy
+    assert set(dataset.index_table.colnames) == set(
+        dataset_loaded.index_table.colnames)
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_basic_obs_dataset_read_iter(max_workers):
+
+    filepaths = sorted(get_pkg_data_path().joinpath(
+            'tests/basic_obs_data/').glob("*.nc"))
+    dataset = BasicObsDataset.from_files(filepaths)
+    obsnums = [kd.meta['obsnum'] for kd in dataset.read()]
+    assert [
+        kd.meta['obsnum']
+        for kd in dataset.read_iter(max_workers=max_workers)] == obsnums
+    # only one file is read at a time with the size limit
+    assert [
+        kd.meta['obsnum']
+        for kd in dataset.read_iter(
+            max_workers=max_workers, max_prefetch_size=1)] == obsnums
+    result = list(dataset.read_iter(max_workers=max_workers, ordered=False))
+    assert sorted(i for i, _ in result) == list(range(len(dataset)))
+    for i, kd in result:
+        assert kd.meta['obsnum'] == obsnums[i]
+
+
+def test_basic_obs_dataset_save(tmp_path):
+
+    filepaths = sorted(get_pkg_data_path().joinpath(
+            'tests/basic_obs_data/').glob("*.nc"))
+    dataset = BasicObsDataset.from_files(filepaths)
+    filepath = tmp_path.joinpath('index.ecsv')
+    dataset.save(filepath)
+    with pytest.raises(ValueError, match='unable to infer'):
+        dataset.save(tmp_path.joinpath('index.unknown'))
+
+    dataset_saved = BasicObsDataset.from_saved(filepath)
+    assert dataset_saved.is_lazy
+    assert '_bod' not in Table.read(filepath).colnames
+    assert dataset_saved['obsnum'].tolist() == dataset['obsnum'].tolist()
+    assert dataset_saved['source'].tolist() == dataset['source'].tolist()
+    assert [kd.meta['obsnum'] for kd in dataset_saved.read()] == \
+        dataset['obsnum'].tolist()
+
+
 def test_basic_obs_dataset_from_index_table():
 
     index_table = Table(rows=[
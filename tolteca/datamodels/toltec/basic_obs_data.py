@@ -1,6 +1,6 @@
 #! /usr/bin/env python
 
-from tollan.utils.log import get_logger
+from tollan.utils.log import get_logger, timeit
 from astropy.table import Table, MaskedColumn, vstack, unique, join
 import numpy as np
 # from astropy.io import registry
@@ -10,7 +10,11 @@ from ..io.registry import open_file
 from ..io.base import DataFileIO
 from ..fs.toltec import meta_from_source
 from collections import defaultdict
+from concurrent.futures import (
+    ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED)
+import multiprocessing
 import warnings
+from pathlib import Path
 from tollan.utils.fmt import pformat_fancy_index
 import dill
 
@@ -63,24 +67,50 @@ class BasicObsData(DataFileIO):
 
     open_: bool
         If True, attemp to open the file to load meta data.
+
+    lazy : bool
+        If True, the meta data are initially populated from the
+        file location only, and the file is opened on first access of
+        :attr:`file_obj`.
     """
 
     logger = get_logger()
 
-    def __init__(self, source, open_=True):
+    def __init__(self, source, open_=True, lazy=False):
         super().__init__()
         file_loc = self._file_loc = self._normalize_file_loc(source)
-        if open_ and file_loc.is_local:
+        self._file_obj_pending = open_ and lazy and file_loc.is_local
+        if open_ and not lazy and file_loc.is_local:
             file_obj = open_file(file_loc.path)
         else:
             file_obj = None
         self._file_loc = file_loc
         self._file_obj = file_obj
         self._update_meta()
-        if self.file_obj is not None:
+        if self._file_obj is not None:
             # ensure the file is closed
             # after the meta is updated.
-            self.file_obj.close()
+            self._file_obj.close()
+
+    @property
+    def file_obj(self):
+        if self.file_obj_pending:
+            self.set_file_obj(open_file(self.file_loc.path))
+        return self._file_obj
+
+    @property
+    def file_obj_pending(self):
+        """True if the file is to be opened on access of :attr:`file_obj`.
+        """
+        return getattr(self, '_file_obj_pending', False)
+
+    def set_file_obj(self, file_obj):
+        """Set :attr:`file_obj` of a lazy instance and update the meta."""
+        self._file_obj = file_obj
+        self._file_obj_pending = False
+        self.update_meta_from_file_obj(self.meta, file_obj)
+        file_obj.close()
+        return self
 
     @classmethod
     def update_meta_from_file_obj(cls, meta, file_obj):
@@ -110,8 +140,8 @@ class BasicObsData(DataFileIO):
         """Update :attr:`meta`."""
 
         self.update_meta_from_file_loc(self.meta, self.file_loc)
-        if self.file_obj is not None:
-            self.update_meta_from_file_obj(self.meta, self.file_obj)
+        if self._file_obj is not None:
+            self.update_meta_from_file_obj(self.meta, self._file_obj)
 
     @sharedmethod
     def open(obj, *args, **kwargs):
@@ -132,6 +162,94 @@ class BasicObsData(DataFileIO):
             return fo.read()
 
 
+def _open_file_obj(path):
+    # this is run in the worker processes. The returned object is closed
+    # and pickled.
+    try:
+        file_obj = open_file(path)
+        file_obj.close()
+    except Exception as e:
+        return e
+    return file_obj
+
+
+def load_bods(bods, n_workers=1):
+    """Open the files of lazy `BasicObsData` instances to load the meta.
+
+    Parameters
+    ----------
+    bods : list
+        The list of `BasicObsData` instances. Instances that are None
+        or not lazy are skipped.
+    n_workers : int
+        The number of worker processes. The netCDF library is not
+        thread-safe, so the files are opened in separate processes.
+
+    Returns
+    -------
+    list
+        The list of the exceptions raised when opening the files, or None
+        if succeeded, for each of `bods`.
+    """
+    logger = get_logger()
+    result = [None] * len(bods)
+    pending = [
+        (i, bod) for i, bod in enumerate(bods)
+        if bod is not None and bod.file_obj_pending]
+    if not pending:
+        return result
+    if n_workers > 1 and \
+            'fork' not in multiprocessing.get_all_start_methods():
+        logger.warning(
+            "parallel loading requires fork start method, "
+            "fallback to serial loading.")
+        n_workers = 1
+    paths = [bod.file_loc.path for _, bod in pending]
+    if n_workers > 1:
+        with timeit(
+                f"load {len(paths)} files with n_workers={n_workers}"):
+            with ProcessPoolExecutor(
+                    max_workers=n_workers,
+                    mp_context=multiprocessing.get_context('fork'),
+                    ) as executor:
+                file_objs = list(executor.map(
+                    _open_file_obj, paths,
+                    chunksize=max(1, len(paths) // (4 * n_workers))))
+    else:
+        file_objs = map(_open_file_obj, paths)
+    for (i, bod), file_obj in zip(pending, file_objs):
+        if isinstance(file_obj, Exception):
+            result[i] = file_obj
+            continue
+        bod.set_file_obj(file_obj)
+    return result
+
+
+def _read_bod(bod, args, kwargs):
+    return bod.read(*args, **kwargs)
+
+
+def _get_file_size(bod):
+    if bod is None or not bod.file_loc.is_local:
+        return 0
+    try:
+        return bod.file_loc.path.stat().st_size
+    except OSError:
+        return 0
+
+
+def _get_done_index(pending):
+    # return the index of a done future in pending, waiting
+    # for one if needed.
+    futures = dict()
+    for i, (future, _) in pending.items():
+        if future is None or future.done():
+            return i
+        futures[future] = i
+    done, _ = wait(futures.keys(), return_when=FIRST_COMPLETED)
+    return futures[next(iter(done))]
+
+
 class BasicObsDataset(object):
     """A helper class to access a set of TolTEC basic obs data items.
 
@@ -202,7 +320,7 @@ class BasicObsDataset(object):
         return tbl
 
     @classmethod
-    def _make_bod_list(cls, tbl, **kwargs):
+    def _make_bod_list(cls, tbl, n_workers=1, lazy=False, **kwargs):
         # this will update tbl in place.
         bods = []
         s = tbl['source']
@@ -212,14 +330,11 @@ class BasicObsDataset(object):
             if source is None:
                 bods.append(None)
                 continue
-            try:
-                bod = BasicObsData(source, **kwargs)
-            except Exception as e:
-                raise
-                cls.logger.debug(f"unable to create bod: {e}")
-                bod = None
-            bods.append(bod)
-
+            bods.append(BasicObsData(source, lazy=True, **kwargs))
+        if not lazy:
+            for e in load_bods(bods, n_workers=n_workers):
+                if e is not None:
+                    raise e
         return np.array(bods, dtype=object)
 
     @classmethod
@@ -252,11 +367,12 @@ class BasicObsDataset(object):
             The keys to add.
         """
         data = defaultdict(list)
-        for k in keys:
-            for bod in self:
-                if bod is None:
-                    continue
-                data[k].append(bod.meta.get(k, None))
+        for bod in self:
+            if bod is None:
+                continue
+            meta = bod.meta
+            for k in keys:
+                data[k].append(meta.get(k, None))
         for k in data.keys():
             try:
                 self[k] = data[k]
@@ -308,12 +424,98 @@ class BasicObsDataset(object):
         for bod in self:
             if bod is None:
                 yield None
+                continue
             yield bod.read(*args, **kwargs)
 
     def read_all(self, *args, **kwargs):
         """Return a list of data items."""
         return list(self.read(*args, **kwargs))
 
+    def read_iter(
+            self, *args, max_workers=1, prefetch=None,
+            max_prefetch_size=None, ordered=True, **kwargs):
+        """Return a generator of data items, which are read in the
+        background.
+
+        Parameters
+        ----------
+        max_workers : int
+            The number of workers. When 1, the files are read in a
+            background thread. Otherwise, the files are read in a pool of
+            worker processes, since the netCDF library is not thread-safe.
+            Each data item is then pickled and sent back through a pipe,
+            which costs a copy of the decoded data, so this only pays off
+            when decoding the files takes longer than the copy.
+        prefetch : int, optional
+            The max number of data items that are being read or are read
+            but not yet consumed. Default is ``max_workers + 1``.
+        max_prefetch_size : int, optional
+            If set, the reads are also limited such that the total size
+            in bytes of the files of these data items does not exceed this
+            value. At least one file is always read.
+        ordered : bool
+            If True, the data items are yielded in the order of the dataset.
+            Otherwise, the data items are yielded as soon as they are read,
+            as tuples of ``(index, data)``.
+        *args, **kwargs :
+            Passed to :meth:`BasicObsData.read`.
+        """
+        if max_workers > 1 and \
+                'fork' not in multiprocessing.get_all_start_methods():
+            self.logger.warning(
+                "parallel read requires fork start method, "
+                "fallback to single worker.")
+            max_workers = 1
+        if prefetch is None:
+            prefetch = max_workers + 1
+        if max_workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('fork'))
+        else:
+            executor = ThreadPoolExecutor(max_workers=1)
+        bods = list(self._bod_list)
+        # index -> (future, size)
+        pending = dict()
+        pending_size = 0
+        i_submit = 0
+        i_yield = 0
+        try:
+            while True:
+                while i_submit < len(bods) and len(pending) < prefetch:
+                    bod = bods[i_submit]
+                    size = _get_file_size(bod)
+                    if (
+                            pending and max_prefetch_size is not None
+                            and pending_size + size > max_prefetch_size):
+                        break
+                    if bod is None:
+                        future = None
+                    else:
+                        future = executor.submit(_read_bod, bod, args, kwargs)
+                    pending[i_submit] = (future, size)
+                    pending_size += size
+                    i_submit += 1
+                if not pending:
+                    break
+                if ordered:
+                    i = i_yield
+                    i_yield += 1
+                else:
+                    i = _get_done_index(pending)
+                future, size = pending.pop(i)
+                pending_size -= size
+                data = None if future is None else future.result()
+                if ordered:
+                    yield data
+                else:
+                    yield i, data
+        finally:
+            for future, _ in pending.values():
+                if future is not None:
+                    future.cancel()
+            executor.shutdown(wait=True)
+
     # iter op on the bod list
     def __iter__(self):
         return self._bod_list.__iter__()
@@ -328,6 +530,10 @@ class BasicObsDataset(object):
         # otherwise it return an indextable
         if arg in self.index_table.colnames:
             return self.index_table[arg]
+        if isinstance(arg, str) and self.is_lazy:
+            # the column may be available after loading the files
+            self.load_meta()
+            return self[arg]
         if isinstance(arg, list) and any(
                 a in self.index_table.colnames for a in arg):
             return self.index_table[arg]
@@ -356,16 +562,33 @@ class BasicObsDataset(object):
         return self._index_table
 
     def write_index_table(self, *args, **kwargs):
+        """Write the index table, without the columns of object dtype
+        and the multi-dimensional columns.
+
+        Mixin columns such as `~astropy.time.Time` are kept.
+
+        Parameters
+        ----------
+        *args, **kwargs :
+            Passed to :meth:`astropy.table.Table.write`.
+        """
         tbl = self.index_table
-        use_cols = [
-            c for c in tbl.colnames
-            if not (
-                tbl.dtype[c].hasobject
-                or tbl.dtype[c].ndim > 0
-                )]
+        use_cols = list()
+        for c in tbl.colnames:
+            # the mixin columns do not have dtype
+            dtype = getattr(tbl[c], 'dtype', None)
+            if dtype is not None and (
+                    dtype.hasobject or len(tbl[c].shape) > 1):
+                continue
+            use_cols.append(c)
         return tbl[use_cols].write(*args, **kwargs)
 
     def dump(self, filepath):
+        """Pickle the dataset to `filepath`.
+
+        The loaded data objects, if any, are included. See :meth:`save`
+        for saving the index table only.
+        """
         with open(filepath, 'wb') as fo:
             dill.dump(self, fo)
 
@@ -374,6 +597,81 @@ class BasicObsDataset(object):
         with open(filepath, 'rb') as fo:
             return dill.load(fo)
 
+    _index_table_formats = {
+        '.ecsv': 'ascii.ecsv',
+        '.parquet': 'parquet',
+        '.fits': 'fits',
+        '.h5': 'hdf5',
+        '.hdf5': 'hdf5',
+        }
+
+    @classmethod
+    def _get_index_table_format(cls, filepath):
+        suffix = Path(filepath).suffix
+        if suffix not in cls._index_table_formats:
+            raise ValueError(
+                f"unable to infer index table format for {filepath}, "
+                f"supported suffixes: {list(cls._index_table_formats)}")
+        return cls._index_table_formats[suffix]
+
+    def save(self, filepath, format=None, overwrite=False, **kwargs):
+        """Save the index table to `filepath`.
+
+        The index table is written with :meth:`write_index_table`, so the
+        columns of object dtype, which include the data items and the
+        loaded data objects, and the multi-dimensional columns are not
+        saved. Mixin columns such as
+        `~astropy.time.Time` are saved as supported by the format.
+        The saved index table can be loaded with :meth:`from_saved`.
+
+        Parameters
+        ----------
+        filepath : str, `pathlib.Path`
+            The output filepath.
+        format : str, optional
+            The table format. If None, it is inferred from the suffix of
+            `filepath`, one of ``.ecsv``, ``.parquet``, ``.fits``, ``.h5``
+            and ``.hdf5``.
+        overwrite : bool
+            If True, the existing file is overwritten.
+        **kwargs :
+            Passed to :meth:`astropy.table.Table.write`.
+        """
+        if format is None:
+            format = self._get_index_table_format(filepath)
+        if format == 'hdf5':
+            kwargs.setdefault('path', 'index_table')
+            kwargs.setdefault('serialize_meta', True)
+        self.write_index_table(
+            filepath, format=format, overwrite=overwrite, **kwargs)
+
+    @classmethod
+    def from_saved(cls, filepath, format=None, **kwargs):
+        """Return a dataset from the index table saved by :meth:`save`.
+
+        The files are not opened until the data are read, or columns that
+        are not in the index table are requested.
+
+        Parameters
+        ----------
+        filepath : str, `pathlib.Path`
+            The filepath of the saved index table.
+        format : str, optional
+            The table format. If None, it is inferred from the suffix of
+            `filepath`.
+        **kwargs :
+            Passed to :meth:`astropy.table.Table.read`, e.g.,
+            ``memmap=True`` for FITS files.
+        """
+        if format is None:
+            format = cls._get_index_table_format(filepath)
+        if format == 'hdf5':
+            kwargs.setdefault('path', 'index_table')
+        index_table = Table.read(filepath, format=format, **kwargs)
+        return cls(
+            index_table=cls._validate_index_table(index_table),
+            include_meta_cols=None, lazy=True)
+
     def select(self, cond, desc=None):
         """Return a subset of the dataset specified by `cond`
 
@@ -445,18 +743,63 @@ class BasicObsDataset(object):
                f":\n{pformat_tbl}"
 
     @classmethod
-    def from_files(cls, files, open_=True, **kwargs):
+    def from_files(cls, files, open_=True, lazy=False, n_workers=1, **kwargs):
+        """Return a dataset from a list of files.
+
+        Parameters
+        ----------
+        files : list
+            The list of files.
+        open_ : bool
+            If True, the files are opened to load the meta data.
+        lazy : bool
+            If True, the index table is populated from the file locations,
+            and the files are opened when the data are read, or when
+            columns that are not in the index table are requested.
+            Note that unknown files are not ignored in this mode.
+        n_workers : int
+            The number of worker processes to open the files.
+        **kwargs :
+            Passed to the constructor.
+        """
         if not files:
             raise ValueError("no file specified")
         bod_list = []
         for f in files:
             try:
-                bod_list.append(BasicObsData(f, open_=open_))
+                bod_list.append(BasicObsData(f, open_=open_, lazy=True))
             except Exception as e:
                 cls.logger.debug(
                         f'ignored unknown file {f}: {e}', exc_info=False)
+        if not lazy:
+            errors = load_bods(bod_list, n_workers=n_workers)
+            for bod, e in zip(list(bod_list), errors):
+                if e is not None:
+                    cls.logger.debug(
+                        f'ignored unknown file {bod.file_loc}: {e}',
+                        exc_info=False)
+                    bod_list.remove(bod)
         return cls(bod_list=bod_list, **kwargs)
 
+    def load_meta(self, n_workers=1):
+        """Open the files of the lazy data items to load the meta data.
+
+        The meta columns in the index table are updated.
+        """
+        errors = load_bods(self._bod_list, n_workers=n_workers)
+        for bod, e in zip(self._bod_list, errors):
+            if e is not None:
+                raise e
+        self.add_meta_cols('intersection')
+        return self
+
+    @property
+    def is_lazy(self):
+        """True if any of the files are pending to be opened."""
+        return any(
+            bod is not None and bod.file_obj_pending
+            for bod in self._bod_list)
+
     @classmethod
     def from_index_table(cls, index_table, copy=True, meta=None):
         """Return a dataset from an index table.
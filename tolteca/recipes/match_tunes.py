@@ -51,9 +51,11 @@ def prepare_d21_data(dataset):
 
     # Compute the D21
     d21_kwargs = dict(fstep=500 << u.Hz, flim=(4.0e8 << u.Hz, 1.0e9 << u.Hz), smooth=2)
-    swps = targs.read_all()
-    for swp in swps:
+    # the sweeps are read in the background while the D21 is computed.
+    swps = list()
+    for swp in targs.read_iter():
         swp.make_unified(**d21_kwargs)
+        swps.append(swp)
     targs.index_table['swp'] = swps
     return targs
 
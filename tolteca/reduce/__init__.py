@@ -1,13 +1,19 @@
 #!/usr/bin/env python
 
 from dataclasses import dataclass, field
+from typing import Union
+import astropy.units as u
+from schema import Or
 from tollan.utils.dataclass_schema import add_schema
-from tollan.utils.log import get_logger, timeit, logit
+from tollan.utils.log import get_logger, logit
 from tollan.utils.fmt import pformat_yaml
 from ..utils.config_registry import ConfigRegistry
 from ..utils.config_schema import add_config_schema
 from ..utils import RuntimeBase, RuntimeBaseError
 from ..utils.doc_helper import collect_config_item_types
+from ..utils.common_schema import PhysicalTypeSchema
+from ..datamodels.toltec import BasicObsDataset
+from .step_graph import StepGraph
 
 
 __all__ = [
@@ -63,6 +69,35 @@ class ReduConfig(object):
             'schema': list(steps_registry.item_schemas),
             'pformat_schema_type': f"[<{steps_registry.name}>, ...]"
             })
+    n_procs: int = field(
+        default=1,
+        metadata={
+            'description': 'The max number of independent steps to run '
+                           'concurrently in worker processes. When larger '
+                           'than 1, each step writes to a sub directory '
+                           'of the output directory.'
+            })
+    n_cpus_per_proc: Union[None, int] = field(
+        default=None,
+        metadata={
+            'description': 'The number of CPUs of each worker process, used '
+                           'to set the CPU affinity and thread caps.',
+            'schema': Or(None, int),
+            })
+    max_memory_per_proc: Union[None, u.Quantity] = field(
+        default=None,
+        metadata={
+            'description': 'The max resident memory of each worker process '
+                           'and its subprocesses.',
+            'schema': Or(None, PhysicalTypeSchema('data quantity')),
+            })
+    use_step_cache: bool = field(
+        default=False,
+        metadata={
+            'description': 'If True, the outputs of the steps are cached '
+                           'by the hash of their configs and inputs, and '
+                           'the steps are skipped in re-runs.'
+            })
 
     class Meta:
         schema = {
@@ -130,28 +165,64 @@ class PipelineRuntime(RuntimeBase):
         self.logger.debug(
             f"run reduction with config dict: "
             f"{pformat_yaml(cfg.to_config_dict())}")
-        # TODO
-        # later on we'll enable the DAG like pipeline step
-        # management facility but for now we'll just run each step
-        # sequentially.
-        n_steps = len(cfg.steps)
+        # the steps are run in the order of their dependencies, which are
+        # resolved from the data kinds declared in the step registry.
         tmp_data = cfg.load_input_data()
         self.logger.info(f"collected data from inputs: {tmp_data!r}")
         if len(cfg.steps) == 0:
             self.logger.warning("no pipeline steps found, nothing to do.")
+        steps = list()
         for i, step in enumerate(cfg.steps):
             if not step.enabled:
-                self.logger.info(f"skip step [{i + 1}/{n_steps}] {step.name}")
+                self.logger.info(
+                    f"skip step [{i + 1}/{len(cfg.steps)}] {step.name}")
                 continue
-            with timeit(
-                    f"run pipeline step [{i + 1}/{n_steps}] {step.name}",
-                    level='INFO',
-                    ):
-                self.logger.debug(f"input data {tmp_data!r}")
-                tmp_data = step.run(cfg, inputs=tmp_data)
-                self.logger.debug(f"output data {tmp_data!r}")
+            steps.append(step)
+        if not steps:
+            return tmp_data
+        step_graph = StepGraph(steps, steps_registry)
+        self.logger.debug(
+            "resolved step dependencies:\n{}".format(pformat_yaml({
+                f'{i}_{step.name}': [
+                    f'{j}_{steps[j].name}' for j in step_graph.deps[i]]
+                for i, step in enumerate(steps)})))
+        if cfg.use_step_cache:
+            cache_dir = cfg.get_or_create_output_dir().joinpath(
+                '.step_cache')
+        else:
+            cache_dir = None
+        max_memory = cfg.max_memory_per_proc
+        if max_memory is not None:
+            max_memory = int(max_memory.to_value(u.byte))
+        outputs = step_graph.run(
+            cfg, tmp_data,
+            n_procs=cfg.n_procs,
+            n_cpus_per_proc=cfg.n_cpus_per_proc,
+            max_memory=max_memory,
+            cache_dir=cache_dir,
+            inputs_key=self._get_inputs_key(cfg, tmp_data),
+            )
         self.logger.info("work's done!")
-        return tmp_data
+        return outputs[-1]
+
+    @staticmethod
+    def _get_inputs_key(cfg, data):
+        # the key includes the input config and the sources of the input
+        # data files, with their mtimes.
+        items = [repr(cfg.inputs)]
+        for d in data:
+            if not isinstance(d, BasicObsDataset):
+                items.append(repr(d))
+                continue
+            for bod in d:
+                if bod is None:
+                    continue
+                file_loc = bod.file_loc
+                mtime = None
+                if file_loc.is_local and file_loc.path.exists():
+                    mtime = file_loc.path.stat().st_mtime
+                items.append(f'{file_loc.uri} {mtime}')
+        return '\n'.join(items)
 
 
 # make a list of all redu config item types
@@ -12,7 +12,10 @@ from schema import Optional, Schema, Or
 from .citlali import Citlali, CitlaliConfig
 
 
-@steps_registry.register('citlali')
+@steps_registry.register('citlali', info={
+    'inputs': ['basic_obs_dataset'],
+    'outputs': ['data_prod'],
+    })
 class CitlaliStepConfig(DataclassNamespace):
     """The config class for reduction with Citlali."""
 
@@ -49,7 +52,23 @@ class CitlaliStepConfig(DataclassNamespace):
             default=False,
             description='Check config file generation only without running the pipeline.'
             ):
-        bool
+        bool,
+        Optional(
+            'n_procs',
+            default=1,
+            description='The max number of citlali processes to run '
+                        'concurrently. When larger than 1, each obs is '
+                        'reduced by a separate citlali process.'
+            ):
+        int,
+        Optional(
+            'n_threads_per_proc',
+            default=None,
+            description='The number of threads of each citlali process, '
+                        'used to set the thread caps and CPU affinity when '
+                        'n_procs is larger than 1.'
+            ):
+        Or(None, int),
         })
 
     logger = get_logger()
@@ -121,4 +140,6 @@ class CitlaliStepConfig(DataclassNamespace):
                 output_dir=output_dir,
                 log_level=self.log_level,
                 logger_func=logger.info,
-                dry_run=self.dry_run)
+                dry_run=self.dry_run,
+                n_procs=self.n_procs,
+                n_threads_per_proc=self.n_threads_per_proc)
@@ -1,13 +1,17 @@
 #!/usr/bin/env python
 
 import functools
+import hashlib
+import json
 import subprocess
 import re
 import shutil
 import os
+import queue
 import git
 import pathlib
 
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from cached_property import cached_property
 from packaging.version import Version, InvalidVersion
@@ -28,11 +32,11 @@ from tollan.utils import ensure_abspath
 from tollan.utils.fmt import pformat_yaml
 
 from .base import PipelineEngine, PipelineEngineError
-from ...utils import get_user_data_dir
+from ...utils import get_user_data_dir, get_cpu_slots
 from ...utils.misc import get_nested_keys
 from ...utils.common_schema import RelPathSchema, PhysicalTypeSchema
 from ...utils.runtime_context import yaml_load
-from ...datamodels.toltec.data_prod import ToltecDataProd
+from ...datamodels.toltec.data_prod import ToltecDataProd, ScienceDataProd
 from ...datamodels.toltec.basic_obs_data import BasicObsData
 from ...datamodels.io.toltec.tel import LmtTelFileIO
 from ...common.toltec import toltec_info
@@ -225,6 +229,21 @@ class CitlaliExec(object):
             return [stdbuf, '-oL']
         return list()
 
+    @staticmethod
+    @functools.lru_cache(maxsize=1)
+    def _get_taskset_path():
+        return shutil.which('taskset')
+
+    @classmethod
+    def _get_cpu_affinity_cmd(cls, cpus):
+        if cpus is None:
+            return list()
+        taskset = cls._get_taskset_path()
+        if taskset is None:
+            cls.logger.warning("taskset not found, skip setting CPU affinity")
+            return list()
+        return [taskset, '-c', ','.join(map(str, cpus))]
+
     def run(self, config_file, log_level="INFO", **kwargs):
         exec_path = self.path
         citlali_cmd = [
@@ -237,6 +256,60 @@ class CitlaliExec(object):
             "run {} cmd: {}".format(self, ' '.join(citlali_cmd)))
         return call_subprocess_with_live_output(cmd, **kwargs)
 
+    def run_streamed(
+            self, config_file, log_level="INFO", logger_func=None,
+            log_prefix='', cpus=None, n_threads=None):
+        """Run citlali and pass the output lines to `logger_func`.
+
+        Unlike :meth:`run`, this can be called from multiple threads.
+
+        Parameters
+        ----------
+        config_file : `pathlib.Path`
+            The config file.
+        log_level : str
+            The log level of citlali.
+        logger_func : callable, optional
+            The function to handle the output lines.
+        log_prefix : str
+            The string prepended to the output lines.
+        cpus : list, optional
+            If set, the process is pinned to these CPUs.
+        n_threads : int, optional
+            If set, the thread caps of the common threading libraries
+            are set to this value via the env vars.
+
+        Returns
+        -------
+        bool
+            True if the process exits with 0.
+        """
+        if logger_func is None:
+            logger_func = self.logger.info
+        citlali_cmd = [
+                self.path.as_posix(),
+                '-l', log_level.lower(),
+                config_file.as_posix(),
+                ]
+        cmd = (
+            self._get_line_buf_cmd()
+            + self._get_cpu_affinity_cmd(cpus)
+            + citlali_cmd)
+        env = None
+        if n_threads is not None:
+            env = dict(os.environ, **{
+                k: str(n_threads) for k in [
+                    'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'MKL_NUM_THREADS']})
+        self.logger.info(
+            "run {} cmd: {}".format(self, ' '.join(cmd)))
+        with subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                env=env, bufsize=1, universal_newlines=True) as proc:
+            for line in proc.stdout:
+                logger_func(f'{log_prefix}{line.rstrip()}')
+        return proc.returncode == 0
+
 
 @functools.lru_cache(maxsize=None)
 def _get_citlali_exec(path):
@@ -307,6 +380,9 @@ class Citlali(PipelineEngine):
     def run(self, *args, **kwargs):
         return self._citlali_exec.run(*args, **kwargs)
 
+    def run_streamed(self, *args, **kwargs):
+        return self._citlali_exec.run_streamed(*args, **kwargs)
+
     @classmethod
     def find_citlali_executables(
             cls, path=None, version=None, use_env_path=True):
@@ -398,7 +474,14 @@ class CitlaliProc(object):
 
     def __call__(
         self, dataset, output_dir,
-            log_level='INFO', logger_func=None, dry_run=False):
+            log_level='INFO', logger_func=None, dry_run=False,
+            n_procs=1, n_threads_per_proc=None):
+        if n_procs > 1:
+            return self._run_groups(
+                dataset, output_dir,
+                log_level=log_level, logger_func=logger_func,
+                dry_run=dry_run, n_procs=n_procs,
+                n_threads_per_proc=n_threads_per_proc)
         cfg = self._prepare_citlali_config(dataset, output_dir)
         input_items = cfg['inputs']
         name = input_items[0]['meta']['name']
@@ -422,6 +505,102 @@ class CitlaliProc(object):
         raise RuntimeError(
             f"failed to run {self.citlali} with config file {cfg_filepath}")
 
+    def _run_groups(
+            self, dataset, output_dir, log_level, logger_func, dry_run,
+            n_procs, n_threads_per_proc):
+        """Run citlali for each obs in a separate process.
+
+        Each process writes to a sub directory of `output_dir`, since
+        citlali numbers the reductions in the output directory. The latest
+        reductions of all the obs are collected at the end, and the summary
+        is saved to ``citlali_groups.ecsv`` in `output_dir`.
+        """
+        if logger_func is None:
+            logger_func = self.logger.info
+        cfg = self._prepare_citlali_config(dataset, output_dir)
+        input_items = cfg.pop('inputs')
+        groups = list()
+        names = set()
+        for i, input_item in enumerate(input_items):
+            name = input_item['meta']['name']
+            if name in names:
+                # the groups may differ in master or repeat
+                name = f'{name}_{i}'
+            names.add(name)
+            group_output_dir = output_dir.joinpath(f'o{name}')
+            group_cfg = deepcopy(cfg)
+            rupdate(group_cfg, {
+                'inputs': [input_item],
+                'runtime': {
+                    'output_dir': group_output_dir.as_posix() + '/'
+                    }
+                })
+            if n_threads_per_proc is not None:
+                rupdate(group_cfg, {
+                    'runtime': {'n_threads': n_threads_per_proc}})
+            cfg_filepath = output_dir.joinpath(f'citlali_o{name}_c1.yaml')
+            with open(cfg_filepath, 'w') as fo:
+                fo.write(pformat_yaml(group_cfg))
+            groups.append((name, cfg_filepath, group_output_dir))
+        if dry_run:
+            for _, cfg_filepath, _ in groups:
+                logger_func(
+                    f"** DRY RUN **: citlali low level config: "
+                    f"{cfg_filepath}")
+            logger_func(f"dry run's done.")
+            return None
+        for _, _, group_output_dir in groups:
+            group_output_dir.mkdir(parents=True, exist_ok=True)
+        n_procs = min(n_procs, len(groups))
+        cpu_slots = queue.Queue()
+        for cpus in (
+                get_cpu_slots(n_procs, n_threads_per_proc)
+                or [None] * n_procs):
+            cpu_slots.put(cpus)
+
+        def _run_group(group):
+            name, cfg_filepath, _ = group
+            cpus = cpu_slots.get()
+            try:
+                return self._citlali.run_streamed(
+                    cfg_filepath, log_level=log_level,
+                    logger_func=logger_func, log_prefix=f'[o{name}] ',
+                    cpus=cpus, n_threads=n_threads_per_proc)
+            except Exception as e:
+                self.logger.error(
+                    f"failed to run citlali for {name}: {e}", exc_info=True)
+                return False
+            finally:
+                cpu_slots.put(cpus)
+
+        with timeit(
+                f"run citlali for {len(groups)} obs with n_procs={n_procs}"):
+            with ThreadPoolExecutor(max_workers=n_procs) as executor:
+                success = list(executor.map(_run_group, groups))
+        Table(rows=[
+            (name, cfg_filepath.name, group_output_dir.name, s)
+            for (name, cfg_filepath, group_output_dir), s
+            in zip(groups, success)
+            ], names=['name', 'config', 'output_dir', 'success']).write(
+                output_dir.joinpath('citlali_groups.ecsv'),
+                format='ascii.ecsv', overwrite=True)
+        failed = [
+            cfg_filepath.as_posix()
+            for (_, cfg_filepath, _), s in zip(groups, success) if not s]
+        if failed:
+            raise RuntimeError(
+                f"failed to run {self.citlali} with config files "
+                f"{failed}")
+        results = list()
+        for _, _, group_output_dir in groups:
+            results.extend(_collect_latest_redu(group_output_dir))
+        return ToltecDataProd(source={
+            'meta': {
+                'name': output_dir.name
+                },
+            'data_items': results
+            })
+
     def _prepare_citlali_config(
             self, dataset, output_dir,
             ):
@@ -759,32 +938,164 @@ class CitlaliProc(object):
                 'cal_items': list(cal_items.values()),
                 }
 
-def _fix_tel(source, output_dir):
+def _collect_latest_redu(dirpath):
+    """Return the data prods of the latest citlali reduction in `dirpath`.
+    """
+    redu_dirs = [
+        p for p in dirpath.iterdir()
+        if p.is_dir() and re.match(r'redu\d+$', p.name)]
+    if not redu_dirs:
+        return list()
+    return ScienceDataProd.collect_from_citlali_output_dir(
+        max(redu_dirs, key=lambda p: int(p.name[4:])))
+
+
+# bump this when the recomputation in _fix_tel changes, to invalidate
+# the cached files.
+_FIX_TEL_VERSION = 2
+
+# the max total size in bytes of the cached recomputed tel.nc files.
+_FIX_TEL_CACHE_MAX_SIZE = 5 << 30
+
+
+def _get_fix_tel_cache_dir():
+    return get_user_data_dir().joinpath('cache/tel_recomputed')
+
+
+def _prune_fix_tel_cache(cache_dir, max_size, keep=None):
+    """Remove the least recently used files in `cache_dir` except `keep`
+    so that the total size does not exceed `max_size`."""
+    logger = get_logger()
+    entries = list()
+    for p in cache_dir.glob('*.nc'):
+        try:
+            st = p.stat()
+        except OSError:
+            # removed by other processes
+            continue
+        entries.append((st.st_mtime, st.st_size, p))
+    size = sum(e[1] for e in entries)
+    for _, s, p in sorted(entries):
+        if size <= max_size:
+            break
+        if p == keep:
+            continue
+        logger.debug(f"remove cached recomputed tel.nc {p}")
+        try:
+            p.unlink()
+        except OSError:
+            continue
+        size -= s
+
+
+def _hash_file(filepath, params, chunk_size=1 << 20):
+    """Return the hash of the content of `filepath` and `params`."""
+    h = hashlib.sha1()
+    with open(filepath, 'rb') as fo:
+        for chunk in iter(lambda: fo.read(chunk_size), b''):
+            h.update(chunk)
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def _transform_altaz_to_icrs(
+        coords_altaz, erfa_interp_len=300. << u.s,
+        max_error=0.1 << u.arcsec, n_check=100):
+    """Return `coords_altaz` transformed to ICRS.
+
+    The astrometry parameters are interpolated with
+    `ErfaAstromInterpolator` on a time grid of `erfa_interp_len`. The
+    result is checked against the exact transform at `n_check` samples,
+    and the exact transform is used for all samples if the error
+    exceeds `max_error`.
+    """
+    logger = get_logger()
+    from astropy.coordinates.erfa_astrom import (
+        erfa_astrom, ErfaAstromInterpolator)
+    if erfa_interp_len is None:
+        return coords_altaz.transform_to('icrs')
+    with timeit("transform tel coords to icrs with erfa interpolator"):
+        with erfa_astrom.set(ErfaAstromInterpolator(erfa_interp_len)):
+            coords_icrs = coords_altaz.transform_to('icrs')
+    n = coords_altaz.shape[0]
+    check_idx = np.unique(np.linspace(0, n - 1, min(n, n_check)).astype(int))
+    coords_icrs_check = coords_altaz[check_idx].transform_to('icrs')
+    error = coords_icrs[check_idx].separation(coords_icrs_check).max()
+    if error > max_error:
+        logger.warning(
+            f"error of interpolated transform {error.to(u.arcsec)} "
+            f"exceeds {max_error}, use exact transform")
+        with timeit("transform tel coords to icrs"):
+            return coords_altaz.transform_to('icrs')
+    logger.debug(
+        f"max error of interpolated transform: {error.to(u.arcsec)}")
+    return coords_icrs
+
+
+def _fix_tel(
+        source, output_dir, erfa_interp_len=300. << u.s,
+        max_error=0.1 << u.arcsec, cache_dir=None,
+        cache_max_size=_FIX_TEL_CACHE_MAX_SIZE):
     # This is to recompute the ParAngAct, SourceRaAct and SourceDecAct from the tel.nc file
+    # The recomputed files are cached by the hash of the content of the
+    # source and the params, so re-reductions skip the recomputation.
+    # The least recently used files are removed when the cache exceeds
+    # cache_max_size.
+    logger = get_logger()
+    source_new = output_dir.joinpath(Path(source).name.replace('.nc', '_recomputed.nc')).as_posix()
+    if Path(source_new).exists():
+        return source_new
+    if source_new == source:
+        raise ValueError("invalid tel.nc filename")
+    if cache_dir is None:
+        cache_dir = _get_fix_tel_cache_dir()
+    cache_dir = Path(cache_dir)
+    key = _hash_file(source, {
+        'version': _FIX_TEL_VERSION,
+        'erfa_interp_len': erfa_interp_len,
+        'max_error': max_error,
+        })
+    cache_filepath = cache_dir.joinpath(f'{key}.nc')
+    if not cache_filepath.exists():
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first so that incomplete files
+        # never get into the cache.
+        tmp_filepath = cache_dir.joinpath(f'{key}.nc.{os.getpid()}')
+        try:
+            shutil.copy(source, tmp_filepath)
+            _recompute_tel(
+                tmp_filepath,
+                erfa_interp_len=erfa_interp_len, max_error=max_error)
+            os.replace(tmp_filepath, cache_filepath)
+        finally:
+            if tmp_filepath.exists():
+                tmp_filepath.unlink()
+        _prune_fix_tel_cache(
+            cache_dir, cache_max_size, keep=cache_filepath)
+    else:
+        logger.debug(f"use cached recomputed tel.nc {cache_filepath}")
+    try:
+        # mark as recently used
+        os.utime(cache_filepath)
+        shutil.copy(cache_filepath, source_new)
+    except Exception:
+        raise ValueError("unable to create recomputed tel.nc")
+    return source_new
+
+
+def _recompute_tel(filepath, erfa_interp_len, max_error):
+    # recompute the tel.nc file in place
     logger = get_logger()
     import netCDF4
     from netCDF4 import Dataset
     from astropy.time import Time
     from astropy.coordinates import SkyCoord
-    from tollan.utils.fmt import pformat_yaml
     from tolteca.simu.toltec.toltec_info import toltec_info
     from tolteca.simu.toltec.models import pa_from_coords
-    source_new = output_dir.joinpath(Path(source).name.replace('.nc', '_recomputed.nc')).as_posix()
-    if Path(source_new).exists():
-        return source_new
-    if source_new != source:
-        try:
-            shutil.copy(source, source_new)
-        except Exception:
-            raise ValueError("unable to create recomputed tel.nc")
-    else:
-        raise ValueError("invalid tel.nc filename")
 
     observer = toltec_info['site']['observer']
-    tnc = Dataset(source_new, mode='a')
+    tnc = Dataset(filepath, mode='a')
     tel_time = Time(tnc['Data.TelescopeBackend.TelTime'][:], format='unix')
-    tel_t0 = tel_time[0]
-    tel_t = tel_time - tel_t0
 
     tel_az = tnc['Data.TelescopeBackend.TelAzAct'][:] << u.rad
     tel_alt = tnc['Data.TelescopeBackend.TelElAct'][:] << u.rad
@@ -794,7 +1105,8 @@ def _fix_tel(source, output_dir):
     tel_alt_tot = tel_alt - (tel_alt_cor)
     altaz_frame = observer.altaz(time=tel_time)
     tel_altaz = SkyCoord(tel_az_tot, tel_alt_tot, frame=altaz_frame)
-    tel_icrs_astropy = tel_altaz.transform_to('icrs')
+    tel_icrs_astropy = _transform_altaz_to_icrs(
+        tel_altaz, erfa_interp_len=erfa_interp_len, max_error=max_error)
 
     # 20230328 It seems that there are some rotation in final maps.
     # we switch the pa from using astroplan observer to that used in the
@@ -831,7 +1143,6 @@ def _fix_tel(source, output_dir):
     stat_change(pa, pa_orig, u.deg, 'ActParAng') 
     stat_change(tel_icrs_astropy.ra, ra_orig, u.arcsec, 'SourceRaAct') 
     stat_change(tel_icrs_astropy.dec, dec_orig, u.arcsec, 'SourceDecAct') 
-    return source_new
 
 
 def _fix_apt(source, output_dir):
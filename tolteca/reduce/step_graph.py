@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+import copy
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import traceback
+from concurrent.futures import (
+    ProcessPoolExecutor, wait, FIRST_COMPLETED)
+
+import dill
+from tollan.utils.log import get_logger, timeit
+
+from ..utils import get_cpu_slots
+
+
+__all__ = ['StepGraph', ]
+
+
+def _get_process_tree_rss(pid):
+    """Return the resident memory in bytes of `pid` and its descendants,
+    and the list of the pids."""
+    rss = 0
+    pids = list()
+    stack = [pid]
+    while stack:
+        p = stack.pop()
+        try:
+            with open(f'/proc/{p}/status', 'r') as fo:
+                for line in fo:
+                    if line.startswith('VmRSS:'):
+                        rss += int(line.split()[1]) * 1024
+                        break
+            children = list()
+            for tid in os.listdir(f'/proc/{p}/task'):
+                with open(f'/proc/{p}/task/{tid}/children', 'r') as fo:
+                    children.extend(int(c) for c in fo.read().split())
+        except (OSError, ValueError):
+            # the process has exited
+            continue
+        pids.append(p)
+        stack.extend(children)
+    return rss, pids
+
+
+def _init_step_worker(cpu_slots, n_threads):
+    # set the resource limits of the worker process. The CPU affinity and
+    # the thread caps are inherited by the subprocesses.
+    if cpu_slots is not None:
+        cpus = cpu_slots.get()
+        if cpus is not None and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpus)
+    if n_threads is not None:
+        for k in [
+                'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+            os.environ[k] = str(n_threads)
+
+
+def _run_step_child(payload, conn):
+    # this is run in the child process of the worker, and sends back the
+    # pickled output or exception.
+    try:
+        step, cfg, inputs = dill.loads(payload)
+        result = (True, dill.dumps(step.run(cfg, inputs=inputs)))
+    except Exception as e:
+        try:
+            result = (False, dill.dumps(e))
+        except Exception:
+            result = (False, dill.dumps(RuntimeError(
+                traceback.format_exc())))
+    conn.send(result)
+    conn.close()
+
+
+def _run_step_in_child(step_name, payload, max_memory, interval=0.5):
+    # run the step in a child process, which is killed along with its
+    # subprocesses when the resident memory exceeds max_memory.
+    mp_context = multiprocessing.get_context('fork')
+    conn_recv, conn_send = mp_context.Pipe(duplex=False)
+    proc = mp_context.Process(
+        target=_run_step_child, args=(payload, conn_send))
+    proc.start()
+    conn_send.close()
+    try:
+        while not conn_recv.poll(interval):
+            rss, pids = _get_process_tree_rss(proc.pid)
+            if rss <= max_memory:
+                continue
+            for p in pids:
+                try:
+                    os.kill(p, signal.SIGKILL)
+                except OSError:
+                    pass
+            raise MemoryError(
+                f"step {step_name} exceeds the memory limit")
+        try:
+            success, data = conn_recv.recv()
+        except EOFError:
+            proc.join()
+            raise RuntimeError(
+                f"step {step_name} exited unexpectedly "
+                f"with code {proc.exitcode}") from None
+    finally:
+        conn_recv.close()
+        proc.join()
+    if not success:
+        raise dill.loads(data)
+    return data
+
+
+def _run_step_pickled(step_name, payload, max_memory=None):
+    # the payload and the result are pickled with dill, which handles more
+    # types than pickle, e.g., the closures in the data objects.
+    if max_memory is not None:
+        return _run_step_in_child(step_name, payload, max_memory)
+    step, cfg, inputs = dill.loads(payload)
+    return dill.dumps(step.run(cfg, inputs=inputs))
+
+
+class StepGraph(object):
+    """A dependency graph of the pipeline steps.
+
+    The dependencies are resolved from the ``inputs`` and ``outputs`` data
+    kinds declared in the registry info of the steps. A step depends on
+    the latest preceding step that outputs any of its input kinds, and the
+    steps that do not depend on any step take the input data. Steps
+    without the declaration depend on the preceding step, as in a plain
+    sequential pipeline.
+
+    Parameters
+    ----------
+    steps : list
+        The list of the enabled step config objects.
+    registry : `~tolteca.utils.config_registry.ConfigRegistry`
+        The registry of the steps.
+    """
+
+    logger = get_logger()
+
+    def __init__(self, steps, registry):
+        self._steps = steps
+        self._deps = self._resolve_deps(steps, registry)
+
+    @property
+    def steps(self):
+        return self._steps
+
+    @property
+    def deps(self):
+        """The list of indices of the steps that each step depends on."""
+        return self._deps
+
+    @staticmethod
+    def _resolve_deps(steps, registry):
+        deps = list()
+        # the index of the latest step that outputs the data kind
+        producers = dict()
+        for i, step in enumerate(steps):
+            info = registry.get_info(step.name)
+            inputs = info.get('inputs', None)
+            outputs = info.get('outputs', None)
+            if inputs is None:
+                deps.append([i - 1] if i > 0 else [])
+            else:
+                # the output of a step without the declaration may be
+                # any kind.
+                deps.append(sorted({
+                    producers.get(k, producers.get(None))
+                    for k in inputs
+                    if k in producers or None in producers}))
+            if outputs is None:
+                producers.clear()
+                producers[None] = i
+                outputs = []
+            for k in outputs:
+                producers[k] = i
+        return deps
+
+    def _get_inputs(self, i, outputs, inputs):
+        deps = self._deps[i]
+        if not deps:
+            return inputs
+        if len(deps) == 1:
+            return outputs[deps[0]]
+        result = list()
+        for j in deps:
+            if isinstance(outputs[j], list):
+                result.extend(outputs[j])
+            elif outputs[j] is not None:
+                result.append(outputs[j])
+        return result
+
+    def _get_step_cfg(self, cfg, i):
+        # the concurrent steps get their own output dirs, because the
+        # engines such as citlali number the reductions in the output dir.
+        step_cfg = copy.copy(cfg)
+        step_cfg.jobkey = f'{cfg.jobkey}/{i}_{self._steps[i].name}'
+        return step_cfg
+
+    @staticmethod
+    def _get_step_config_dict(step):
+        if hasattr(step, 'to_dict'):
+            return step.to_dict()
+        return {
+            k: v for k, v in vars(step).items()
+            if not k.startswith('_') and k != 'logger'}
+
+    def _get_step_key(self, i, keys, inputs_key):
+        deps = self._deps[i]
+        step = self._steps[i]
+        h = hashlib.sha1(json.dumps(
+            {'name': step.name, 'config': self._get_step_config_dict(step)},
+            sort_keys=True, default=str).encode())
+        if not deps:
+            h.update(inputs_key.encode())
+        for j in deps:
+            h.update(keys[j].encode())
+        return h.hexdigest()
+
+    def run(
+            self, cfg, inputs, n_procs=1, n_cpus_per_proc=None,
+            max_memory=None, cache_dir=None, inputs_key=''):
+        """Run the steps and return the list of outputs.
+
+        Parameters
+        ----------
+        cfg : `~tolteca.reduce.ReduConfig`
+            The reduction config passed to the steps.
+        inputs : list
+            The input data of the steps that do not depend on other steps.
+        n_procs : int
+            The max number of steps to run concurrently. When larger than
+            1, the steps are run in worker processes, and the inputs and
+            outputs are pickled with dill. Each step then writes to the
+            sub directory ``<index>_<name>`` of the output directory.
+        n_cpus_per_proc : int, optional
+            The number of CPUs of each worker process. The thread caps of
+            the common threading libraries are set to this value for the
+            subprocesses, and the workers are pinned to disjoint sets of
+            CPUs if there are enough CPUs.
+        max_memory : int, optional
+            The max resident memory in bytes of each step and its
+            subprocesses. When set, each step is run in a child process of
+            the worker, which is killed if it exceeds the limit, and
+            `MemoryError` is raised. This requires the ``/proc`` file
+            system.
+        cache_dir : `pathlib.Path`, optional
+            If set, the outputs of the steps are saved in this directory,
+            keyed by the hash of the step config and its inputs, and the
+            steps with saved outputs are skipped.
+        inputs_key : str
+            The string that identifies `inputs`, used for the cache keys.
+        """
+        n_steps = len(self._steps)
+        outputs = [None] * n_steps
+        keys = [None] * n_steps
+        done = set()
+
+        def _get_cache_filepath(i):
+            if cache_dir is None:
+                return None
+            return cache_dir.joinpath(f'{self._steps[i].name}_{keys[i]}.pkl')
+
+        def _load_cache(i):
+            filepath = _get_cache_filepath(i)
+            if filepath is None or not filepath.exists():
+                return False
+            self.logger.info(
+                f"skip step [{i + 1}/{n_steps}] {self._steps[i].name}, "
+                f"use cached output {filepath}")
+            with open(filepath, 'rb') as fo:
+                outputs[i] = dill.load(fo)
+            return True
+
+        def _save_cache(i):
+            filepath = _get_cache_filepath(i)
+            if filepath is None:
+                return
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_filepath = filepath.with_suffix('.pkl.tmp')
+            with open(tmp_filepath, 'wb') as fo:
+                dill.dump(outputs[i], fo)
+            tmp_filepath.replace(filepath)
+
+        def _get_ready():
+            # steps in order whose deps are all done
+            return [
+                i for i in range(n_steps)
+                if i not in done and i not in running
+                and all(j in done for j in self._deps[i])]
+
+        def _prepare(i):
+            keys[i] = self._get_step_key(i, keys, inputs_key)
+            if _load_cache(i):
+                done.add(i)
+                return None
+            return self._get_inputs(i, outputs, inputs)
+
+        running = dict()
+        if n_procs <= 1:
+            for i in range(n_steps):
+                step_inputs = _prepare(i)
+                if i in done:
+                    continue
+                with timeit(
+                        f"run pipeline step [{i + 1}/{n_steps}] "
+                        f"{self._steps[i].name}",
+                        level='INFO',
+                        ):
+                    outputs[i] = self._steps[i].run(cfg, inputs=step_inputs)
+                _save_cache(i)
+                done.add(i)
+            return outputs
+
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise RuntimeError(
+                "running steps concurrently requires fork start method")
+        if max_memory is not None and not os.path.exists('/proc/self/task'):
+            self.logger.warning(
+                "memory limit requires the /proc file system, ignored.")
+            max_memory = None
+        mp_context = multiprocessing.get_context('fork')
+        cpu_slots = get_cpu_slots(n_procs, n_cpus_per_proc)
+        if cpu_slots is not None:
+            cpu_slots_queue = mp_context.Queue()
+            for cpus in cpu_slots:
+                cpu_slots_queue.put(cpus)
+        else:
+            cpu_slots_queue = None
+        with ProcessPoolExecutor(
+                max_workers=n_procs,
+                mp_context=mp_context,
+                initializer=_init_step_worker,
+                initargs=(cpu_slots_queue, n_cpus_per_proc),
+                ) as executor:
+            while len(done) < n_steps:
+                for i in _get_ready():
+                    step_inputs = _prepare(i)
+                    if i in done:
+                        continue
+                    self.logger.info(
+                        f"run pipeline step [{i + 1}/{n_steps}] "
+                        f"{self._steps[i].name}")
+                    running[i] = executor.submit(
+                        _run_step_pickled,
+                        self._steps[i].name,
+                        dill.dumps((
+                            self._steps[i],
+                            self._get_step_cfg(cfg, i),
+                            step_inputs)),
+                        max_memory=max_memory)
+                if not running:
+                    # the ready steps are loaded from the cache
+                    continue
+                finished, _ = wait(
+                    running.values(), return_when=FIRST_COMPLETED)
+                for i, future in list(running.items()):
+                    if future not in finished:
+                        continue
+                    del running[i]
+                    try:
+                        outputs[i] = dill.loads(future.result())
+                    except Exception:
+                        for f in running.values():
+                            f.cancel()
+                        raise
+                    self.logger.info(
+                        f"finished pipeline step [{i + 1}/{n_steps}] "
+                        f"{self._steps[i].name}")
+                    _save_cache(i)
+                    done.add(i)
+        return outputs
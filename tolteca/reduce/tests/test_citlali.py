@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+import threading
+from pathlib import Path
+
+import numpy as np
+import pytest
+import astropy.units as u
+from astropy.coordinates import AltAz, EarthLocation, SkyCoord
+from astropy.table import Table
+from astropy.time import Time
+
+from ..engines import citlali
+from ..engines.citlali import (
+    CitlaliExec, CitlaliProc, _fix_tel, _transform_altaz_to_icrs)
+
+
+def _make_citlali_exec(tmp_path):
+    # a fake citlali executable that echos the thread cap and the config,
+    # and fails if the config file says so.
+    exec_path = tmp_path.joinpath('citlali')
+    with open(exec_path, 'w') as fo:
+        fo.write(
+            '#!/bin/sh\n'
+            'echo "log_level=$2"\n'
+            'echo "n_threads=$OMP_NUM_THREADS"\n'
+            'cat "$3"\n'
+            'grep -q fail "$3" && exit 1\n'
+            'exit 0\n')
+    exec_path.chmod(0o755)
+    citlali_exec = CitlaliExec.__new__(CitlaliExec)
+    citlali_exec._path = exec_path
+    citlali_exec._version = 'test'
+    return citlali_exec
+
+
+def test_citlali_exec_run_streamed(tmp_path):
+    citlali_exec = _make_citlali_exec(tmp_path)
+    cfg_filepath = tmp_path.joinpath('citlali.yaml')
+    with open(cfg_filepath, 'w') as fo:
+        fo.write('ok\n')
+    lines = list()
+    assert citlali_exec.run_streamed(
+        cfg_filepath, log_level='DEBUG', logger_func=lines.append,
+        log_prefix='[o1] ', n_threads=2)
+    assert lines == ['[o1] log_level=debug', '[o1] n_threads=2', '[o1] ok']
+
+    with open(cfg_filepath, 'w') as fo:
+        fo.write('fail\n')
+    lines = list()
+    assert not citlali_exec.run_streamed(
+        cfg_filepath, logger_func=lines.append)
+    assert lines[-1] == 'fail'
+
+
+class _Citlali(object):
+    """A fake citlali engine that records the runs."""
+
+    def __init__(self, failed_names=None):
+        self.failed_names = failed_names or set()
+        self.runs = list()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'Citlali(test)'
+
+    def run_streamed(
+            self, config_file, log_level='INFO', logger_func=None,
+            log_prefix='', cpus=None, n_threads=None):
+        with self._lock:
+            self.runs.append((config_file.name, log_prefix, n_threads))
+        return not any(
+            f'o{name}_' in config_file.name for name in self.failed_names)
+
+
+def _make_citlali_proc(citlali):
+    proc = CitlaliProc.__new__(CitlaliProc)
+    proc._citlali = citlali
+
+    def _prepare_citlali_config(dataset, output_dir):
+        return {
+            'inputs': [
+                {'meta': {'name': '1'}},
+                {'meta': {'name': '1'}},
+                {'meta': {'name': '2'}},
+                ],
+            'runtime': {'n_threads': 1},
+            }
+
+    proc._prepare_citlali_config = _prepare_citlali_config
+    return proc
+
+
+def test_citlali_proc_run_groups(tmp_path):
+    citlali = _Citlali()
+    proc = _make_citlali_proc(citlali)
+    proc(None, tmp_path, n_procs=2, n_threads_per_proc=1)
+    # the duplicated names are renamed
+    assert sorted(citlali.runs) == [
+        ('citlali_o1_1_c1.yaml', '[o1_1] ', 1),
+        ('citlali_o1_c1.yaml', '[o1] ', 1),
+        ('citlali_o2_c1.yaml', '[o2] ', 1),
+        ]
+    for name in ['1', '1_1', '2']:
+        assert tmp_path.joinpath(f'o{name}').is_dir()
+    tbl = Table.read(
+        tmp_path.joinpath('citlali_groups.ecsv'), format='ascii.ecsv')
+    assert list(tbl['name']) == ['1', '1_1', '2']
+    assert list(tbl['output_dir']) == ['o1', 'o1_1', 'o2']
+    assert all(tbl['success'])
+
+
+def test_citlali_proc_run_groups_failed(tmp_path):
+    citlali = _Citlali(failed_names={'1_1'})
+    proc = _make_citlali_proc(citlali)
+    with pytest.raises(RuntimeError, match='citlali_o1_1_c1.yaml'):
+        proc(None, tmp_path, n_procs=2)
+    # all the groups are run and reported
+    assert len(citlali.runs) == 3
+    tbl = Table.read(
+        tmp_path.joinpath('citlali_groups.ecsv'), format='ascii.ecsv')
+    assert list(tbl['success']) == [True, False, True]
+
+
+def test_citlali_proc_run_groups_dry_run(tmp_path):
+    citlali = _Citlali()
+    proc = _make_citlali_proc(citlali)
+    lines = list()
+    assert proc(
+        None, tmp_path, logger_func=lines.append, dry_run=True,
+        n_procs=2) is None
+    assert not citlali.runs
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        'citlali_o1_1_c1.yaml', 'citlali_o1_c1.yaml', 'citlali_o2_c1.yaml']
+    assert lines[-1] == "dry run's done."
+
+
+def _make_altaz_track(n_samples):
+    location = EarthLocation.from_geodetic(
+        -97.31481605209875 * u.deg, 18.98578175043638 * u.deg, 4600 * u.m)
+    t = Time('2022-03-04T05:06:07') + np.linspace(0, 3600, n_samples) * u.s
+    az = (120. + 20. * np.sin(np.linspace(0, 20, n_samples))) << u.deg
+    alt = (50. + 5. * np.cos(np.linspace(0, 30, n_samples))) << u.deg
+    return SkyCoord(az, alt, frame=AltAz(obstime=t, location=location))
+
+
+def test_transform_altaz_to_icrs():
+    coords_altaz = _make_altaz_track(1000)
+    coords_icrs_exact = coords_altaz.transform_to('icrs')
+    coords_icrs = _transform_altaz_to_icrs(
+        coords_altaz, max_error=np.inf << u.arcsec)
+    assert coords_icrs.separation(coords_icrs_exact).max() < 0.1 << u.arcsec
+    # the exact transform is used when the error is too large
+    coords_icrs = _transform_altaz_to_icrs(
+        coords_altaz, max_error=0. << u.arcsec)
+    assert coords_icrs.separation(coords_icrs_exact).max() < 1e-6 << u.arcsec
+    coords_icrs = _transform_altaz_to_icrs(coords_altaz, erfa_interp_len=None)
+    assert coords_icrs.separation(coords_icrs_exact).max() < 1e-6 << u.arcsec
+
+
+def test_fix_tel_cache(tmp_path, monkeypatch):
+    n_recomputed = list()
+
+    def _recompute_tel(filepath, erfa_interp_len, max_error):
+        n_recomputed.append(filepath)
+        with open(filepath, 'a') as fo:
+            fo.write('recomputed\n')
+
+    monkeypatch.setattr(citlali, '_recompute_tel', _recompute_tel)
+    cache_dir = tmp_path.joinpath('cache')
+    sources = list()
+    for i in range(2):
+        source = tmp_path.joinpath(f'tel_toltec_{i}.nc')
+        with open(source, 'w') as fo:
+            fo.write(f'tel {i}\n')
+        sources.append(source.as_posix())
+
+    def _run(source, name):
+        output_dir = tmp_path.joinpath(name)
+        output_dir.mkdir(exist_ok=True)
+        result = _fix_tel(
+            source, output_dir, cache_dir=cache_dir, cache_max_size=20)
+        with open(result, 'r') as fo:
+            return Path(result).name, fo.read()
+
+    assert _run(sources[0], 'redu0') == (
+        'tel_toltec_0_recomputed.nc', 'tel 0\nrecomputed\n')
+    assert len(n_recomputed) == 1
+    # the second call copies from the cache
+    assert _run(sources[0], 'redu1') == (
+        'tel_toltec_0_recomputed.nc', 'tel 0\nrecomputed\n')
+    assert len(n_recomputed) == 1
+    assert len(list(cache_dir.iterdir())) == 1
+    # each cached file is 17 bytes, the least recently used ones are
+    # removed to keep the cache under 20 bytes.
+    _run(sources[1], 'redu2')
+    assert len(n_recomputed) == 2
+    assert len(list(cache_dir.iterdir())) == 1
+    _run(sources[1], 'redu3')
+    assert len(n_recomputed) == 2
+    _run(sources[0], 'redu4')
+    assert len(n_recomputed) == 3
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+from ..step_graph import StepGraph
+
+
+class _Registry(object):
+
+    _info = {
+        'reduce': {'inputs': ['raw'], 'outputs': ['dp']},
+        'analyze': {'inputs': ['dp'], 'outputs': ['catalog']},
+        'inject': {'inputs': ['raw'], 'outputs': ['simu']},
+        'custom': {},
+        'alloc': {'inputs': ['raw'], 'outputs': ['alloc']},
+        'env': {'inputs': ['raw'], 'outputs': ['env']},
+        'fail': {'inputs': ['raw'], 'outputs': ['fail']},
+        }
+
+    def get_info(self, key):
+        return self._info[key]
+
+
+class _Config(object):
+
+    jobkey = 'test'
+
+
+class _Step(object):
+
+    def __init__(self, name, tag):
+        self.name = name
+        self.tag = tag
+
+    def to_dict(self):
+        return {'tag': self.tag}
+
+    def run(self, cfg, inputs=None):
+        return [f'{self.tag}({i})@{cfg.jobkey}' for i in inputs]
+
+
+def test_step_graph_deps():
+    steps = [
+        _Step('reduce', 'r'),
+        _Step('inject', 's'),
+        _Step('analyze', 'a'),
+        _Step('custom', 'c'),
+        _Step('analyze', 'b'),
+        ]
+    step_graph = StepGraph(steps, _Registry())
+    # custom steps depend on the preceding step, and the steps after
+    # them depend on the custom steps, unless the inputs are produced
+    # by the later steps.
+    assert step_graph.deps == [[], [], [0], [2], [3]]
+    steps = [
+        _Step('custom', 'c'),
+        _Step('inject', 's'),
+        _Step('reduce', 'r'),
+        _Step('analyze', 'a'),
+        ]
+    step_graph = StepGraph(steps, _Registry())
+    assert step_graph.deps == [[], [0], [0], [2]]
+
+
+def test_step_graph_step_key():
+
+    class _ObjStep(_Step):
+        def to_dict(self):
+            # the object has a default repr with the id in it.
+            return {'tag': self.tag, 'obj': None}
+
+    steps = [_ObjStep('reduce', 'r')]
+    steps[0].obj = object()
+    keys = [None]
+    key = StepGraph(steps, _Registry())._get_step_key(0, keys, 'x')
+    steps[0].obj = object()
+    assert StepGraph(steps, _Registry())._get_step_key(0, keys, 'x') == key
+    steps[0].tag = 'r2'
+    assert StepGraph(steps, _Registry())._get_step_key(0, keys, 'x') != key
+
+
+@pytest.mark.parametrize('n_procs', [1, 2])
+def test_step_graph_run(tmp_path, n_procs):
+    steps = [
+        _Step('reduce', 'r'),
+        _Step('inject', 's'),
+        _Step('analyze', 'a'),
+        ]
+    step_graph = StepGraph(steps, _Registry())
+    cfg = _Config()
+    outputs = step_graph.run(
+        cfg, ['x'], n_procs=n_procs, cache_dir=tmp_path)
+    if n_procs == 1:
+        assert outputs == [
+            ['r(x)@test'], ['s(x)@test'], ['a(r(x)@test)@test']]
+    else:
+        # concurrent steps have separate output dirs
+        assert outputs == [
+            ['r(x)@test/0_reduce'],
+            ['s(x)@test/1_inject'],
+            ['a(r(x)@test/0_reduce)@test/2_analyze']]
+    assert cfg.jobkey == 'test'
+    assert len(list(tmp_path.glob('*.pkl'))) == 3
+
+    # re-run with the cached outputs
+    steps[0].run = None
+    assert step_graph.run(
+        cfg, ['x'], n_procs=n_procs, cache_dir=tmp_path) == outputs
+    # the cache is invalidated by the change in the config of the
+    # upstream step
+    steps[0] = _Step('reduce', 'r2')
+    step_graph = StepGraph(steps, _Registry())
+    assert step_graph.run(
+        cfg, ['x'], n_procs=n_procs, cache_dir=tmp_path)[2][0].startswith(
+            'a(r2(x)')
+
+
+class _AllocStep(object):
+
+    name = 'alloc'
+
+    def run(self, cfg, inputs=None):
+        data = np.ones((200 << 20, ), dtype='u1')
+        time.sleep(2)
+        return data.sum()
+
+
+class _EnvStep(object):
+
+    name = 'env'
+
+    def run(self, cfg, inputs=None):
+        return (
+            os.environ.get('OMP_NUM_THREADS'),
+            len(os.sched_getaffinity(0)))
+
+
+class _FailStep(object):
+
+    name = 'fail'
+
+    def run(self, cfg, inputs=None):
+        raise ValueError("step failed")
+
+
+@pytest.mark.skipif(
+    not os.path.exists('/proc/self/task'), reason='requires /proc')
+def test_step_graph_run_in_child():
+    # the steps are run in child processes when max_memory is set
+    step_graph = StepGraph([_Step('reduce', 'r')], _Registry())
+    assert step_graph.run(
+        _Config(), ['x'], n_procs=2, max_memory=1 << 30) == [
+            ['r(x)@test/0_reduce']]
+    step_graph = StepGraph([_FailStep()], _Registry())
+    with pytest.raises(ValueError, match='step failed'):
+        step_graph.run(_Config(), ['x'], n_procs=2, max_memory=1 << 30)
+
+
+@pytest.mark.skipif(
+    not os.path.exists('/proc/self/task'), reason='requires /proc')
+def test_step_graph_resource_limits():
+    step_graph = StepGraph([_EnvStep(), _EnvStep()], _Registry())
+    outputs = step_graph.run(_Config(), ['x'], n_procs=2, n_cpus_per_proc=1)
+    n_cpus = len(os.sched_getaffinity(0))
+    for n_threads, n_cpus_worker in outputs:
+        assert n_threads == '1'
+        # the workers are pinned only when there are enough CPUs
+        assert n_cpus_worker == (1 if n_cpus >= 2 else n_cpus)
+
+
+@pytest.mark.skipif(
+    not os.environ.get('TOLTECA_TEST_BENCHMARK', None)
+    or not os.path.exists('/proc/self/task'),
+    reason='set TOLTECA_TEST_BENCHMARK to run the memory limit test')
+def test_step_graph_memory_limit():
+    step_graph = StepGraph([_AllocStep()], _Registry())
+    with pytest.raises(MemoryError, match='exceeds the memory limit'):
+        step_graph.run(_Config(), ['x'], n_procs=2, max_memory=100 << 20)
+    # the steps within the limit are run in the child processes too
+    step_graph = StepGraph([_EnvStep(), _AllocStep()], _Registry())
+    outputs = step_graph.run(
+        _Config(), ['x'], n_procs=2, max_memory=400 << 20)
+    assert outputs[1] == 200 << 20
@@ -468,7 +468,10 @@ class MinkasiExecutor(object):
         return hdu
 
 
-@steps_registry.register('minkasi')
+@steps_registry.register('minkasi', info={
+    'inputs': ['data_prod'],
+    'outputs': ['data_prod'],
+    })
 @add_schema
 @dataclass
 class MinkasiStepConfig():
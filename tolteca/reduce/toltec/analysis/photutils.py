@@ -33,7 +33,10 @@ from ... import steps_registry
 from ....simu.toltec.toltec_info import toltec_info
 
 
-@steps_registry.register('photutils')
+@steps_registry.register('photutils', info={
+    'inputs': ['data_prod'],
+    'outputs': ['source_catalog'],
+    })
 @add_schema
 @dataclass
 class PhotUtilsStepConfig():
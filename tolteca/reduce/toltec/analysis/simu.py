@@ -26,7 +26,10 @@ from ....simu.toltec.toltec_info import toltec_info
 from ....simu.toltec.simulator import ToltecObsSimulator
 from ....simu.utils import make_time_grid, SkyBoundingBox
 
-@steps_registry.register('simu')
+@steps_registry.register('simu', info={
+    'inputs': ['basic_obs_dataset'],
+    'outputs': ['simu_output_dir'],
+    })
 @add_schema
 @dataclass
 class SimuStepConfig():
@@ -6,6 +6,7 @@ from dataclasses import dataclass, field
 from cached_property import cached_property
 import copy
 from typing import ClassVar
+from pathlib import Path
 from schema import Or
 
 from tollan.utils.dataclass_schema import add_schema
@@ -13,11 +14,12 @@ from tollan.utils.log import get_logger, logit, log_to_file, timeit
 from tollan.utils.fmt import pformat_yaml
 from tollan.utils import rupdate
 
-from ..utils.common_schema import PhysicalTypeSchema
+from ..utils.common_schema import PhysicalTypeSchema, RelPathSchema
 from ..utils.config_registry import ConfigRegistry
 from ..utils.config_schema import add_config_schema
 from ..utils import RuntimeBase, RuntimeBaseError
 from ..utils.doc_helper import collect_config_item_types
+from .utils import iter_eval_chunks, WriteBehindWriter
 
 
 __all__ = [
@@ -83,6 +85,17 @@ class PerfParamsConfig(object):
             'schema': PhysicalTypeSchema("angle"),
             }
         )
+    catalog_model_eval_method: str = field(
+        default='render',
+        metadata={
+            'description': (
+                'The method to evaluate catalog source model. '
+                '"render" renders the catalog to images, and "direct" '
+                'sums the beam response of the nearby sources for each '
+                'detector sample.'),
+            'schema': Or('render', 'direct'),
+            }
+        )
     mapping_eval_interp_len: Union[u.Quantity, None] = field(
         default=None,
         metadata={
@@ -122,6 +135,56 @@ class PerfParamsConfig(object):
             'description': 'Size of time grid used for pre-eval calculations.',
             }
         )
+    n_workers: int = field(
+        default=1,
+        metadata={
+            'description': (
+                'Number of worker processes to evaluate the time chunks '
+                'in parallel.'),
+            }
+        )
+    max_inflight_chunks: Union[int, None] = field(
+        default=None,
+        metadata={
+            'description': (
+                'Max number of chunks being evaluated or waiting to be '
+                'written. Default is twice the number of workers.'),
+            'schema': Or(None, int),
+            }
+        )
+    write_behind_queue_size: Union[int, None] = field(
+        default=None,
+        metadata={
+            'description': (
+                'Max number of simulated chunks waiting to be written by '
+                'the background writer thread. Default is to write the '
+                'chunks synchronously.'),
+            'schema': Or(None, int),
+            }
+        )
+    traj_store_dir: Union[Path, None] = field(
+        default=None,
+        metadata={
+            'description': (
+                'The directory to store the memory-mapped sky trajectory '
+                'arrays. When set, the store is used even with one '
+                'worker. Default is /dev/shm if it exists and the system '
+                'temporary directory otherwise, and the store is only '
+                'used when n_workers > 1.'),
+            'schema': Or(None, RelPathSchema(check_exists=False)),
+            }
+        )
+    sky_proj_engine: str = field(
+        default='exact',
+        metadata={
+            'description': (
+                'The engine to project detector positions on sky. '
+                '"exact" transforms all detector positions to ICRS, '
+                '"small_field" and "vectorized" rotate the detector '
+                'offsets around the boresight.'),
+            'schema': Or('exact', 'small_field', 'vectorized'),
+            }
+        )
 
     anim_frame_rate: u.Quantity = field(
         default=1 << u.Hz,
@@ -254,7 +317,10 @@ class SimuConfig(object):
     output_context: dict = field(
         default_factory=dict,
         metadata={
-            'description': 'Dict passed to output_context call.',
+            'description': (
+                'Dict passed to output_context call. For the toltec '
+                'simulator, `nc_layout` can be set to a preset name or '
+                'a dict to control the layout of the output files.'),
             }
         )
 
@@ -421,23 +487,28 @@ class SimulatorRuntime(RuntimeBase):
 
                     n_chunks = len(t_chunks)
                     # run simulator for each chunk and save the data
-                    with timeit("creating simulated data"):
-                        # from loky import set_loky_pickler
-                        # set_loky_pickler("dill")
-                        # from loky import get_reusable_executor
-                        # executor = get_reusable_executor(max_workers=4)
-                        # for ci, iter_data in enumerate(
-                        #         executor.map(iter_eval, t_chunks)):
-                        #     t = iter_data['t']
-                        #     self.logger.info(
-                        #         f"simulated chunk {ci}/{n_chunks} "
-                        #         f"t_min={t.min()} t_max={t.max()}")
-                        #     output_ctx.write_sim_data(iter_data)
-                        for ci, t in enumerate(t_chunks):
+                    # the chunks are evaluated in the worker processes
+                    # when perf_params.n_workers > 1, and are
+                    # written in order.
+                    perf_params = cfg.perf_params
+                    # the data are written in a background thread
+                    # when perf_params.write_behind_queue_size is set.
+                    writer = WriteBehindWriter(
+                        output_ctx.write_sim_data,
+                        max_queued=perf_params.write_behind_queue_size)
+                    with timeit("creating simulated data"), writer:
+                        for ci, data in iter_eval_chunks(
+                                iter_eval, t_chunks,
+                                reduce_func=output_ctx.make_sim_data_payload,
+                                n_workers=perf_params.n_workers,
+                                max_inflight_chunks=(
+                                    perf_params.max_inflight_chunks),
+                                ):
+                            t = t_chunks[ci]
                             self.logger.info(
-                                f"simulate chunk {ci}/{n_chunks} "
+                                f"simulated chunk {ci}/{n_chunks} "
                                 f"t_min={t.min()} t_max={t.max()}")
-                            output_ctx.write_sim_data(iter_eval(t))
+                            writer.submit(data)
         return output_dir
 
     def plot(self, type, **kwargs):
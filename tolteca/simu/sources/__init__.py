@@ -57,13 +57,20 @@ class ImageSourceConfig(DataclassNamespace):
             description=(
                 "The assignments of FITS extensions to data item labels."
                 )): _make_data_item_schema(
-                    "extname", "The FITS extension name")
+                    "extname", "The FITS extension name"),
+        Optional(
+            'interp_mode',
+            default='nearest',
+            description=(
+                "The interpolation mode to get the image values at "
+                "the detector positions.")): Or('nearest', 'bilinear'),
         })
 
     def __call__(self, cfg):
         return ImageSourceModel.from_file(
             self.filepath,
             data_exts=self.data_exts,
+            interp_mode=self.interp_mode,
             )
 
 
@@ -8,6 +8,8 @@ from astropy.coordinates import SkyCoord
 from astropy.table import Table, QTable
 from astropy.modeling import models
 from astropy.modeling.functional_models import GAUSSIAN_SIGMA_TO_FWHM
+from scipy.spatial import cKDTree
+from scipy.signal import fftconvolve
 
 # from tollan.utils.fmt import pformat_yaml
 from tollan.utils.log import get_logger, timeit
@@ -20,6 +22,76 @@ from ..utils import SkyBoundingBox
 __all__ = ['ImageSourceModel', 'CatalogSourceModel']
 
 
+# a special value used to indicate data array for non polarized
+# evaluation
+_UNPOLARIZED = object()
+
+
+def _resolve_eval_data_keys(data_tbl, eval_polarized, eval_hwp=False):
+    """Return the data table and the data keys to evaluate.
+
+    The data keys are the Stokes parameters for polarized evaluation,
+    or ``[_UNPOLARIZED]`` otherwise.
+    """
+    logger = get_logger()
+    logger.debug(f"eval_polarized={eval_polarized} eval_hwp={eval_hwp}")
+    if 'stokes_param' not in data_tbl.colnames:
+        stokes_params = None
+    else:
+        stokes_params = np.unique(data_tbl['stokes_param'])
+    # check if stokes_params exists for polarized eval
+    if not eval_polarized and (
+        stokes_params is not None and set(stokes_params).intersection(
+            {'Q', 'U'})):
+        logger.warning(
+            "stokes_param Q and U are ignored because "
+            "no position angles are provided for polarized eval"
+            )
+        # in this case we only use the data_tbl with the stokes I
+        data_tbl = data_tbl[data_tbl['stokes_param'] == 'I']
+    elif eval_polarized and stokes_params is None:
+        raise ValueError(
+            "stokes_param is required for polarized evaluation")
+    if not eval_polarized:
+        return data_tbl, [_UNPOLARIZED]
+    return data_tbl, stokes_params
+
+
+def _get_data_key_entry(group, data_key):
+    """Return the entry in `group` for `data_key`."""
+    if data_key is _UNPOLARIZED:
+        # just use the only entry here for as input
+        return group[0]
+    # evaluate for the entry with matching stokes_param
+    entry = group[group['stokes_param'] == data_key]
+    assert len(entry) == 1
+    return entry[0]
+
+
+def _mix_stokes_params(s_outs, det_pa_icrs=None, hwp_pa_icrs=None):
+    """Return the detector signal from the Stokes parameters `s_outs`."""
+    if _UNPOLARIZED in s_outs:
+        # non polarized case
+        return s_outs[_UNPOLARIZED]
+    # mix the I Q and U
+    get_logger().debug(f"mix s_outs for stokes_params {s_outs.keys()}")
+    sb_zero = 0 << u.MJy / u.sr
+    I = s_outs.get('I', sb_zero)  # noqa: E741
+    Q = s_outs.get('Q', sb_zero)
+    U = s_outs.get('U', sb_zero)
+    if hwp_pa_icrs is None:
+        return (
+            I
+            + Q * np.cos(2. * det_pa_icrs)
+            + U * np.sin(2. * det_pa_icrs)
+            )
+    return (
+        I
+        + Q * np.cos(4. * hwp_pa_icrs - 2. * det_pa_icrs)
+        + U * np.sin(4. * hwp_pa_icrs - 2. * det_pa_icrs)
+        )
+
+
 class ImageSourceModel(SurfaceBrightnessModel):
     """The class for simulator source from FITS image.
 
@@ -30,6 +102,9 @@ class ImageSourceModel(SurfaceBrightnessModel):
         expected as the first argument of the model evaluation.
         The dict values can alternatively be a dict of keys I, Q and
         U for polarized data.
+    interp_mode : {"nearest", "bilinear"}
+        The interpolation mode to get the image values at the detector
+        positions.
     """
 
     logger = get_logger()
@@ -37,8 +112,15 @@ class ImageSourceModel(SurfaceBrightnessModel):
     n_inputs = 4
     n_outputs = 1
 
-    def __init__(self, hdulist, data_exts=None, **kwargs):
+    _interp_modes = ['nearest', 'bilinear']
+
+    def __init__(
+            self, hdulist, data_exts=None, interp_mode='nearest', **kwargs):
         super().__init__(**kwargs)
+        if interp_mode not in self._interp_modes:
+            raise ValueError(f"invalid interp_mode {interp_mode}")
+        self._interp_mode = interp_mode
+        self._wcs_info_cache = dict()
         self.inputs = ('label', 'lon', 'lat', 'pa')
         self._hdulist = hdulist
 
@@ -91,26 +173,65 @@ class ImageSourceModel(SurfaceBrightnessModel):
     def data(self):
         return self._data
 
-    @classmethod
-    def _set_data_for_hdu(
-            cls, hdu, det_ra, det_dec, s_out_mask, s_out):
-        """Populate `s_out` using data from `hdu`."""
-        logger = get_logger()
-        # check lon lat range of hdu and re-wrap longitude for proper
-        # range check
+    @property
+    def interp_mode(self):
+        return self._interp_mode
+
+    @staticmethod
+    def _get_hdu_unit(hdu):
         if 'SIGUNIT' in hdu.header:
-            s_out_unit = u.Unit(hdu.header['SIGUNIT'])
-        elif 'BUNIT' in hdu.header:
-            s_out_unit = u.Unit(hdu.header['BUNIT'])
-        else:
-            s_out_unit = u.adu
+            return u.Unit(hdu.header['SIGUNIT'])
+        if 'BUNIT' in hdu.header:
+            return u.Unit(hdu.header['BUNIT'])
+        return u.adu
+
+    def _get_wcs_info(self, extname, hdu):
+        """Return the WCS info of `hdu`, which is cached by `extname`.
+
+        The returned dict has a `key` that is shared by HDUs with the
+        same WCS and data shape.
+        """
+        if extname in self._wcs_info_cache:
+            return self._wcs_info_cache[extname]
         wcsobj = WCS(hdu.header)
-        ny, nx = data_shape = hdu.data.shape
+        data_shape = hdu.data.shape
         sky_bbox = SkyBoundingBox.from_wcs(wcsobj, data_shape)
-        logger.debug(
-            f"data bbox: w={sky_bbox.w} e={sky_bbox.e} "
-            f"s={sky_bbox.s} n={sky_bbox.n}")
-        logger.debug(f'data shape: {data_shape}')
+        self.logger.debug(
+            f"data bbox of {extname}: w={sky_bbox.w} e={sky_bbox.e} "
+            f"s={sky_bbox.s} n={sky_bbox.n} shape={data_shape}")
+        wcs_info = self._wcs_info_cache[extname] = {
+            'key': (wcsobj.to_header_string(relax=True), data_shape),
+            'wcs': wcsobj,
+            'data_shape': data_shape,
+            'sky_bbox': sky_bbox,
+            }
+        return wcs_info
+
+    @classmethod
+    def _get_pixel_index(
+            cls, wcs_info, det_ra, det_dec, interp_mode='nearest'):
+        """Return the pixel indices of the detector positions.
+
+        Parameters
+        ----------
+        wcs_info : dict
+            The WCS info returned by :meth:`_get_wcs_info`.
+        det_ra, det_dec : `astropy.coordinates.Angle`
+            The detector positions.
+        interp_mode : {"nearest", "bilinear"}
+            The interpolation mode.
+
+        Returns
+        -------
+        dict or None
+            The pixel index, which has the mask `g` of the detector
+            positions within the image and the pixel indices of them.
+            None if no detector positions overlap with the image.
+        """
+        logger = get_logger()
+        wcsobj = wcs_info['wcs']
+        sky_bbox = wcs_info['sky_bbox']
+        ny, nx = wcs_info['data_shape']
         # to make it simple we work in deg explicitly
         # here we also re-wrap the ra to be consistent with the sky bbox.
         det_ra_deg = det_ra.wrap_at(sky_bbox.lon_wrap_angle).degree
@@ -124,75 +245,84 @@ class ImageSourceModel(SurfaceBrightnessModel):
                 )
         logger.debug(f"data group mask {g.sum()}/{det_dec.size}")
         if g.sum() == 0:
-            # skip because no overlap between detectors and sky bbox
-            return
+            # no overlap between detectors and sky bbox
+            return None
         # convert all detector posistions to x y
         x_g, y_g = wcsobj.wcs_world2pix(det_ra_deg[g], det_dec_deg[g], 0)
-        ii = np.rint(y_g).astype(int)
-        jj = np.rint(x_g).astype(int)
-        logger.debug(
-                f"pixel range: [{ii.min()}, {ii.max()}] "
-                f"[{jj.min()}, {jj.max()}]")
-        # check ii and jj for valid pixel range
-        gp = (ii >= 0) & (ii < ny) & (jj >= 0) & (jj < nx)
-        # update g to include only valid pixels
-        g[g] = gp
-        # TODO this seems to be unnecessary
-        # convert all lon lat to x y with update mask g
-        x_g, y_g = wcsobj.wcs_world2pix(det_ra_deg[g], det_dec_deg[g], 0)
-        ii = np.rint(y_g).astype(int)
-        jj = np.rint(x_g).astype(int)
-        logger.debug(
-                f"pixel range updated: [{ii.min()}, {ii.max()}] "
-                f"[{jj.min()}, {jj.max()}]")
-        ig, jg = np.where(g)
-        s = hdu.data[ii, jj] << s_out_unit
-        logger.debug(
-            f'detector signal range: [{s.min()}, {s.max()}]')
-        # combine the mask with overlapping mask
-        s_out[np.flatnonzero(s_out_mask)[ig], jg] = s
+        if interp_mode == 'nearest':
+            ii = np.rint(y_g).astype(int)
+            jj = np.rint(x_g).astype(int)
+            # check ii and jj for valid pixel range
+            gp = (ii >= 0) & (ii < ny) & (jj >= 0) & (jj < nx)
+            # update g to include only valid pixels
+            g[g] = gp
+            if not np.any(gp):
+                return None
+            return {'g': g, 'ii': ii[gp], 'jj': jj[gp]}
+        if interp_mode == 'bilinear':
+            gp = (y_g >= 0) & (y_g <= ny - 1) & (x_g >= 0) & (x_g <= nx - 1)
+            g[g] = gp
+            if not np.any(gp):
+                return None
+            y_g = y_g[gp]
+            x_g = x_g[gp]
+            # clip the lower corner so the upper corner is always valid
+            ii = np.clip(np.floor(y_g).astype(int), 0, max(ny - 2, 0))
+            jj = np.clip(np.floor(x_g).astype(int), 0, max(nx - 2, 0))
+            return {
+                'g': g, 'ii': ii, 'jj': jj,
+                'wy': y_g - ii, 'wx': x_g - jj,
+                }
+        raise ValueError(f"invalid interp_mode {interp_mode}")
+
+    @staticmethod
+    def _gather_pixel_data(pixel_index, planes):
+        """Return the values of each of the 2-d `planes` at `pixel_index`.
+
+        The planes are gathered one at a time so that no copy of the
+        image data is made.
+        """
+        ii = pixel_index['ii']
+        jj = pixel_index['jj']
+        if 'wy' not in pixel_index:
+            return [data[ii, jj] for data in planes]
+        ny, nx = planes[0].shape
+        wy = pixel_index['wy']
+        wx = pixel_index['wx']
+        ii1 = np.minimum(ii + 1, ny - 1)
+        jj1 = np.minimum(jj + 1, nx - 1)
+        w00 = (1. - wy) * (1. - wx)
+        w10 = wy * (1. - wx)
+        w01 = (1. - wy) * wx
+        w11 = wy * wx
+        return [
+            data[ii, jj] * w00
+            + data[ii1, jj] * w10
+            + data[ii, jj1] * w01
+            + data[ii1, jj1] * w11
+            for data in planes]
 
     def evaluate_tod_icrs(
             self,
             det_array_name, det_ra, det_dec,
             det_pa_icrs=None,
-            hwp_pa_icrs=None):
-        """Return signal data."""
-        data_tbl = self.data
-        eval_polarized = det_pa_icrs is not None
-        eval_hwp = hwp_pa_icrs is not None
-        self.logger.debug(
-            f"eval_polarized={eval_polarized} eval_hwp={eval_hwp}")
+            hwp_pa_icrs=None,
+            interp_mode=None):
+        """Return signal data.
 
-        if 'stokes_param' not in data_tbl.colnames:
-            stokes_params = None
-        else:
-            stokes_params = np.unique(data_tbl['stokes_param'])
-        # check if stokes_params exists for polarized eval
-        if not eval_polarized and (
-            stokes_params is not None and set(stokes_params).intersection(
-                {'Q', 'U'})):
-            self.logger.warning(
-                "stokes_param Q and U are ignored because "
-                "no position angles are provided for polarized eval"
-                )
-            # in this case we only use the data_tbl with the stokes I
-            data_tbl = data_tbl[data_tbl['stokes_param'] == 'I']
-            # this won't be used but just for consistency
-            stokes_params = ['I']
-        elif eval_polarized and stokes_params is None:
-            raise ValueError(
-                "stokes_param is required for polarized evaluation")
-        else:
-            # good to go
-            pass
-        # a special value used to indicate data array for non polarized
-        # evaluation
-        UNPOLARIZED = object()
-        if not eval_polarized:
-            data_keys = [UNPOLARIZED]
-        else:
-            data_keys = stokes_params
+        The pixel indices of the detector positions are computed once
+        for each array and WCS, and are shared among the Stokes
+        parameters.
+
+        `interp_mode` is one of ``nearest`` and ``bilinear``, and
+        defaults to the `interp_mode` of the model.
+        """
+        if interp_mode is None:
+            interp_mode = self.interp_mode
+        eval_polarized = det_pa_icrs is not None
+        data_tbl, data_keys = _resolve_eval_data_keys(
+            self.data, eval_polarized,
+            eval_hwp=hwp_pa_icrs is not None)
         data_by_array_name = data_tbl.group_by('array_name')
         s_outs = {
             k: np.zeros(det_ra.shape) << u.MJy / u.sr
@@ -208,45 +338,38 @@ class ImageSourceModel(SurfaceBrightnessModel):
             self.logger.debug(
                 f"evaluate {m.sum()}/{len(m)} "
                 f"detector signals for array_name={array_name}")
+            # group the data keys by the WCS so that the pixel index
+            # is computed once and the data are gathered in one pass.
+            entries_by_wcs = dict()
             for data_key in data_keys:
-                if data_key is UNPOLARIZED:
-                    # just use the only entry here for as input
-                    entry = group[0]
-                else:
-                    # evaluate for the entry with matching stokes_param
-                    entry = group[group['stokes_param'] == data_key]
-                    assert len(entry) == 1
-                    entry = entry[0]
-                self.logger.debug(
-                    f"get data from hdu {entry['extname']}")
-                # get data into the s_out array
-                hdu = entry['hdu']
-                self._set_data_for_hdu(
-                    hdu=hdu,
-                    det_ra=det_ra[m],
-                    det_dec=det_dec[m],
-                    s_out_mask=m,
-                    s_out=s_outs[data_key])
-        if not eval_polarized:
-            # non polarized case
-            return s_outs[data_key]
-        # mix the I Q and U
-        self.logger.debug(f"mix s_outs for stokes_params {s_outs.keys()}")
-        sb_zero = 0 << u.MJy / u.sr
-        I = s_outs.get('I', sb_zero)  # noqa: E741
-        Q = s_outs.get('Q', sb_zero)
-        U = s_outs.get('U', sb_zero)
-        if not eval_hwp:
-            return (
-                I
-                + Q * np.cos(2. * det_pa_icrs)
-                + U * np.sin(2. * det_pa_icrs)
-                )
-        return (
-            I
-            + Q * np.cos(4. * hwp_pa_icrs - 2. * det_pa_icrs)
-            + U * np.sin(4. * hwp_pa_icrs - 2. * det_pa_icrs)
-            )
+                entry = _get_data_key_entry(group, data_key)
+                wcs_info = self._get_wcs_info(entry['extname'], entry['hdu'])
+                entries_by_wcs.setdefault(
+                    wcs_info['key'], (wcs_info, list()))[1].append(
+                        (data_key, entry))
+            det_ra_m = det_ra[m]
+            det_dec_m = det_dec[m]
+            for wcs_key, (wcs_info, entries) in entries_by_wcs.items():
+                extnames = [entry['extname'] for _, entry in entries]
+                self.logger.debug(f"get data from hdus {extnames}")
+                pixel_index = self._get_pixel_index(
+                    wcs_info, det_ra_m, det_dec_m,
+                    interp_mode=interp_mode)
+                if pixel_index is None:
+                    # skip because no overlap between detectors and image
+                    continue
+                s = self._gather_pixel_data(
+                    pixel_index, [entry['hdu'].data for _, entry in entries])
+                ig, jg = np.where(pixel_index['g'])
+                ig = np.flatnonzero(m)[ig]
+                for (data_key, entry), s_k in zip(entries, s):
+                    s_k = s_k << self._get_hdu_unit(entry['hdu'])
+                    self.logger.debug(
+                        f'detector signal range of {entry["extname"]}: '
+                        f'[{s_k.min()}, {s_k.max()}]')
+                    s_outs[data_key][ig, jg] = s_k
+        return _mix_stokes_params(
+            s_outs, det_pa_icrs=det_pa_icrs, hwp_pa_icrs=hwp_pa_icrs)
 
     # @staticmethod
     # def _get_data_sky_bbox(wcsobj, data_shape):
@@ -455,6 +578,8 @@ class CatalogSourceModel(SurfaceBrightnessModel):
         # store the data item as table for masked access
         self._data = QTable(rows=data_items)
         self.logger.debug(f"catalog data:\n{self.data}")
+        # the spatial index is built lazily for direct evaluation
+        self._source_tree = None
 
     @classmethod
     def _get_col_quantity(cls, tbl, colname, unit):
@@ -508,11 +633,212 @@ class CatalogSourceModel(SurfaceBrightnessModel):
         return cls(catalog, **kwargs)
 
     def evaluate(self, *args, **kwargs):
-        # TODO a trivial implementation of this is too slow. Need to figure
-        # out a better one
+        # use evaluate_tod_icrs for the detector signals
         return NotImplemented
 
-    def make_image_model(self, fwhms, pixscale):
+    @staticmethod
+    def _lonlat_to_xyz(lon, lat):
+        # return the unit vectors of shape (n, 3) from lon and lat in radian
+        cos_lat = np.cos(lat)
+        return np.stack([
+            cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)],
+            axis=-1)
+
+    @property
+    def source_tree(self):
+        """The KD-tree of the source positions as unit vectors."""
+        if self._source_tree is None:
+            self._source_tree = cKDTree(self._lonlat_to_xyz(
+                self.pos.ra.radian, self.pos.dec.radian))
+        return self._source_tree
+
+    def evaluate_tod_icrs(
+            self,
+            det_array_name, det_ra, det_dec, fwhms,
+            det_pa_icrs=None,
+            hwp_pa_icrs=None,
+            search_radius=3.,
+            block_size=1 << 20):
+        """Return signal data evaluated directly from the catalog.
+
+        The signal of each detector sample is the sum of the Gaussian beam
+        response of the sources within `search_radius` times the beam FWHM,
+        which are looked up from the KD-tree of the source positions.
+
+        Parameters
+        ----------
+        det_array_name : array
+            The array names of the detectors.
+        det_ra, det_dec : `astropy.coordinates.Angle`
+            The detector positions of shape (n_detectors, n_times).
+        fwhms : dict
+            The beam FWHMs keyed by the array names.
+        det_pa_icrs, hwp_pa_icrs : `astropy.coordinates.Angle`, optional
+            The position angles for polarized evaluation.
+        search_radius : float
+            The search radius in units of the beam FWHM.
+        block_size : int
+            The number of detector samples to process at a time.
+        """
+        eval_polarized = det_pa_icrs is not None
+        data_tbl, data_keys = _resolve_eval_data_keys(
+            self.data, eval_polarized,
+            eval_hwp=hwp_pa_icrs is not None)
+        data_by_array_name = data_tbl.group_by('array_name')
+        s_outs = {
+            k: np.zeros(det_ra.shape) << u.MJy / u.sr
+            for k in data_keys
+            }
+        source_tree = self.source_tree
+        for key, group in zip(
+                data_by_array_name.groups.keys,
+                data_by_array_name.groups):
+            array_name = key['array_name']
+            # the size of group should match with the size of data keys
+            assert len(group) == len(data_keys)
+            m = (det_array_name == array_name)
+            self.logger.debug(
+                f"evaluate {m.sum()}/{len(m)} "
+                f"detector signals for array_name={array_name}")
+            fwhm = fwhms[array_name].to_value(u.rad)
+            stddev = fwhm / GAUSSIAN_SIGMA_TO_FWHM
+            beam_area = 2 * np.pi * stddev ** 2
+            # the chord length of the search radius
+            r_search = 2. * np.sin(0.5 * search_radius * fwhm)
+            fluxes = [
+                _get_data_key_entry(group, data_key)['flux'].to_value(u.MJy)
+                for data_key in data_keys
+                ]
+            det_xyz = self._lonlat_to_xyz(
+                det_ra[m].radian.ravel(), det_dec[m].radian.ravel())
+            n_samples = det_xyz.shape[0]
+            s_m = np.zeros((len(data_keys), n_samples), dtype='d')
+            n_pairs = 0
+            for i0 in range(0, n_samples, block_size):
+                i1 = min(i0 + block_size, n_samples)
+                pairs = cKDTree(det_xyz[i0:i1]).sparse_distance_matrix(
+                    source_tree, max_distance=r_search,
+                    output_type='ndarray')
+                if len(pairs) == 0:
+                    continue
+                n_pairs += len(pairs)
+                dist = 2. * np.arcsin(0.5 * pairs['v'])
+                # the beam response in unit of 1/sr
+                resp = np.exp(-0.5 * (dist / stddev) ** 2) / beam_area
+                for k, flux in enumerate(fluxes):
+                    s_m[k, i0:i1] = np.bincount(
+                        pairs['i'], weights=flux[pairs['j']] * resp,
+                        minlength=i1 - i0)
+            self.logger.debug(
+                f"summed {n_pairs} detector-source pairs within "
+                f"{search_radius} x FWHM")
+            for k, data_key in enumerate(data_keys):
+                s_outs[data_key][m] = s_m[k].reshape(
+                    (m.sum(), ) + det_ra.shape[1:]) << u.MJy / u.sr
+        return _mix_stokes_params(
+            s_outs, det_pa_icrs=det_pa_icrs, hwp_pa_icrs=hwp_pa_icrs)
+
+    @staticmethod
+    def _render_images_loop(data_tbl, psf_models, x, y, shape):
+        """Return the images rendered by evaluating the PSF model for
+        each source."""
+        imgs = list()
+        for entry, psf_model in zip(data_tbl, psf_models):
+            # note flux is a vector
+            amp = (entry['flux'] * psf_model.amplitude).to(u.MJy / u.sr)
+            img = np.zeros(shape, dtype=float) << u.MJy / u.sr
+            # make a copy of the model so we update the info
+            m = psf_model.copy()
+            with timeit(f"render {len(amp)} sources"):
+                for xx, yy, aa in zip(x, y, amp):
+                    m.amplitude = aa
+                    m.x_mean = xx
+                    m.y_mean = yy
+                    m.render(img)
+            imgs.append(img)
+        return imgs
+
+    @staticmethod
+    def _deposit_bilinear(img, x, y, values):
+        """Add `values` at sub-pixel positions `x` and `y` to `img` with
+        the bilinear weights.
+
+        The four corners of all positions are accumulated into `img` in
+        one pass.
+        """
+        ny, nx = img.shape
+        jj0 = np.floor(x).astype(int)
+        ii0 = np.floor(y).astype(int)
+        wx = x - jj0
+        wy = y - ii0
+        ii = np.concatenate([ii0, ii0 + 1, ii0, ii0 + 1])
+        jj = np.concatenate([jj0, jj0, jj0 + 1, jj0 + 1])
+        w = np.concatenate([
+            values * ((1. - wy) * (1. - wx)),
+            values * (wy * (1. - wx)),
+            values * ((1. - wy) * wx),
+            values * (wy * wx),
+            ])
+        g = (ii >= 0) & (ii < ny) & (jj >= 0) & (jj < nx)
+        np.add.at(img, (ii[g], jj[g]), w[g])
+        return img
+
+    @classmethod
+    def _render_images_fft(
+            cls, data_tbl, psf_models, x, y, shape, pixel_area):
+        """Return the images rendered by convolving the deposited source
+        fluxes with the PSF model via FFT."""
+        # group the entries by the psf model so the convolution is shared.
+        entries_by_psf = dict()
+        for i, psf_model in enumerate(psf_models):
+            entries_by_psf.setdefault(
+                id(psf_model), (psf_model, list()))[1].append(i)
+        imgs = [None] * len(data_tbl)
+        for psf_model, indices in entries_by_psf.values():
+            with timeit(
+                    f"render {len(x)} sources for {len(indices)} "
+                    f"data entries"):
+                # the flux deposited on the grid in surface brightness
+                planes = np.zeros((len(indices), ) + shape, dtype=float)
+                for plane, i in zip(planes, indices):
+                    cls._deposit_bilinear(
+                        plane, x, y,
+                        (data_tbl['flux'][i] / pixel_area).to_value(
+                            u.MJy / u.sr))
+                # the psf kernel normalized to unit sum, with the same
+                # extent as the bounding box of the model
+                x_stddev = psf_model.x_stddev.value
+                y_stddev = psf_model.y_stddev.value
+                hx = int(np.ceil(5.5 * x_stddev))
+                hy = int(np.ceil(5.5 * y_stddev))
+                ky, kx = np.mgrid[-hy:hy + 1, -hx:hx + 1]
+                kernel = np.exp(
+                    -0.5 * ((kx / x_stddev) ** 2 + (ky / y_stddev) ** 2)
+                    ) / (2 * np.pi * x_stddev * y_stddev)
+                planes = fftconvolve(
+                    planes, kernel[np.newaxis, :, :], mode='same',
+                    axes=(1, 2))
+            for plane, i in zip(planes, indices):
+                imgs[i] = plane << u.MJy / u.sr
+        return imgs
+
+    def make_image_model(self, fwhms, pixscale, render_method='fft'):
+        """Return an image source model rendered from the catalog.
+
+        Parameters
+        ----------
+        fwhms : dict
+            The beam FWHMs keyed by the array names.
+        pixscale : `astropy.units.Quantity`
+            The pixel scale of the rendered image.
+        render_method : {"fft", "loop"}
+            The ``fft`` method deposits the source fluxes on the image grid
+            and convolves with the PSF via FFT, once for all the data
+            entries sharing the same PSF. The ``loop`` method renders the
+            PSF model for each source.
+        """
+        if render_method not in ('fft', 'loop'):
+            raise ValueError(f"invalid render_method {render_method}")
         # fwhms is a dict keyed by the array_names
         pixscale = u.pixel_scale(pixscale)
         delta_pix = (1. << u.pix).to(u.arcsec, equivalencies=pixscale)
@@ -590,29 +916,24 @@ class CatalogSourceModel(SurfaceBrightnessModel):
         assert ((y < 0) | (y > s)).sum() == 0
 
         # render the image for each data table entry
+        if render_method == 'fft':
+            imgs = self._render_images_fft(
+                data_tbl, psf_models, x, y, (s, s),
+                pixel_area=delta_pix ** 2)
+        else:
+            imgs = self._render_images_loop(
+                data_tbl, psf_models, x, y, (s, s))
 
         hdus = list()
         data_exts = list()
 
-        for i, (entry, psf_model) in enumerate(zip(data_tbl, psf_models)):
-            # make hdu for model psf_model with flux in entry['flux']
-            # note flux is a vector
+        for i, (entry, img) in enumerate(zip(data_tbl, imgs)):
             data_ext = {
                 c: entry[c]
                 for c in data_tbl.colnames
                 }
-            flux = data_ext.pop('flux')
+            data_ext.pop('flux')
             extname = data_ext['extname'] = f'{i}_{data_ext["colname"]}'
-            amp = (flux * psf_model.amplitude).to(u.MJy / u.sr)
-            img = np.zeros((s, s), dtype=float) << u.MJy / u.sr
-            # make a copy of the model so we update the info
-            m = psf_model.copy()
-            with timeit(f"render {len(amp)} sources for ext {extname}"):
-                for xx, yy, aa in zip(x, y, amp):
-                    m.amplitude = aa
-                    m.x_mean = xx
-                    m.y_mean = yy
-                    m.render(img)
             # create the hdu with wcs and data
             hdu = fits.ImageHDU(
                 img.to_value(u.MJy / u.sr), header=header)
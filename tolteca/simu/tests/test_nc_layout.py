@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import time
+from types import SimpleNamespace
+
+import astropy.units as u
+import netCDF4
+import numpy as np
+import pytest
+from astropy.table import QTable
+from tollan.utils.log import get_logger
+
+from ..toltec.simulator import ToltecNcLayoutConfig, ToltecSimuOutputContext
+
+
+def _write_kidsdata(filepath, layout, data, n_times_per_chunk):
+    # mimic the layout of the kidsdata files written by the simulator
+    n_times, n_tones = data.shape
+    with netCDF4.Dataset(filepath, 'w') as nc:
+        nc.createDimension('time', layout.get_time_dim_size(n_times))
+        nc.createDimension('iqlen', n_tones)
+        chunk_tones = layout.chunk_tones or n_tones
+        v_I = nc.createVariable(
+            'Data.Toltec.Is', 'i4', ('time', 'iqlen'),
+            **layout.get_var_kwargs(
+                n_times_per_chunk, chunk_sizes=(min(chunk_tones, n_tones), )))
+        for i0 in range(0, n_times, n_times_per_chunk):
+            i1 = min(i0 + n_times_per_chunk, n_times)
+            v_I[i0:i1, :] = data[i0:i1]
+
+
+def _read_kidsdata(filepath):
+    with netCDF4.Dataset(filepath, 'r') as nc:
+        return nc.variables['Data.Toltec.Is'][:]
+
+
+@pytest.mark.parametrize(
+    'preset', list(ToltecNcLayoutConfig.presets.keys()))
+def test_nc_layout_throughput(tmp_path, preset):
+    logger = get_logger()
+    n_times, n_tones, n_times_per_chunk = 12200, 500, 1220
+    rng = np.random.default_rng(0)
+    data = rng.integers(
+        -100000, 100000, size=(n_times, n_tones), dtype='i4')
+    layout = ToltecNcLayoutConfig.from_preset(preset)
+    filepath = tmp_path.joinpath(f'{preset}.nc')
+
+    t0 = time.perf_counter()
+    _write_kidsdata(filepath, layout, data, n_times_per_chunk)
+    t_write = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    data_read = _read_kidsdata(filepath)
+    t_read = time.perf_counter() - t0
+
+    size_mb = data.nbytes / 1e6
+    logger.info(
+        f"nc layout {preset}: write {size_mb / t_write:.1f} MB/s "
+        f"read {size_mb / t_read:.1f} MB/s "
+        f"file size {filepath.stat().st_size / 1e6:.1f} MB")
+    np.testing.assert_array_equal(data_read, data)
+
+
+def test_nc_layout_var_kwargs():
+    layout = ToltecNcLayoutConfig.from_dict({
+        'chunk_time': 'auto', 'chunk_tones': 100, 'zlib': True})
+    assert layout.get_time_dim_size(1000) is None
+    assert layout.get_var_kwargs(122, chunk_sizes=(100, )) == {
+        'chunksizes': (122, 100),
+        'zlib': True, 'complevel': 1, 'shuffle': True}
+    assert ToltecNcLayoutConfig().get_var_kwargs(122) == {}
+    with pytest.raises(ValueError, match='invalid nc layout preset'):
+        ToltecNcLayoutConfig.from_preset('unknown')
+
+
+def _make_apt(n_tones):
+    apt = QTable()
+    apt['nw'] = np.zeros(n_tones, dtype=int)
+    apt['fp'] = np.linspace(500., 600., n_tones) << u.MHz
+    apt['fr'] = apt['fp']
+    apt['Qr'] = np.full(n_tones, 2e4)
+    apt['k0'] = np.zeros(n_tones) << u.s
+    apt['k1'] = np.zeros(n_tones) << u.s
+    for c in ['g0', 'g1', 'm0', 'm1']:
+        apt[c] = np.ones(n_tones)
+    return apt
+
+
+@pytest.mark.parametrize(
+    'preset', list(ToltecNcLayoutConfig.presets.keys()))
+def test_nc_layout_output_context(tmp_path, preset):
+    n_chunks, n_times_per_chunk, n_tones = 5, 122, 50
+    t_chunks = [np.arange(n_times_per_chunk)] * n_chunks
+    n_times = n_chunks * n_times_per_chunk
+    simulator = SimpleNamespace(_eval_context={'t_chunks': t_chunks})
+    simu_config = SimpleNamespace(
+        runtime_info=SimpleNamespace(
+            config_info=SimpleNamespace(runtime_context_dir=tmp_path)),
+        obs_params=SimpleNamespace(f_smp_probing=122. << u.Hz))
+    rng = np.random.default_rng(0)
+    data = rng.integers(
+        -100000, 100000, size=(n_times, n_tones), dtype='i4')
+    layout = ToltecNcLayoutConfig.from_preset(preset)
+    with ToltecSimuOutputContext(
+            simulator, tmp_path, nc_layout=preset).open() as output_ctx:
+        nm = output_ctx._make_kidsdata_nc(
+            _make_apt(n_tones), 0, simu_config)
+        filepath = nm.file_loc.path
+        nc = nm.nc_node
+        v_I = nc.variables['Data.Toltec.Is']
+        assert nc.dimensions['time'].isunlimited() == (not layout.preallocate)
+        chunking = v_I.chunking()
+        if layout.chunk_time == 'auto':
+            assert chunking == [n_times_per_chunk, n_tones]
+        elif layout.preallocate:
+            assert chunking == 'contiguous'
+        filters = v_I.filters()
+        assert filters['zlib'] == layout.zlib
+        assert filters['shuffle'] == (layout.zlib and layout.shuffle)
+        if layout.zlib:
+            assert filters['complevel'] == layout.complevel
+        for t in t_chunks:
+            sl = output_ctx._next_write_slice(
+                output_ctx._get_kidsdata_interface(0), len(t))
+            v_I[sl, :] = data[sl]
+        assert len(nc.dimensions['time']) == n_times
+    np.testing.assert_array_equal(_read_kidsdata(filepath), data)
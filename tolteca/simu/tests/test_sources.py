@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+from ..sources.models import ImageSourceModel, CatalogSourceModel
+from ..utils import SkyBoundingBox
+import numpy as np
+import astropy.units as u
+from astropy.io import fits
+from astropy.wcs import WCS
+from astropy.coordinates import Angle, SkyCoord
+from astropy.modeling.functional_models import GAUSSIAN_SIGMA_TO_FWHM
+from astropy.table import Table
+import pytest
+
+
+def _make_image_hdulist(shape=(40, 50), stokes_params='IQU'):
+    wcsobj = WCS(naxis=2)
+    wcsobj.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    wcsobj.wcs.crval = [180., 0.]
+    wcsobj.wcs.crpix = [shape[1] / 2, shape[0] / 2]
+    wcsobj.wcs.cdelt = [-1. / 3600, 1. / 3600]
+    header = wcsobj.to_header()
+    header['BUNIT'] = 'MJy/sr'
+    rng = np.random.default_rng(0)
+    hdulist = fits.HDUList([fits.PrimaryHDU()])
+    for stokes_param in stokes_params:
+        hdu = fits.ImageHDU(
+            data=rng.normal(size=shape), header=header, name=stokes_param)
+        hdulist.append(hdu)
+    data_exts = [
+        {'extname': stokes_param, 'array_name': 'a1100',
+         'stokes_param': stokes_param}
+        for stokes_param in stokes_params]
+    return hdulist, data_exts
+
+
+def _eval_per_plane(hdu, det_ra, det_dec):
+    # evaluate the nearest pixel values of one plane, as is done
+    # before the pixel indices are shared among the planes.
+    wcsobj = WCS(hdu.header)
+    ny, nx = hdu.data.shape
+    sky_bbox = SkyBoundingBox.from_wcs(wcsobj, hdu.data.shape)
+    det_ra_deg = det_ra.wrap_at(sky_bbox.lon_wrap_angle).degree
+    det_dec_deg = det_dec.degree
+    g = (
+        (det_ra_deg > sky_bbox.w.degree)
+        & (det_ra_deg < sky_bbox.e.degree)
+        & (det_dec_deg > sky_bbox.s.degree)
+        & (det_dec_deg < sky_bbox.n.degree)
+        )
+    x, y = wcsobj.wcs_world2pix(det_ra_deg[g], det_dec_deg[g], 0)
+    ii = np.rint(y).astype(int)
+    jj = np.rint(x).astype(int)
+    gp = (ii >= 0) & (ii < ny) & (jj >= 0) & (jj < nx)
+    g[g] = gp
+    s = np.zeros(det_ra.shape)
+    s[g] = hdu.data[ii[gp], jj[gp]]
+    return s
+
+
+@pytest.mark.parametrize('interp_mode', ['nearest', 'bilinear'])
+def test_image_source_model_eval(interp_mode):
+    hdulist, data_exts = _make_image_hdulist()
+    m = ImageSourceModel(
+        hdulist, data_exts=data_exts, interp_mode=interp_mode)
+    n_dets, n_times = 5, 200
+    rng = np.random.default_rng(1)
+    # some of the positions are off the image
+    det_ra = Angle(rng.uniform(
+        180. - 30. / 3600, 180. + 30. / 3600,
+        size=(n_dets, n_times)) << u.deg)
+    det_dec = Angle(rng.uniform(
+        -25. / 3600, 25. / 3600, size=(n_dets, n_times)) << u.deg)
+    det_pa = Angle(rng.uniform(0, 2 * np.pi, size=(n_dets, n_times)) << u.rad)
+    det_array_name = np.array(['a1100'] * n_dets)
+    s = m.evaluate_tod_icrs(
+        det_array_name, det_ra, det_dec, det_pa_icrs=det_pa)
+    s_i, s_q, s_u = (
+        _eval_per_plane(hdu, det_ra, det_dec) for hdu in hdulist[1:])
+    s_expected = (
+        s_i + s_q * np.cos(2. * det_pa) + s_u * np.sin(2. * det_pa))
+    if interp_mode == 'nearest':
+        np.testing.assert_allclose(s.to_value(u.MJy / u.sr), s_expected)
+        return
+    # the bilinear values agree with the nearest values at the pixel
+    # centers.
+    s = s.to_value(u.MJy / u.sr)
+    assert np.all(np.isfinite(s))
+    hdu = hdulist[1]
+    wcsobj = WCS(hdu.header)
+    ra_c, dec_c = wcsobj.wcs_pix2world(
+        np.arange(5, 15), np.arange(5, 15), 0)
+    det_ra_c = Angle(ra_c[np.newaxis, :] << u.deg)
+    det_dec_c = Angle(dec_c[np.newaxis, :] << u.deg)
+    s_c = m.evaluate_tod_icrs(np.array(['a1100']), det_ra_c, det_dec_c)
+    np.testing.assert_allclose(
+        s_c.to_value(u.MJy / u.sr),
+        _eval_per_plane(hdu, det_ra_c, det_dec_c), atol=1e-8)
+
+
+def _make_catalog_model(n_sources=50):
+    rng = np.random.default_rng(2)
+    catalog = Table()
+    catalog['source_name'] = [f's{i}' for i in range(n_sources)]
+    catalog['ra'] = rng.uniform(
+        180. - 60. / 3600, 180. + 60. / 3600, n_sources) << u.deg
+    catalog['dec'] = rng.uniform(
+        -60. / 3600, 60. / 3600, n_sources) << u.deg
+    catalog['flux_a1100'] = rng.uniform(1, 10, n_sources) << u.mJy
+    catalog['flux_a2000'] = rng.uniform(1, 10, n_sources) << u.mJy
+    return CatalogSourceModel(
+        catalog, data_cols=[
+            {'colname': 'flux_a1100', 'array_name': 'a1100'},
+            {'colname': 'flux_a2000', 'array_name': 'a2000'},
+            ])
+
+
+def test_catalog_source_model_eval():
+    m = _make_catalog_model()
+    fwhms = {'a1100': 5. << u.arcsec, 'a2000': 10. << u.arcsec}
+    n_dets, n_times = 6, 100
+    rng = np.random.default_rng(3)
+    det_ra = Angle(rng.uniform(
+        180. - 60. / 3600, 180. + 60. / 3600,
+        size=(n_dets, n_times)) << u.deg)
+    det_dec = Angle(rng.uniform(
+        -60. / 3600, 60. / 3600, size=(n_dets, n_times)) << u.deg)
+    det_array_name = np.array(['a1100', 'a2000'] * (n_dets // 2))
+    # use a small block size to check the blocking
+    s = m.evaluate_tod_icrs(
+        det_array_name, det_ra, det_dec, fwhms=fwhms, block_size=64)
+    # sum the beam response of all sources
+    s_expected = np.zeros(det_ra.shape)
+    det_coords = SkyCoord(det_ra, det_dec)
+    for i in range(n_dets):
+        array_name = det_array_name[i]
+        stddev = fwhms[array_name].to_value(u.rad) / GAUSSIAN_SIGMA_TO_FWHM
+        flux = m.data[m.data['array_name'] == array_name][0]['flux']
+        for pos, f in zip(m.pos, flux.to_value(u.MJy)):
+            dist = det_coords[i].separation(pos).radian
+            s_expected[i] += f * np.exp(-0.5 * (dist / stddev) ** 2) / (
+                2 * np.pi * stddev ** 2)
+    # the sources beyond the search radius contribute < exp(-25)
+    np.testing.assert_allclose(
+        s.to_value(u.MJy / u.sr), s_expected,
+        rtol=1e-6, atol=1e-6 * s_expected.max())
+
+
+def test_catalog_source_model_deposit_bilinear():
+    rng = np.random.default_rng(4)
+    shape = (20, 30)
+    # some positions are partially off the image
+    x = rng.uniform(-1, shape[1], 200)
+    y = rng.uniform(-1, shape[0], 200)
+    values = rng.uniform(1, 2, 200)
+    img = CatalogSourceModel._deposit_bilinear(
+        np.zeros(shape), x, y, values)
+    img_expected = np.zeros(shape)
+    for xx, yy, v in zip(x, y, values):
+        j0 = int(np.floor(xx))
+        i0 = int(np.floor(yy))
+        wx = xx - j0
+        wy = yy - i0
+        for i, j, w in [
+                (i0, j0, (1 - wy) * (1 - wx)),
+                (i0 + 1, j0, wy * (1 - wx)),
+                (i0, j0 + 1, (1 - wy) * wx),
+                (i0 + 1, j0 + 1, wy * wx),
+                ]:
+            if 0 <= i < shape[0] and 0 <= j < shape[1]:
+                img_expected[i, j] += v * w
+    np.testing.assert_allclose(img, img_expected)
+
+
+def test_catalog_source_model_render():
+    m = _make_catalog_model()
+    fwhms = {'a1100': 5. << u.arcsec, 'a2000': 10. << u.arcsec}
+    pixscale = 1. << u.arcsec / u.pix
+    m_fft = m.make_image_model(fwhms, pixscale, render_method='fft')
+    m_loop = m.make_image_model(fwhms, pixscale, render_method='loop')
+    for hdu_fft, hdu_loop in zip(
+            m_fft.data['hdu'], m_loop.data['hdu']):
+        img_fft = hdu_fft.data
+        img_loop = hdu_loop.data
+        assert img_fft.shape == img_loop.shape
+        # the total flux is conserved
+        np.testing.assert_allclose(img_fft.sum(), img_loop.sum(), rtol=1e-3)
+        # the bilinear deposition smooths the peaks slightly
+        np.testing.assert_allclose(
+            img_fft, img_loop, atol=0.05 * img_loop.max())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+from ..toltec.toast_atm_cache import ToastAtmSlabCache
+import multiprocessing
+from types import SimpleNamespace
+import astropy.units as u
+from astropy.time import Time
+
+
+def _make_bbox(azmin, azmax, elmin, elmax):
+    return SimpleNamespace(
+        w=azmin << u.deg, e=azmax << u.deg,
+        s=elmin << u.deg, n=elmax << u.deg)
+
+
+def _add_entry(cache, params_hash, tmin, tmax, bbox, size):
+    key, entry = cache.create(params_hash, tmin, tmax, bbox)
+    with open(cache.get_build_dir(key).joinpath('slab.h5'), 'wb') as fo:
+        fo.write(b'0' * size)
+    cache.commit(key, entry)
+    return key
+
+
+def test_toast_atm_slab_cache_lookup(tmp_path):
+    cache = ToastAtmSlabCache(tmp_path)
+    params_hash = cache.make_params_hash(
+        {'lmin_center': 0.01 << u.m}, Time('2022-01-01T00:00:00'))
+    key = _add_entry(
+        cache, params_hash, 0., 100., _make_bbox(350., 10., 30., 60.), 10)
+    # contained ranges, with wrapping az
+    assert cache.lookup(
+        params_hash, 10., 90., _make_bbox(355., 5., 40., 50.))[0] == key
+    # not contained
+    assert cache.lookup(
+        params_hash, 10., 110., _make_bbox(355., 5., 40., 50.)) is None
+    assert cache.lookup(
+        params_hash, 10., 90., _make_bbox(340., 5., 40., 50.)) is None
+    assert cache.lookup(
+        'other', 10., 90., _make_bbox(355., 5., 40., 50.)) is None
+    # the smaller entry is used
+    key_small = _add_entry(
+        cache, params_hash, 0., 90., _make_bbox(355., 5., 30., 60.), 5)
+    assert cache.lookup(
+        params_hash, 10., 90., _make_bbox(355., 5., 40., 50.))[0] == key_small
+
+
+def test_toast_atm_slab_cache_evict(tmp_path):
+    cache = ToastAtmSlabCache(tmp_path, max_size=25 << u.byte)
+    bbox = _make_bbox(0., 10., 30., 60.)
+    keys = [
+        _add_entry(cache, 'p', 0., 100. + i, bbox, 10) for i in range(3)]
+    # the least recently used entry is removed
+    assert not cache.get_entry_dir(keys[0]).exists()
+    assert set(cache._load_index().keys()) == set(keys[1:])
+    cache.lookup('p', 0., 100., bbox)
+    _add_entry(cache, 'p', 0., 200., bbox, 10)
+    assert set(cache._load_index().keys()) == {
+        cache.lookup('p', 0., 100., bbox)[0],
+        cache.lookup('p', 0., 200., bbox)[0]}
+
+
+def _add_entries_in_proc(rootpath, i, n_entries):
+    cache = ToastAtmSlabCache(rootpath)
+    bbox = _make_bbox(0., 10., 30., 60.)
+    for j in range(n_entries):
+        _add_entry(cache, 'p', 0., 1000. * i + j, bbox, 1)
+
+
+def test_toast_atm_slab_cache_multiprocess(tmp_path):
+    n_procs = 4
+    n_entries = 20
+    ctx = multiprocessing.get_context('fork')
+    procs = [
+        ctx.Process(
+            target=_add_entries_in_proc, args=(tmp_path, i, n_entries))
+        for i in range(n_procs)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+        assert p.exitcode == 0
+    # no updates of the index are lost
+    cache = ToastAtmSlabCache(tmp_path)
+    assert len(cache._load_index()) == n_procs * n_entries
+
+
+def test_toast_atm_slab_cache_pin(tmp_path):
+    cache = ToastAtmSlabCache(tmp_path, max_size=25 << u.byte)
+    bbox = _make_bbox(0., 10., 30., 60.)
+    key0 = _add_entry(cache, 'p', 0., 100., bbox, 10)
+    # the pinned entry is not evicted
+    assert cache.lookup('p', 0., 100., bbox)[0] == key0
+    keys = [_add_entry(cache, 'p', 0., 101. + i, bbox, 10) for i in range(2)]
+    assert cache.get_entry_dir(key0).exists()
+    assert not cache.get_entry_dir(keys[0]).exists()
+    cache.release(key0)
+    _add_entry(cache, 'p', 0., 200., bbox, 10)
+    assert not cache.get_entry_dir(key0).exists()
+
+
+def _lookup_in_proc(rootpath, bbox):
+    ToastAtmSlabCache(rootpath).lookup('p', 0., 100., bbox)
+
+
+def test_toast_atm_slab_cache_pin_dead_process(tmp_path):
+    cache = ToastAtmSlabCache(tmp_path, max_size=15 << u.byte)
+    bbox = _make_bbox(0., 10., 30., 60.)
+    key0 = _add_entry(cache, 'p', 0., 100., bbox, 10)
+    ctx = multiprocessing.get_context('fork')
+    p = ctx.Process(target=_lookup_in_proc, args=(tmp_path, bbox))
+    p.start()
+    p.join()
+    assert cache._load_index()[key0]['pins'] == [p.pid]
+    # the pin of the exited process is ignored
+    _add_entry(cache, 'p', 0., 200., bbox, 10)
+    assert not cache.get_entry_dir(key0).exists()
+
+
+def _create_and_commit_in_proc(rootpath, bbox):
+    _add_entry(ToastAtmSlabCache(rootpath), 'p', 0., 100., bbox, 5)
+
+
+def test_toast_atm_slab_cache_create_same_key(tmp_path):
+    cache = ToastAtmSlabCache(tmp_path)
+    bbox = _make_bbox(0., 10., 30., 60.)
+    # another process creates and commits the same entry while this one
+    # is building it.
+    key, entry = cache.create('p', 0., 100., bbox)
+    build_dir = cache.get_build_dir(key)
+    with open(build_dir.joinpath('slab.h5'), 'wb') as fo:
+        fo.write(b'0' * 10)
+    ctx = multiprocessing.get_context('fork')
+    p = ctx.Process(target=_create_and_commit_in_proc, args=(tmp_path, bbox))
+    p.start()
+    p.join()
+    assert p.exitcode == 0
+    assert build_dir.joinpath('slab.h5').stat().st_size == 10
+    assert cache.get_entry_dir(key).joinpath('slab.h5').stat().st_size == 5
+    # the entry committed first is kept
+    cache.commit(key, entry)
+    assert not build_dir.exists()
+    assert cache._load_index()[key]['size'] == 5
+    assert cache.get_entry_dir(key).joinpath('slab.h5').stat().st_size == 5
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        key, 'index.json', 'index.lock']
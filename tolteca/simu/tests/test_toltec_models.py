@@ -2,12 +2,15 @@
 
 
 from ..toltec.models import (
-    ToltecArrayProjModel, ToltecSkyProjModel)
+    ToltecArrayProjModel, ToltecSkyProjModel, ToltecArrayPowerLoadingModel,
+    ToastAtmEvaluator, pa_from_coords)
+from ..toltec.toltec_info import toltec_info
 from tollan.utils.log import get_logger
 import numpy as np
 import astropy.units as u
 from astropy.time import Time
 from astropy.coordinates import SkyCoord
+from types import SimpleNamespace
 import pytest
 
 
@@ -98,3 +101,173 @@ def test_toltec_sky_proj_multi():
             az[i].arcsec, alt[i].arcsec,
             color=f'C{i % 6}', marker='.', linestyle='none')
     plt.show()
+
+
+def _wrap_rad(a):
+    return (a + np.pi) % (2 * np.pi) - np.pi
+
+
+def test_toltec_sky_proj_engines():
+
+    n_times = 20
+    t0 = Time('2022-01-01T00:00:00')
+    time_obs = t0 + (np.linspace(0, 10, n_times) << u.min)
+    # a raster around the target
+    bs_coords_icrs = SkyCoord(
+        (180. << u.deg) + (np.linspace(-5, 5, n_times) << u.arcmin),
+        (60. << u.deg) + (np.sin(np.linspace(0, 3, n_times)) << u.arcmin),
+        frame='icrs')
+    observer = ToltecSkyProjModel.observer
+    bs_coords_altaz = bs_coords_icrs.transform_to(
+        observer.altaz(time=time_obs))
+
+    x_t, y_t = np.meshgrid(
+        np.linspace(-2, 2, 5), np.linspace(-2, 2, 5), indexing='ij')
+    x_t = x_t.ravel() << u.arcmin
+    y_t = y_t.ravel() << u.arcmin
+    pa_t = np.linspace(0, 180, x_t.size) << u.deg
+
+    m = ToltecSkyProjModel(
+        origin_coords_icrs=bs_coords_icrs,
+        origin_coords_altaz=bs_coords_altaz)
+    _, eval_ctx = m(
+        x_t[np.newaxis, :], y_t[np.newaxis, :], pa_t[np.newaxis, :],
+        evaluate_frame='icrs', return_eval_context=True)
+    exact = {
+        'az': eval_ctx['coords_altaz'].az,
+        'alt': eval_ctx['coords_altaz'].alt,
+        'pa_altaz': eval_ctx['pa_altaz'],
+        'ra': eval_ctx['coords_icrs'].ra,
+        'dec': eval_ctx['coords_icrs'].dec,
+        'pa_icrs': eval_ctx['pa_icrs'],
+        }
+    exact = {k: v.to_value(u.rad) for k, v in exact.items()}
+
+    bs_parallactic_angle = pa_from_coords(
+        observer=observer,
+        coords_altaz=bs_coords_altaz,
+        coords_icrs=bs_coords_icrs)
+    bs_rot_altaz_icrs = ToltecSkyProjModel.get_origin_rot_altaz_icrs(
+        bs_coords_altaz, bs_coords_icrs)
+    small_field = ToltecSkyProjModel.evaluate_small_field(
+        x_t, y_t, pa_t,
+        origin_coords_altaz=bs_coords_altaz,
+        origin_coords_icrs=bs_coords_icrs,
+        origin_pa_altaz_icrs=bs_parallactic_angle,
+        origin_rot_altaz_icrs=bs_rot_altaz_icrs,
+        )
+    small_field = {k: v.to_value(u.rad) for k, v in small_field.items()}
+    # use a small block size to check the blocking
+    vectorized = ToltecSkyProjModel.evaluate_vectorized(
+        x_t.to_value(u.rad), y_t.to_value(u.rad), pa_t.to_value(u.rad),
+        origin_az=bs_coords_altaz.az.radian,
+        origin_alt=bs_coords_altaz.alt.radian,
+        origin_ra=bs_coords_icrs.ra.radian,
+        origin_dec=bs_coords_icrs.dec.radian,
+        origin_pa_altaz_icrs=bs_parallactic_angle.radian,
+        origin_rot_altaz_icrs=bs_rot_altaz_icrs.radian,
+        block_size=7,
+        )
+    arcsec = (1. << u.arcsec).to_value(u.rad)
+    # the ICRS P.A. of the approximations use the parallactic angle at
+    # the bore sight, which differs from that at the detectors by a few
+    # arcmin for the offsets here.
+    atols = {
+        'az': 0.1 * arcsec,
+        'alt': 0.1 * arcsec,
+        'pa_altaz': 0.1 * arcsec,
+        'ra': 0.1 * arcsec,
+        'dec': 0.1 * arcsec,
+        'pa_icrs': 600. * arcsec,
+        }
+    for result in [small_field, vectorized]:
+        for k, atol in atols.items():
+            assert result[k].shape == (x_t.size, n_times)
+            np.testing.assert_allclose(
+                _wrap_rad(result[k] - exact[k]), 0., atol=atol)
+    # the two approximations agree to numerical precision
+    for k in exact.keys():
+        np.testing.assert_allclose(
+            _wrap_rad(vectorized[k] - small_field[k]), 0.,
+            atol=1e-6 * arcsec)
+
+
+def test_toltec_array_power_loading_lut(tmp_path):
+
+    aplm = ToltecArrayPowerLoadingModel(
+        array_name='a1100', atm_model_name='am_q50', lut_dir=tmp_path)
+    alt = [30., 45.01, 60., 72.345] << u.deg
+    P = aplm.get_P(alt)
+    noise = aplm.get_noise(alt)
+    assert tmp_path.joinpath(aplm._lut_filename).exists()
+    np.testing.assert_allclose(
+        P.to_value(u.pW), aplm._get_P(alt).to_value(u.pW), rtol=1e-4)
+    noise_direct = aplm._get_noise(alt, return_avg=True)
+    for k in ['net_cmb', 'nefd', 'nep']:
+        np.testing.assert_allclose(
+            noise[k].to_value(noise_direct[k].unit),
+            noise_direct[k].value, rtol=1e-4)
+
+
+class _MockAtmSlab(object):
+
+    def __init__(self, k):
+        self.k = k
+
+    def observe(self, times, az, el, tod, fixed_r=0):
+        tod[:] = self.k * np.sin(3. * az) * np.cos(el) + 1e-3 * (
+            times - times[0])
+        return 0
+
+
+def _calc_atm_pwr_per_slab(toast_atm_simu, array_name, det_az, det_alt, t):
+    # the per-slab calculation on the whole raveled chunk, as is done
+    # before the slabs are observed in detector blocks.
+    det_az = det_az.to_value(u.rad).ravel()
+    det_alt = det_alt.to_value(u.rad).ravel()
+    times = np.tile(t, det_az.size // t.size)
+    result = 0.
+    for atm_slab in toast_atm_simu.atm_slabs.values():
+        atmtod = np.zeros_like(times)
+        atm_slab.observe(times=times, az=det_az, el=det_alt, tod=atmtod)
+        atmtod *= 1e-3 * toast_atm_simu.absorption[array_name]
+        atmtod += toast_atm_simu.loading[array_name] / np.sin(det_alt)
+        atmtod *= 5e-2
+        result = result + ((atmtod << u.Kelvin).to(
+            u.J, equivalencies=u.temperature_energy())
+            * toltec_info[array_name]['passband']).to(u.pW)
+    return result
+
+
+@pytest.mark.parametrize(
+    'det_block_size,n_threads', [(64, 1), (3, 1), (3, 3)])
+def test_toast_atm_evaluator_det_blocks(det_block_size, n_threads):
+    toast_atm_simu = SimpleNamespace(
+        atm_slabs={i: _MockAtmSlab(k) for i, k in enumerate([1., 2., 0.5])},
+        absorption={'a1100': 0.3},
+        loading={'a1100': 10.},
+        )
+    evaluator = ToastAtmEvaluator(
+        det_block_size=det_block_size, n_threads=n_threads)
+    evaluator._toast_atm_simu = toast_atm_simu
+    n_dets, n_times = 7, 50
+    rng = np.random.default_rng(0)
+    det_az = rng.uniform(0, 2 * np.pi, (n_dets, n_times)) << u.rad
+    det_alt = rng.uniform(0.5, 1.2, (n_dets, n_times)) << u.rad
+    t = 1.6e9 + np.arange(n_times) * 0.1
+    result = evaluator.calc_toast_atm_pwr_for_array(
+        'a1100', det_az, det_alt, t)
+    assert result.shape == (n_dets, n_times)
+    result_expected = _calc_atm_pwr_per_slab(
+        toast_atm_simu, 'a1100', det_az, det_alt, t)
+    np.testing.assert_allclose(
+        result.to_value(u.pW),
+        result_expected.to_value(u.pW).reshape((n_dets, n_times)),
+        rtol=1e-12)
+    # single detector
+    result = evaluator.calc_toast_atm_pwr_for_array(
+        'a1100', det_az[0], det_alt[0], t)
+    assert result.shape == (n_times, )
+    np.testing.assert_allclose(
+        result.to_value(u.pW),
+        result_expected.to_value(u.pW)[:n_times], rtol=1e-12)
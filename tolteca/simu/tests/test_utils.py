@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+import multiprocessing
+import os
+import threading
+import time
+
+from ..utils import (
+    SubsamplePlanner, WriteBehindWriter, SkyTrajStore, iter_eval_chunks,
+    _chunk_eval_state)
+from tollan.utils.log import get_logger
+import numpy as np
+import pytest
+import astropy.units as u
+from astropy.time import Time
+
+
+def _get_subsample_index_loop(mjd, evaluate_interp_len):
+    # the reference implementation with the per-sample python loop.
+    s = [0]
+    for i, t in enumerate(mjd):
+        if t - mjd[s[-1]] < evaluate_interp_len:
+            continue
+        s.append(i)
+    if s[-1] != len(mjd) - 1:
+        s.append(len(mjd) - 1)
+    return np.array(s)
+
+
+def _get_subsample_index_grid_loop(mjd, mjd_ref, dt):
+    # the per-sample python loop of the algorithm of SubsamplePlanner.
+    k = np.floor((mjd[0] - mjd_ref) / dt)
+    s = [0]
+    for i, t in enumerate(mjd):
+        if t < mjd_ref + k * dt:
+            continue
+        s.append(i)
+        while mjd_ref + k * dt <= t:
+            k += 1
+    s.append(len(mjd) - 1)
+    return np.unique(s)
+
+
+def test_subsample_planner():
+    f_smp = 122. << u.Hz
+    interp_len = 0.1 << u.s
+    t0 = Time('2022-01-01T00:00:00')
+    t = np.arange(0, 60, (1 / f_smp).to_value(u.s)) << u.s
+    mjd = (t0 + t).mjd
+
+    planner = SubsamplePlanner(interp_len, t_ref=t0)
+    s = planner.get_subsample_index(mjd)
+    assert s[0] == 0
+    assert s[-1] == len(mjd) - 1
+    assert np.all(np.diff(s) > 0)
+    # the knots are spaced no more than interp_len plus one sample
+    ds = np.diff(mjd[s]) * 86400.
+    assert np.all(
+        ds <= interp_len.to_value(u.s) + (1 / f_smp).to_value(u.s) + 1e-6)
+    # the number of knots is comparable to the loop implementation
+    s_loop = _get_subsample_index_loop(mjd << u.day, interp_len)
+    assert abs(len(s) - len(s_loop)) <= 0.1 * len(s_loop)
+    # the knots are the same as the per-sample loop of the grid algorithm
+    np.testing.assert_array_equal(s, _get_subsample_index_grid_loop(
+        mjd, t0.mjd, interp_len.to_value(u.day)))
+
+    # the knots of a chunk are a subset of that of the full time grid
+    # when the chunk boundary is not at a knot.
+    s_chunk = planner.get_subsample_index(mjd[1000:2000]) + 1000
+    assert set(s_chunk[1:-1]).issubset(set(s))
+
+
+@pytest.mark.skipif(
+    not os.environ.get('TOLTECA_TEST_BENCHMARK', None),
+    reason='set TOLTECA_TEST_BENCHMARK to run the benchmark')
+def test_subsample_planner_benchmark():
+    logger = get_logger()
+    f_smp = 122. << u.Hz
+    interp_len = 0.1 << u.s
+    t0 = Time('2022-01-01T00:00:00')
+    t = np.arange(0, 120, (1 / f_smp).to_value(u.s)) << u.s
+    mjd = (t0 + t).mjd
+    planner = SubsamplePlanner(interp_len, t_ref=t0)
+
+    # the loop runs on the quantities as in the old _get_detector_sky_traj
+    t_start = time.perf_counter()
+    s_loop = _get_subsample_index_loop(mjd << u.day, interp_len)
+    t_loop = time.perf_counter() - t_start
+
+    t_start = time.perf_counter()
+    s = planner.get_subsample_index(mjd)
+    t_vec = time.perf_counter() - t_start
+
+    logger.info(
+        f"subsample index of {len(mjd)} samples: "
+        f"loop={t_loop:.3g}s vectorized={t_vec:.3g}s "
+        f"speedup={t_loop / t_vec:.3g} "
+        f"n_knots loop={len(s_loop)} vectorized={len(s)}")
+
+
+def test_write_behind_writer():
+    written = list()
+    main_thread = threading.current_thread()
+
+    def write_func(item):
+        assert threading.current_thread() is not main_thread
+        time.sleep(0.01)
+        written.append(item)
+
+    with WriteBehindWriter(write_func, max_queued=2) as writer:
+        for i in range(10):
+            writer.submit(i)
+    assert written == list(range(10))
+
+    # synchronous writes
+    written_sync = list()
+    with WriteBehindWriter(written_sync.append) as writer:
+        writer.submit(1)
+        assert written_sync == [1]
+
+
+def test_write_behind_writer_error():
+
+    def write_func(item):
+        if item == 3:
+            raise ValueError("bad item")
+
+    with pytest.raises(RuntimeError, match='write-behind writer failed'):
+        with WriteBehindWriter(write_func, max_queued=1) as writer:
+            for i in range(100):
+                writer.submit(i)
+
+
+def test_sky_traj_store(tmp_path):
+    t = np.arange(10) << u.s
+    with SkyTrajStore(rootpath=tmp_path) as store:
+        assert store.rootpath.parent == tmp_path
+        key = store.make_key('model', t)
+        assert key == store.make_key('model', t)
+        assert key != store.make_key('model', t + (1 << u.s))
+        assert store.get(key, ['a']) is None
+        arrays = store.create(key, ['a', 'b'], shape=(10, ))
+        arrays['a'][:] = np.arange(10)
+        arrays['b'][:] = 1.
+        del arrays
+        result = store.get(key, ['a', 'b'])
+        np.testing.assert_array_equal(result['a'], np.arange(10))
+        np.testing.assert_array_equal(result['b'], 1.)
+        assert not result['a'].flags.writeable
+        # None is returned if any of the names is missing
+        assert store.get(key, ['a', 'c']) is None
+        store.discard(key)
+        assert store.get(key, ['a']) is None
+    assert not store.rootpath.exists()
+
+
+def _read_traj_in_proc(store, key, queue):
+    traj = store.get(key, ['a'])
+    queue.put(float(traj['a'].sum()))
+    # this does not remove the files, which are owned by the parent
+    store.close()
+
+
+def test_sky_traj_store_fork(tmp_path):
+    ctx = multiprocessing.get_context('fork')
+    with SkyTrajStore(rootpath=tmp_path) as store:
+        arrays = store.create('key', ['a'], shape=(100, ))
+        arrays['a'][:] = 2.
+        del arrays
+        queue = ctx.Queue()
+        p = ctx.Process(target=_read_traj_in_proc, args=(store, 'key', queue))
+        p.start()
+        assert queue.get(timeout=60) == 200.
+        p.join()
+        assert p.exitcode == 0
+        assert store.get('key', ['a']) is not None
+    assert not store.rootpath.exists()
+
+
+def test_iter_eval_chunks():
+    n_chunks = 12
+    max_inflight_chunks = 3
+    t_chunks = [np.arange(i, i + 5) for i in range(n_chunks)]
+    # the number of chunks whose evaluation has started
+    n_started = multiprocessing.get_context('fork').Value('i', 0)
+
+    def eval_func(t):
+        with n_started.get_lock():
+            n_started.value += 1
+        # the later chunks finish first
+        time.sleep(0.01 * (t[0] % 4))
+        return {'t': t, 'sum': t.sum()}
+
+    def reduce_func(data):
+        return data['sum']
+
+    result = list()
+    for ci, data in iter_eval_chunks(
+            eval_func, t_chunks, reduce_func=reduce_func, n_workers=3,
+            max_inflight_chunks=max_inflight_chunks):
+        # the chunks after the in-flight ones are not submitted
+        assert n_started.value <= ci + max_inflight_chunks
+        result.append((ci, data))
+        time.sleep(0.02)
+    assert result == [(ci, t.sum()) for ci, t in enumerate(t_chunks)]
+    assert not _chunk_eval_state
+    assert not multiprocessing.active_children()
+    # serial eval
+    assert list(iter_eval_chunks(
+        eval_func, t_chunks, reduce_func=reduce_func)) == result
+
+
+def test_iter_eval_chunks_error():
+
+    def eval_func(t):
+        if t[0] == 3:
+            raise ValueError("bad chunk")
+        return t.sum()
+
+    t_chunks = [np.arange(i, i + 5) for i in range(10)]
+    result = list()
+    with pytest.raises(ValueError, match='bad chunk'):
+        for ci, data in iter_eval_chunks(
+                eval_func, t_chunks, n_workers=2, max_inflight_chunks=2):
+            result.append(ci)
+    assert result == [0, 1, 2]
+    # the pool is shut down
+    assert not _chunk_eval_state
+    assert not multiprocessing.active_children()
@@ -133,6 +133,24 @@ class ToltecPowerLoadingModelConfig(DataclassNamespace):
                 default=Path("atm_cache"),
                 description="The directory to store atmosphere model data.",
             ): Or(None, RelPathSchema()),
+            Optional(
+                "atm_cache_max_size",
+                default=None,
+                description="The max total size of the atmosphere model "
+                "data in the cache dir.",
+            ): Or(None, PhysicalTypeSchema("data quantity")),
+            Optional(
+                "atm_det_block_size",
+                default=64,
+                description="The number of detectors in each block to "
+                "observe the toast atmosphere slabs.",
+            ): int,
+            Optional(
+                "atm_n_threads",
+                default=1,
+                description="The number of threads to observe the toast "
+                "atmosphere slabs.",
+            ): int,
         }
     )
 
@@ -162,6 +180,9 @@ class ToltecPowerLoadingModelConfig(DataclassNamespace):
             atm_model_name=self.atm_model_name,
             atm_model_params=self.atm_model_params,
             atm_cache_dir=self.atm_cache_dir,
+            atm_cache_max_size=self.atm_cache_max_size,
+            atm_det_block_size=self.atm_det_block_size,
+            atm_n_threads=self.atm_n_threads,
             tel_surface_rms=self.tel_surface_rms,
             det_noise_factor=self.det_noise_factor,
         )
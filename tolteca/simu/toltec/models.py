@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import hashlib
+import json
 
 from gwcs import coordinate_frames as cf
 import astropy.units as u
@@ -7,7 +9,7 @@ from astropy.time import Time
 from astropy.modeling import models, Parameter, Model
 from astropy.modeling.functional_models import GAUSSIAN_SIGMA_TO_FWHM
 from astropy.coordinates import SkyCoord, Angle
-from astropy.table import Table
+from astropy.table import Table, QTable
 from astropy.cosmology import default_cosmology
 from astropy import constants as const
 from astropy.utils.decorators import classproperty
@@ -20,10 +22,12 @@ from tollan.utils.log import timeit, get_logger
 from tollan.utils.fmt import pformat_yaml
 from kidsproc.kidsmodel import _Model as ComplexModel
 from contextlib import contextmanager, ExitStack
+from concurrent.futures import ThreadPoolExecutor
 
 from ...utils.common_schema import PhysicalTypeSchema
-from ...utils import get_pkg_data_path
+from ...utils import get_pkg_data_path, get_user_data_dir
 from .toltec_info import toltec_info
+from .toast_atm_cache import ToastAtmSlabCache
 from ..lmt import get_lmt_atm_models
 
 from ..base import ProjModel, LabelFrame
@@ -426,6 +430,189 @@ class ToltecSkyProjModel(ProjModel):
                 origin_coords_icrs.frame)
             return det_coords_icrs.ra, det_coords_icrs.dec, pa_icrs
 
+    @classmethod
+    def get_origin_rot_altaz_icrs(
+            cls, origin_coords_altaz, origin_coords_icrs):
+        """Return the position angle of the ICRS north in AltAz at origin.
+
+        This is the rotation angle of the ICRS offsets w.r.t. the AltAz
+        offsets, which is computed by transforming a probe point to the
+        north of the origin. Unlike `pa_from_coords`, the result is
+        accurate to the full transformation.
+        """
+        probe_coords_altaz = origin_coords_icrs.directional_offset_by(
+            0. << u.deg, 1. << u.arcmin).transform_to(
+                origin_coords_altaz.frame)
+        return origin_coords_altaz.position_angle(probe_coords_altaz)
+
+    @classmethod
+    @timeit
+    def evaluate_small_field(
+            cls, x, y, pa,
+            origin_coords_altaz,
+            origin_coords_icrs,
+            origin_pa_altaz_icrs,
+            origin_rot_altaz_icrs=None):
+        """Compute the projected coordinates in AltAz and ICRS with small
+        field approximation.
+
+        The AltAz coordinates are computed with the full transformation
+        as in :meth:`evaluate_altaz`, but the ICRS ones are computed
+        by rotating the detector offsets to the ICRS offset frame
+        of the origin, without transforming each detector coordinates from
+        AltAz to ICRS.
+
+        Parameters
+        ----------
+        x, y, pa : `astropy.units.Quantity`
+            The detector offsets and position angles of shape ``(n_det, )``
+            in the TolTEC frame.
+        origin_coords_altaz, origin_coords_icrs : `astropy.coordinates.SkyCoord`
+            The origin coordinates of shape ``(n_time, )``.
+        origin_pa_altaz_icrs : `astropy.coordinates.Angle`
+            The parallactic angle at the origin, of shape ``(n_time, )``.
+            This is added to the AltAz P.A. to get the ICRS P.A.
+        origin_rot_altaz_icrs : `astropy.coordinates.Angle`, optional
+            The rotation angle from AltAz offsets to ICRS offsets, of
+            shape ``(n_time, )``. It is computed with
+            :meth:`get_origin_rot_altaz_icrs` if not set.
+
+        Returns
+        -------
+        dict
+            The dict of shape ``(n_det, n_time)`` angles, with keys
+            ``az``, ``alt``, ``pa_altaz``, ``ra``, ``dec`` and ``pa_icrs``.
+        """
+        if origin_rot_altaz_icrs is None:
+            origin_rot_altaz_icrs = cls.get_origin_rot_altaz_icrs(
+                origin_coords_altaz, origin_coords_icrs)
+        x = x[:, np.newaxis]
+        y = y[:, np.newaxis]
+        pa = pa[:, np.newaxis]
+        origin_coords_altaz = origin_coords_altaz.reshape((1, -1))
+        origin_coords_icrs = origin_coords_icrs.reshape((1, -1))
+        az, alt, pa_altaz = cls.evaluate_altaz(
+            x, y, pa, origin_coords_altaz=origin_coords_altaz)
+        with timeit("apply rotation to detector offset coords"):
+            # the M3 rotation and the rotation from altaz to icrs.
+            # note that the icrs lon offset is flipped w.r.t. the
+            # altaz lon offset.
+            rot = origin_coords_altaz.alt + \
+                origin_rot_altaz_icrs[np.newaxis, :]
+            mat_rot = rotation_matrix_2d(rot.to_value(u.rad))
+            x_offset_icrs = -(mat_rot[0, 0] * x + mat_rot[0, 1] * y)
+            y_offset_icrs = mat_rot[1, 0] * x + mat_rot[1, 1] * y
+            pa_icrs = (
+                pa_altaz + origin_pa_altaz_icrs[np.newaxis, :]).to(u.deg)
+        with timeit("transform detector offset coords to icrs"):
+            icrs_offset_frame = _get_skyoffset_frame(origin_coords_icrs)
+            det_coords_icrs = SkyCoord(
+                x_offset_icrs, y_offset_icrs,
+                frame=icrs_offset_frame).transform_to(
+                    origin_coords_icrs.frame)
+        return {
+            'az': az,
+            'alt': alt,
+            'pa_altaz': pa_altaz,
+            'ra': det_coords_icrs.ra,
+            'dec': det_coords_icrs.dec,
+            'pa_icrs': pa_icrs,
+            }
+
+    @staticmethod
+    def _offset_to_lonlat(lon0, lat0, dlon, dlat):
+        """Return the lon and lat of the offsets `dlon` and `dlat` in the
+        sky offset frame centered at `lon0` and `lat0`.
+
+        All values are in radian.
+        """
+        cos_dlat = np.cos(dlat)
+        x = cos_dlat * np.cos(dlon)
+        y = cos_dlat * np.sin(dlon)
+        z = np.sin(dlat)
+        sin_lat0 = np.sin(lat0)
+        cos_lat0 = np.cos(lat0)
+        x, z = cos_lat0 * x - sin_lat0 * z, sin_lat0 * x + cos_lat0 * z
+        lon = lon0 + np.arctan2(y, x)
+        lat = np.arctan2(z, np.hypot(x, y))
+        return lon, lat
+
+    @classmethod
+    @timeit
+    def evaluate_vectorized(
+            cls, x, y, pa,
+            origin_az, origin_alt, origin_ra, origin_dec,
+            origin_pa_altaz_icrs, origin_rot_altaz_icrs,
+            out=None,
+            block_size=1024):
+        """Compute the projected coordinates in AltAz and ICRS with small
+        field approximation using plain NumPy operations.
+
+        This does the same calculation as :meth:`evaluate_small_field`,
+        but the M3 rotation, the parallactic rotation and the
+        deprojection from the sky offset frames are all done on the
+        ``(n_det, n_time)`` arrays directly.
+
+        Parameters
+        ----------
+        x, y, pa : `numpy.ndarray`
+            The detector offsets and position angles in radian, of shape
+            ``(n_det, )`` in the TolTEC frame.
+        origin_az, origin_alt, origin_ra, origin_dec : `numpy.ndarray`
+            The origin coordinates in radian, of shape ``(n_time, )``.
+        origin_pa_altaz_icrs : `numpy.ndarray`
+            The parallactic angle at the origin in radian, of shape
+            ``(n_time, )``.
+        origin_rot_altaz_icrs : `numpy.ndarray`
+            The rotation angle from AltAz offsets to ICRS offsets in
+            radian, of shape ``(n_time, )``.
+        out : dict, optional
+            The dict of float64 arrays of shape ``(n_det, n_time)`` to
+            write the results to.
+        block_size : int
+            The number of detectors to process at a time.
+
+        Returns
+        -------
+        dict
+            The dict of radian arrays of shape ``(n_det, n_time)``, with
+            keys ``az``, ``alt``, ``pa_altaz``, ``ra``, ``dec`` and
+            ``pa_icrs``.
+        """
+        n_det = len(x)
+        n_time = len(origin_az)
+        if out is None:
+            out = {
+                k: np.empty((n_det, n_time), dtype='d')
+                for k in ['az', 'alt', 'pa_altaz', 'ra', 'dec', 'pa_icrs']
+                }
+        cos_alt = np.cos(origin_alt)
+        sin_alt = np.sin(origin_alt)
+        rot = origin_alt + origin_rot_altaz_icrs
+        cos_rot = np.cos(rot)
+        sin_rot = np.sin(rot)
+        for i0 in range(0, n_det, block_size):
+            i1 = min(i0 + block_size, n_det)
+            _x = x[i0:i1, np.newaxis]
+            _y = y[i0:i1, np.newaxis]
+            _pa = pa[i0:i1, np.newaxis]
+            # M3 rotation, toltec frame to altaz offsets
+            out['az'][i0:i1], out['alt'][i0:i1] = cls._offset_to_lonlat(
+                origin_az, origin_alt,
+                cos_alt * _x - sin_alt * _y,
+                sin_alt * _x + cos_alt * _y,
+                )
+            out['pa_altaz'][i0:i1] = _pa + origin_alt
+            # M3 and parallactic rotation, toltec frame to icrs offsets
+            out['ra'][i0:i1], out['dec'][i0:i1] = cls._offset_to_lonlat(
+                origin_ra, origin_dec,
+                sin_rot * _y - cos_rot * _x,
+                sin_rot * _x + cos_rot * _y,
+                )
+            out['pa_icrs'][i0:i1] = out['pa_altaz'][i0:i1] \
+                + origin_pa_altaz_icrs
+        return out
+
     @staticmethod
     def _check_frame_by_name(frame, frame_name):
         if isinstance(frame, str):
@@ -655,11 +842,18 @@ class ToltecArrayPowerLoadingModel(Model):
             atm_model_name='am_q50',
             tel_surface_rms=None,
             det_noise_factor=None,
+            use_lut=True,
+            lut_dir=None,
             *args, **kwargs):
         super().__init__(name=f'{array_name}_loading', *args, **kwargs)
         self._inputs = ('alt', )
         self._outputs = ('P', 'nep')
         self._array_name = array_name
+        self._atm_model_name = atm_model_name
+        self._use_lut = use_lut
+        if lut_dir is None:
+            lut_dir = self._lut_dir_default
+        self._lut_dir = lut_dir
         self._array_info = toltec_info[array_name]
         self._passband = self._toltec_passbands[array_name]
         self._f = self._passband['f'].quantity
@@ -693,6 +887,127 @@ class ToltecArrayPowerLoadingModel(Model):
     def has_atm_model(self):
         return self._atm_model is not None
 
+    # the altitude grid of the lookup table
+    _lut_alt_grid = np.arange(10., 90. + 0.025, 0.05) << u.deg
+    # the lookup tables are generated and saved in the user data dir, since
+    # the package data dir may not be writable.
+    _lut_dir_default = get_user_data_dir().joinpath(
+        'cache/toltec_power_loading_lut')
+    # the lookup tables loaded in this process, keyed by the lut filename
+    _lut_cache = dict()
+
+    @property
+    def _lut_filename(self):
+        # the file name contains the hash of all params that change the
+        # loading and noise values.
+        lut_params = {
+            'array_name': self._array_name,
+            'atm_model_name': self._atm_model_name,
+            'tel_surface_rms': str(self._internal_params['tel_surface_rms']),
+            'det_noise_factor': float(
+                self._internal_params['det_noise_factor']),
+            'alt_grid': [
+                self._lut_alt_grid[0].to_value(u.deg),
+                self._lut_alt_grid[-1].to_value(u.deg),
+                len(self._lut_alt_grid)],
+            }
+        lut_hash = hashlib.sha1(
+            json.dumps(lut_params, sort_keys=True).encode()).hexdigest()
+        return (
+            f'{self._array_name}_{self._atm_model_name}_'
+            f'{lut_hash[:16]}.ecsv')
+
+    def _make_lut(self):
+        """Return the table of loading and noise values on the altitude grid
+        of the lookup table."""
+        alt = self._lut_alt_grid
+        with timeit(
+                f"make power loading lookup table for {self._array_name} "
+                f"with atm_model_name={self._atm_model_name} "
+                f"size={len(alt)}"):
+            lut = QTable()
+            lut['alt'] = alt
+            lut['P'] = self._get_P(alt)
+            lut.update(self._get_noise(alt, return_avg=True))
+        return lut
+
+    def get_lut(self):
+        """Return the lookup table of the loading and noise values.
+
+        The table is loaded from the lookup table dir if exists, or is
+        generated and saved there otherwise.
+        """
+        filename = self._lut_filename
+        lut = self._lut_cache.get(filename, None)
+        if lut is not None:
+            return lut
+        filepath = self._lut_dir.joinpath(filename)
+        if filepath.exists():
+            self.logger.debug(f"load power loading lookup table {filepath}")
+            lut = QTable.read(filepath, format='ascii.ecsv')
+        else:
+            lut = self._make_lut()
+            try:
+                self._lut_dir.mkdir(parents=True, exist_ok=True)
+                lut.write(filepath, format='ascii.ecsv')
+                self.logger.debug(
+                    f"saved power loading lookup table {filepath}")
+            except OSError as e:
+                self.logger.warning(
+                    f"unable to save power loading lookup table "
+                    f"{filepath}: {e}")
+        self._lut_cache[filename] = lut
+        return lut
+
+    def _interp_lut(self, alt, colname):
+        """Return the value of `colname` at `alt` interpolated from the
+        lookup table.
+
+        Altitudes outside of the table are evaluated directly.
+        """
+        lut = self.get_lut()
+        alt_grid = lut['alt'].to_value(u.deg)
+        col = lut[colname]
+        alt_deg = np.asanyarray(u.Quantity(alt, u.deg).value)
+        result = np.asarray(np.interp(alt_deg, alt_grid, col.value))
+        m = (alt_deg < alt_grid[0]) | (alt_deg > alt_grid[-1])
+        if np.any(m):
+            alt_out = alt_deg[m] << u.deg
+            if colname == 'P':
+                v = self._get_P(alt_out)
+            else:
+                v = self._get_noise(alt_out, return_avg=True)[colname]
+            result[m] = v.to_value(col.unit)
+        return result << col.unit
+
+    def get_P(self, alt):
+        """Return the detector power loading at altitude `alt`.
+
+        This uses the lookup table if enabled.
+        """
+        if not self._use_lut:
+            return self._get_P(alt)
+        return self._interp_lut(alt, 'P')
+
+    def get_noise(self, alt):
+        """Return the passband integrated noise at altitude `alt`.
+
+        This uses the lookup table if enabled.
+        """
+        if not self._use_lut:
+            return self._get_noise(alt, return_avg=True)
+        return {
+            k: self._interp_lut(alt, k)
+            for k in ['net_cmb', 'nefd', 'nep']
+            }
+
+    def get_dP(self, alt, f_smp):
+        """Return the detector power loading uncertainty at altitude `alt`.
+
+        This uses the lookup table if enabled.
+        """
+        return (self.get_noise(alt)['nep'] * np.sqrt(f_smp / 2.)).to(u.pW)
+
     @classproperty
     def _internal_params_default(cls):
         """Lower level instrument parameters for LMT/TolTEC.
@@ -1023,13 +1338,13 @@ class ToltecArrayPowerLoadingModel(Model):
             alt = [50., 60., 70.] << u.deg
         result = dict()
         result['alt'] = alt
-        result['P'] = self._get_P(alt)
-        result.update(self._get_noise(alt, return_avg=True))
+        result['P'] = self.get_P(alt)
+        result.update(self.get_noise(alt))
         return Table(result)
 
     def get_mapping_speed(self, alt, n_dets):
 
-        sens = self._get_noise(alt, return_avg=True)
+        sens = self.get_noise(alt)
         array_name = self._array_name
         a_stddev = toltec_info[array_name]['a_fwhm'] / GAUSSIAN_SIGMA_TO_FWHM
         b_stddev = toltec_info[array_name]['b_fwhm'] / GAUSSIAN_SIGMA_TO_FWHM
@@ -1046,8 +1361,8 @@ class ToltecArrayPowerLoadingModel(Model):
         return rms_depth
 
     def evaluate(self, alt):
-        P = self._get_P(alt)
-        nep = self._get_noise(alt, return_avg=True)['nep']
+        P = self.get_P(alt)
+        nep = self.get_noise(alt)['nep']
         return P, nep
 
     def sky_sb_to_pwr(self, det_s):
@@ -1072,6 +1387,12 @@ class ToltecArrayPowerLoadingModel(Model):
 
     @contextmanager
     def eval_interp_context(self, alt_grid):
+        if self._use_lut:
+            # the lookup table is used for all evaluations so no
+            # interp is needed.
+            self.get_lut()
+            yield self
+            return
         interp_kwargs = dict(kind='linear')
         with timeit(
             f"setup power loading model for {self._array_name} "
@@ -1102,12 +1423,15 @@ class ToltecArrayPowerLoadingModel(Model):
             ):
         """Return the array power loading along with the noise."""
 
-        if getattr(self, '_p_pW_interp', None) is None:
+        if self._use_lut:
+            det_pwr = self.get_P(det_alt)
+            det_delta_pwr = self.get_dP(det_alt, f_smp)
+        elif getattr(self, '_p_pW_interp', None) is None:
             # no interp, direct eval
             alt = np.ravel(det_alt)
-            det_pwr = self._get_P(alt).to(u.pW).reshape(det_alt.shape),
+            det_pwr = self._get_P(alt).to(u.pW).reshape(det_alt.shape)
             det_delta_pwr = self._get_dP(alt, f_smp).reshape(
-                det_alt.shape).to(u.pW),
+                det_alt.shape).to(u.pW)
         else:
             det_pwr = self._p_pW_interp(det_alt.degree) << u.pW
             one_Hz = 1. << u.Hz
@@ -1120,8 +1444,8 @@ class ToltecArrayPowerLoadingModel(Model):
         det_noise = rng.normal(0., det_delta_pwr.to_value(u.pW)) << u.pW
         # calc the median P and dP for logging purpose
         med_alt = np.median(det_alt)
-        med_P = self._get_P(med_alt).to(u.pW)
-        med_dP = self._get_dP(med_alt, f_smp).to(u.aW)
+        med_P = self.get_P(med_alt).to(u.pW)
+        med_dP = self.get_dP(med_alt, f_smp).to(u.aW)
         self.logger.debug(
             f"array power loading at med_alt={med_alt} P={med_P} dP={med_dP}")
         return det_pwr, det_noise
@@ -1144,6 +1468,9 @@ class ToltecPowerLoadingModel(PowerLoadingModel):
     def __init__(
             self, atm_model_name, atm_model_params=None,
             atm_cache_dir=None,
+            atm_cache_max_size=None,
+            atm_det_block_size=64,
+            atm_n_threads=1,
             tel_surface_rms=None,
             det_noise_factor=None,
             ):
@@ -1170,7 +1497,10 @@ class ToltecPowerLoadingModel(PowerLoadingModel):
         if atm_model_name == 'toast':
             self._toast_atm_evaluator = ToastAtmEvaluator(
                 cache_dir=atm_cache_dir,
-                params=atm_model_params)
+                params=atm_model_params,
+                cache_max_size=atm_cache_max_size,
+                det_block_size=atm_det_block_size,
+                n_threads=atm_n_threads)
         else:
             self._toast_atm_evaluator = None
         super().__init__(name='toltec_power_loading')
@@ -1452,13 +1782,32 @@ class ToastAtmConfig(object):
 
 
 class ToastAtmEvaluator(object):
-    """A helper class to work with the Toast Atm model class."""
+    """A helper class to work with the Toast Atm model class.
+
+    When `cache_dir` is set, the generated slabs are kept in a
+    :class:`ToastAtmSlabCache` in it, and are reused by later setups with
+    the same params, start time and contained time range and sky bbox.
+
+    The slabs are observed in blocks of `det_block_size` detectors, which
+    are distributed to `n_threads` threads.
+    """
+
+    logger = get_logger()
 
-    def __init__(self, cache_dir=None, params=None):
+    def __init__(
+            self, cache_dir=None, params=None, cache_max_size=None,
+            det_block_size=64, n_threads=1):
         self._cache_dir = cache_dir
+        self._det_block_size = det_block_size
+        self._n_threads = n_threads
         if params is None:
             params = ToastAtmConfig()
         self._params = params
+        if cache_dir is None:
+            self._slab_cache = None
+        else:
+            self._slab_cache = ToastAtmSlabCache(
+                cache_dir, max_size=cache_max_size)
         self._toast_atm_simu = None
 
     @contextmanager
@@ -1470,6 +1819,7 @@ class ToastAtmEvaluator(object):
         from . import toast_atm
 
         self.logger = get_logger()
+        setup_params = self._params.to_dict()
         init_kwargs = {
             't0': t0,
             'tmin': t0.unix,
@@ -1478,93 +1828,154 @@ class ToastAtmEvaluator(object):
             'azmax': sky_bbox_altaz.e,
             'elmin': sky_bbox_altaz.s,
             'elmax': sky_bbox_altaz.n,
-            'cachedir': self._cache_dir
+            'cachedir': None,
             }
+        slab_cache = self._slab_cache
+        cache_entry = None
+        cache_lookup = None
+        if slab_cache is not None:
+            params_hash = slab_cache.make_params_hash(setup_params, t0)
+            cache_lookup = slab_cache.lookup(
+                params_hash,
+                tmin=init_kwargs['tmin'],
+                tmax=init_kwargs['tmax'],
+                sky_bbox_altaz=sky_bbox_altaz)
+            if cache_lookup is not None:
+                cache_key, entry = cache_lookup
+                cache_dir = slab_cache.get_entry_dir(cache_key)
+                self.logger.info(f"reuse cached toast atm slabs {cache_key}")
+                # the slabs are re-created with the cached ranges so that
+                # toast loads them from its cache files
+                init_kwargs.update({
+                    'tmin': entry['tmin'],
+                    'tmax': entry['tmax'],
+                    'azmin': entry['azmin'] << u.deg,
+                    'azmax': entry['azmax'] << u.deg,
+                    'elmin': entry['elmin'] << u.deg,
+                    'elmax': entry['elmax'] << u.deg,
+                    })
+            else:
+                cache_key, cache_entry = slab_cache.create(
+                    params_hash,
+                    tmin=init_kwargs['tmin'],
+                    tmax=init_kwargs['tmax'],
+                    sky_bbox_altaz=sky_bbox_altaz)
+                cache_dir = slab_cache.get_build_dir(cache_key)
+                self.logger.info(
+                    f"create toast atm slabs in cache {cache_key}")
+            init_kwargs['cachedir'] = cache_dir.as_posix()
         self.logger.debug(
             f"init toast atm simulation with:\n{pformat_yaml(init_kwargs)}"
             )
-        toast_atm_simu = self._toast_atm_simu = \
-            toast_atm.ToastAtmosphereSimulation(**init_kwargs)
-        # here we can pass the atm params to toast for generating the slabs
-        setup_params = self._params
-
-        self.logger.debug(
-            f"setup toast atm simulation slabs with params:\n"
-            f"{pformat_yaml(setup_params)}")
-        toast_atm_simu.generate_simulation(self._params.to_dict())
+        try:
+            toast_atm_simu = self._toast_atm_simu = \
+                toast_atm.ToastAtmosphereSimulation(**init_kwargs)
+            # here we can pass the atm params to toast for generating the
+            # slabs
+            self.logger.debug(
+                f"setup toast atm simulation slabs with params:\n"
+                f"{pformat_yaml(setup_params)}")
+            toast_atm_simu.generate_simulation(setup_params)
+        finally:
+            # the slabs are in memory once generated or loaded
+            if cache_lookup is not None:
+                slab_cache.release(cache_key)
+        if cache_entry is not None:
+            slab_cache.commit(cache_key, cache_entry)
         yield
         # clean up the context
         self._toast_atm_simu = None
 
-    def calc_toast_atm_pwr_for_array(
-            self, array_name, det_az, det_alt, time_obs_unix):
-        toast_atm_simu = self._toast_atm_simu
-        if toast_atm_simu is None:
-            raise RuntimeError(
-                "The toast atm simulator is not setup.")
-
-        # to contain each individual slab
-        atm_pW_additive = list()
+    def _observe_det_block(
+            self, toast_atm_simu, times, det_az, det_alt, out):
+        """Accumulate the slab observations of one detector block to `out`.
 
-        # ravels the 2D array into one 1D array as opposed
-        # to iterating over all detectors
-        # this is now directly impacted by the chunk size
-        # this also covers the 1d case because ravel is a no-op.
-        original_shape = det_alt.shape
-        det_alt_observe = det_alt.ravel()
-        det_az_observe = det_az.ravel()
-        time_obs_unix_observe = np.tile(
-            time_obs_unix, original_shape[0])  # time steps * no of detectors
-
-        # iterate through all generated slabs
+        `times`, `det_az` and `det_alt` are flattened arrays in unix time
+        and radian.
+        """
+        atmtod = np.empty_like(out)
         for slab_id, atm_slab in toast_atm_simu.atm_slabs.items():
-            self.logger.debug(
-                f"integrating {array_name=} "
-                f"({det_az_observe.size} discrete steps) on {slab_id=}")
-
             # returns atmospheric brightness temperature (Kelvin)
-            atmtod = np.zeros_like(time_obs_unix_observe)
-            # print(atmtod.size, det_az.to(u.radian).value.size,
-            #       det_alt.to(u.radian).value.size, time_obs_unix.size)
-            # print(det_az, det_alt)
+            atmtod[:] = 0.
             err = atm_slab.observe(
-                times=time_obs_unix_observe,
-                az=det_az_observe.to_value(u.radian),
-                el=det_alt_observe.to_value(u.radian),
+                times=times,
+                az=det_az,
+                el=det_alt,
                 tod=atmtod,
                 fixed_r=0,
             )
             if err != 0:
-                self.logger.error(f"toast slab observation failed {err=}")
+                self.logger.error(
+                    f"toast slab observation failed {err=} {slab_id=}")
                 raise RuntimeError("toast slab observation failed")
-            self.logger.debug('toast slab observation observation success')
+            out += atmtod
+        return out
 
-            absorption_det = toast_atm_simu.absorption[array_name]
-            loading_det = toast_atm_simu.loading[array_name]
-            atm_gain = 1e-3  # this value is used to bring down the bandpass
+    def calc_toast_atm_pwr_for_array(
+            self, array_name, det_az, det_alt, time_obs_unix):
+        toast_atm_simu = self._toast_atm_simu
+        if toast_atm_simu is None:
+            raise RuntimeError(
+                "The toast atm simulator is not setup.")
 
-            # calibrate the atmopsheric fluctuations to appropriate bandpass
-            atmtod *= atm_gain * absorption_det
+        # this also covers the 1d case of a single detector.
+        original_shape = det_alt.shape
+        det_az = np.atleast_2d(det_az.to_value(u.radian))
+        det_alt = np.atleast_2d(det_alt.to_value(u.radian))
+        n_dets, n_times = det_alt.shape
+        det_block_size = min(self._det_block_size, n_dets)
+        n_slabs = len(toast_atm_simu.atm_slabs)
+        self.logger.debug(
+            f"integrating {array_name=} ({det_alt.size} discrete steps) "
+            f"on {n_slabs} slabs in blocks of {det_block_size} detectors")
+
+        # the sum of the atmospheric brightness temperature of all slabs
+        atmtod = np.zeros((n_dets, n_times), dtype='d')
+        # the time steps of the largest block, which are shared by all
+        # blocks.
+        times = np.tile(time_obs_unix, det_block_size)
+
+        def observe_det_block(i0):
+            i1 = min(i0 + det_block_size, n_dets)
+            n = (i1 - i0) * n_times
+            # the rows of the detector block are contiguous
+            out = atmtod[i0:i1].reshape(-1)
+            self._observe_det_block(
+                toast_atm_simu,
+                times[:n],
+                np.ascontiguousarray(det_az[i0:i1]).reshape(-1),
+                np.ascontiguousarray(det_alt[i0:i1]).reshape(-1),
+                out)
+
+        block_starts = range(0, n_dets, det_block_size)
+        if self._n_threads > 1 and len(block_starts) > 1:
+            # the toast observation releases the GIL so the blocks can
+            # be done concurrently.
+            with ThreadPoolExecutor(max_workers=self._n_threads) as executor:
+                for _ in executor.map(observe_det_block, block_starts):
+                    pass
+        else:
+            for i0 in block_starts:
+                observe_det_block(i0)
+        self.logger.debug('toast slab observation observation success')
 
-            # add the elevation-dependent atmospheric loading component
-            atmtod += loading_det / np.sin(det_alt_observe.to_value(u.radian))
+        absorption_det = toast_atm_simu.absorption[array_name]
+        loading_det = toast_atm_simu.loading[array_name]
+        atm_gain = 1e-3  # this value is used to bring down the bandpass
 
-            atmtod *= 5e-2  # bring it down again
+        # calibrate the atmopsheric fluctuations to appropriate bandpass
+        atmtod *= atm_gain * absorption_det
 
-            # convert from antenna temperature (Kelvin) to MJy/sr
-            # conversion_equiv = u.brightness_temperature(
-            #     info_single['wl_center'])
-            # atm_Mjy_sr = (atmtod * u.Kelvin).to_value(
-            #     u.MJy / u.sr, equivalencies=conversion_equiv),
+        # add the elevation-dependent atmospheric loading component, which
+        # is included once for each slab
+        atmtod += n_slabs * loading_det / np.sin(det_alt)
 
-            # convert from antenna temperature (Kelvin) to pW
-            pb_width = toltec_info[array_name]['passband']
-            atm_pW = ((atmtod << u.Kelvin).to(
-                u.J, equivalencies=u.temperature_energy()) * pb_width).to(u.pW)
-            atm_pW_additive.append(atm_pW)
+        atmtod *= 5e-2  # bring it down again
 
-        # sum over all slabs
-        result = np.sum(atm_pW_additive, axis=0) << u.pW
+        # convert from antenna temperature (Kelvin) to pW
+        pb_width = toltec_info[array_name]['passband']
+        result = ((atmtod << u.Kelvin).to(
+            u.J, equivalencies=u.temperature_energy()) * pb_width).to(u.pW)
 
         # reshape back if that is required
         if original_shape != result.shape:
@@ -5,7 +5,8 @@ from .models import (
     ToltecPowerLoadingModel)
 from .toltec_info import toltec_info
 from ..utils import (
-    PersistentState, SkyBoundingBox, get_lon_extent, make_time_grid)
+    PersistentState, SkyBoundingBox, get_lon_extent, make_time_grid,
+    SubsamplePlanner, SkyTrajStore, interp_linear_into)
 from ..mapping import (PatternKind, LmtTcsTrajMappingModel)
 from ..mapping.utils import resolve_sky_coords_frame
 from ..sources.base import (SurfaceBrightnessModel, )
@@ -20,7 +21,6 @@ from tollan.utils import rupdate
 from kidsproc.kidsmodel.simulator import KidsSimulator
 from kidsproc.kidsmodel import ReadoutGainWithLinTrend
 
-from scipy.interpolate import interp1d
 import netCDF4
 import astropy.units as u
 from astropy.table import Column, QTable
@@ -29,13 +29,15 @@ from contextlib import ExitStack, contextmanager
 from datetime import datetime
 import shutil
 from dataclasses import dataclass, field
+from typing import ClassVar, Union
+from schema import Or
 from astropy.coordinates.erfa_astrom import (
         erfa_astrom, ErfaAstromInterpolator)
 from astropy.coordinates import Angle, Longitude, Latitude  # , AltAz, SkyCoord
 from astropy.modeling.functional_models import GAUSSIAN_SIGMA_TO_FWHM
 
 
-__all__ = ['ToltecObsSimulator', 'ToltecHwpConfig']
+__all__ = ['ToltecObsSimulator', 'ToltecHwpConfig', 'ToltecNcLayoutConfig']
 
 
 @add_schema
@@ -78,6 +80,116 @@ class ToltecHwpConfig(object):
             }
 
 
+@add_schema
+@dataclass
+class ToltecNcLayoutConfig(object):
+    """The config class for the layout of the data variables in the
+    simulator output files."""
+
+    preallocate: bool = field(
+        default=False,
+        metadata={
+            'description': (
+                'If True, the time dimension is created with the full '
+                'length of the simulation instead of being unlimited.')
+            }
+        )
+    chunk_time: Union[None, str, int] = field(
+        default=None,
+        metadata={
+            'description': (
+                'The chunk size along the time dimension. "auto" uses '
+                'the number of samples in each simulation chunk. Default '
+                'is to use the netCDF default chunking.'),
+            'schema': Or(None, 'auto', int),
+            }
+        )
+    chunk_tones: Union[None, int] = field(
+        default=None,
+        metadata={
+            'description': (
+                'The chunk size along the tone dimension. Default is to '
+                'include all tones in each chunk. This is only used when '
+                'chunk_time is set.'),
+            'schema': Or(None, int),
+            }
+        )
+    zlib: bool = field(
+        default=False,
+        metadata={
+            'description': 'If True, enable zlib compression.'
+            }
+        )
+    complevel: int = field(
+        default=1,
+        metadata={
+            'description': 'The zlib compression level.'
+            }
+        )
+    shuffle: bool = field(
+        default=True,
+        metadata={
+            'description': (
+                'If True, enable the HDF5 shuffle filter along with '
+                'zlib compression.')
+            }
+        )
+
+    class Meta:
+        schema = {
+            'ignore_extra_keys': False,
+            'description': (
+                'The parameters related to the layout of output files.')
+            }
+
+    # named layouts that can be used in place of the config dict.
+    presets: ClassVar[dict] = {
+        'default': {},
+        'preallocated': {'preallocate': True},
+        'chunked': {'preallocate': True, 'chunk_time': 'auto'},
+        'compressed': {
+            'preallocate': True, 'chunk_time': 'auto', 'zlib': True},
+        }
+
+    @classmethod
+    def from_preset(cls, name):
+        if name not in cls.presets:
+            raise ValueError(
+                f"invalid nc layout preset {name}. "
+                f"Available presets: {list(cls.presets.keys())}")
+        return cls.from_dict(cls.presets[name])
+
+    def get_time_dim_size(self, n_times):
+        """Return the size of the time dimension to create."""
+        if self.preallocate:
+            return n_times
+        return None
+
+    def get_var_kwargs(self, n_times_per_chunk, chunk_sizes=()):
+        """Return the kwargs to create a time dependent variable.
+
+        Parameters
+        ----------
+        n_times_per_chunk : int
+            The number of samples in each simulation chunk.
+        chunk_sizes : tuple
+            The integer chunk sizes of the dimensions other than time, in
+            order. The tone dimension uses `chunk_tones`, capped at the
+            number of tones.
+        """
+        kwargs = dict()
+        if self.chunk_time is not None:
+            if self.chunk_time == 'auto':
+                chunk_time = n_times_per_chunk
+            else:
+                chunk_time = self.chunk_time
+            kwargs['chunksizes'] = (chunk_time, ) + tuple(chunk_sizes)
+        if self.zlib:
+            kwargs.update(
+                zlib=True, complevel=self.complevel, shuffle=self.shuffle)
+        return kwargs
+
+
 class ToltecObsSimulator(object):
 
     logger = get_logger()
@@ -264,6 +376,38 @@ class ToltecObsSimulator(object):
         return ToltecSimuOutputContext(
             simulator=self, rootpath=dirpath, **kwargs)
 
+    # the names of the detector sky trajectory arrays
+    _det_sky_traj_names = ['az', 'alt', 'pa_altaz', 'ra', 'dec', 'pa_icrs']
+    # the available engines to project detector positions
+    _sky_proj_engines = ['exact', 'small_field', 'vectorized']
+    # the names of the boresight trajectory arrays in the traj store
+    _bs_traj_names = [
+        'bs_ra', 'bs_dec', 'bs_az', 'bs_alt', 'bs_pa',
+        'target_az', 'target_alt', 'hwp_pa_t']
+
+    @staticmethod
+    def _make_det_sky_traj_from_buffers(
+            bufs, lon_wrap_angle_altaz=None, lon_wrap_angle_icrs=None):
+        """Return det sky traj dict of angles as views to float64 radian
+        arrays in `bufs`.
+
+        Note that the longitudes are re-wrapped in-place.
+        """
+        det_sky_traj = dict()
+        det_sky_traj['az'] = Longitude(
+            bufs['az'] << u.rad, wrap_angle=lon_wrap_angle_altaz,
+            copy=False)
+        det_sky_traj['alt'] = Latitude(bufs['alt'] << u.rad, copy=False)
+        det_sky_traj['pa_altaz'] = Angle(
+            bufs['pa_altaz'] << u.rad, copy=False)
+        det_sky_traj['ra'] = Longitude(
+            bufs['ra'] << u.rad, wrap_angle=lon_wrap_angle_icrs,
+            copy=False)
+        det_sky_traj['dec'] = Latitude(bufs['dec'] << u.rad, copy=False)
+        det_sky_traj['pa_icrs'] = Angle(
+            bufs['pa_icrs'] << u.rad, copy=False)
+        return det_sky_traj
+
     @timeit
     def _get_detector_sky_traj(
             self,
@@ -272,11 +416,33 @@ class ToltecObsSimulator(object):
             bs_coords_icrs,
             evaluate_interp_len=None,
             lon_wrap_angle_altaz=None,
-            lon_wrap_angle_icrs=None):
+            lon_wrap_angle_icrs=None,
+            subsample_planner=None,
+            out=None,
+            sky_proj_engine='exact',
+            bs_parallactic_angle=None):
         """Return the detector positions of shape [n_detectors, n_times]
         on sky.
+
+        When `evaluate_interp_len` is set, the projection is only evaluated
+        on the subsample selected by `subsample_planner` and is linearly
+        interpolated for the rest.
+
+        When `out` is set, it shall be a dict of float64 arrays of shape
+        [n_detectors, n_times] keyed by the trajectory names, to which the
+        values are written in radian. The returned angles are views to
+        these arrays.
+
+        The `sky_proj_engine` is one of ``exact``, ``small_field`` and
+        ``vectorized``. The ``exact`` engine transforms all detector
+        positions from AltAz to ICRS. The other two compute the ICRS
+        positions by rotating the detector offsets around the bore sight,
+        with the ``vectorized`` engine doing all the calculations in
+        plain NumPy.
         """
         logger = get_logger()
+        if sky_proj_engine not in self._sky_proj_engines:
+            raise ValueError(f"invalid sky_proj_engine {sky_proj_engine}")
         if evaluate_interp_len is None:
             apt = self.array_prop_table
             x_t = apt['x_t']
@@ -285,31 +451,75 @@ class ToltecObsSimulator(object):
 
             logger.debug(
                 f'get {len(apt)} detector sky trajectories for '
-                f'{len(time_obs)} time steps')
-
-            m_sky_proj = self._m_sky_proj_cls(
-                origin_coords_icrs=bs_coords_icrs,
-                origin_coords_altaz=bs_coords_altaz)
-            # this will do the altaz and icrs eval and save all
-            # intermediate objects in the eval_ctx dict
-            _, eval_ctx = m_sky_proj(
-                x_t[np.newaxis, :],
-                y_t[np.newaxis, :],
-                pa_t[np.newaxis, :],
-                evaluate_frame='icrs',
-                use_evaluate_icrs_fast=False,
-                return_eval_context=True
-                )
-            # unpack the eval_ctx
-            # note that the detector id is dim0 and time_obs is dim1
-            det_sky_traj = dict()
-            det_sky_traj['az'] = eval_ctx['coords_altaz'].az
-            det_sky_traj['alt'] = eval_ctx['coords_altaz'].alt
-            det_sky_traj['pa_altaz'] = eval_ctx['pa_altaz']
-            det_sky_traj['ra'] = eval_ctx['coords_icrs'].ra
-            det_sky_traj['dec'] = eval_ctx['coords_icrs'].dec
-            det_sky_traj['pa_icrs'] = eval_ctx['pa_icrs']
-            # dpa_altaz_icrs = eval_ctx['dpa_altaz_icrs']
+                f'{len(time_obs)} time steps with '
+                f'sky_proj_engine={sky_proj_engine}')
+            m_sky_proj_cls = self._m_sky_proj_cls
+            if sky_proj_engine != 'exact':
+                if bs_parallactic_angle is None:
+                    bs_parallactic_angle = pa_from_coords(
+                        observer=self.observer,
+                        coords_altaz=bs_coords_altaz,
+                        coords_icrs=bs_coords_icrs)
+                bs_rot_altaz_icrs = m_sky_proj_cls.get_origin_rot_altaz_icrs(
+                    bs_coords_altaz, bs_coords_icrs)
+            if sky_proj_engine == 'vectorized':
+                out = m_sky_proj_cls.evaluate_vectorized(
+                    x_t.to_value(u.rad),
+                    y_t.to_value(u.rad),
+                    pa_t.to_value(u.rad),
+                    origin_az=bs_coords_altaz.az.radian,
+                    origin_alt=bs_coords_altaz.alt.radian,
+                    origin_ra=bs_coords_icrs.ra.radian,
+                    origin_dec=bs_coords_icrs.dec.radian,
+                    origin_pa_altaz_icrs=bs_parallactic_angle.radian,
+                    origin_rot_altaz_icrs=bs_rot_altaz_icrs.radian,
+                    out=out,
+                    )
+                return self._make_det_sky_traj_from_buffers(
+                    out,
+                    lon_wrap_angle_altaz=lon_wrap_angle_altaz,
+                    lon_wrap_angle_icrs=lon_wrap_angle_icrs,
+                    )
+            if sky_proj_engine == 'small_field':
+                det_sky_traj = m_sky_proj_cls.evaluate_small_field(
+                    x_t, y_t, pa_t,
+                    origin_coords_altaz=bs_coords_altaz,
+                    origin_coords_icrs=bs_coords_icrs,
+                    origin_pa_altaz_icrs=bs_parallactic_angle,
+                    origin_rot_altaz_icrs=bs_rot_altaz_icrs,
+                    )
+            else:
+                m_sky_proj = m_sky_proj_cls(
+                    origin_coords_icrs=bs_coords_icrs,
+                    origin_coords_altaz=bs_coords_altaz)
+                # this will do the altaz and icrs eval and save all
+                # intermediate objects in the eval_ctx dict
+                _, eval_ctx = m_sky_proj(
+                    x_t[np.newaxis, :],
+                    y_t[np.newaxis, :],
+                    pa_t[np.newaxis, :],
+                    evaluate_frame='icrs',
+                    use_evaluate_icrs_fast=False,
+                    return_eval_context=True
+                    )
+                # unpack the eval_ctx
+                # note that the detector id is dim0 and time_obs is dim1
+                det_sky_traj = dict()
+                det_sky_traj['az'] = eval_ctx['coords_altaz'].az
+                det_sky_traj['alt'] = eval_ctx['coords_altaz'].alt
+                det_sky_traj['pa_altaz'] = eval_ctx['pa_altaz']
+                det_sky_traj['ra'] = eval_ctx['coords_icrs'].ra
+                det_sky_traj['dec'] = eval_ctx['coords_icrs'].dec
+                det_sky_traj['pa_icrs'] = eval_ctx['pa_icrs']
+                # dpa_altaz_icrs = eval_ctx['dpa_altaz_icrs']
+            if out is not None:
+                for k, v in det_sky_traj.items():
+                    out[k][:] = v.to_value(u.rad)
+                return self._make_det_sky_traj_from_buffers(
+                    out,
+                    lon_wrap_angle_altaz=lon_wrap_angle_altaz,
+                    lon_wrap_angle_icrs=lon_wrap_angle_icrs,
+                    )
             # set the lon wrap angle if specified
             if lon_wrap_angle_altaz is not None:
                 det_sky_traj['az'].wrap_angle = lon_wrap_angle_altaz
@@ -322,80 +532,118 @@ class ToltecObsSimulator(object):
         logger.debug(
             f"evaluate sky_proj_model with "
             f"evaluate_interp_len={evaluate_interp_len}")
-        mjd = time_obs.mjd << u.day
-        if not np.all(np.diff(mjd) >= 0):
+        if subsample_planner is None:
+            subsample_planner = SubsamplePlanner(evaluate_interp_len)
+        mjd_day = time_obs.mjd
+        if not np.all(np.diff(mjd_day) >= 0):
             raise ValueError('time_obs has to be sorted ascending.')
         # collect the subsample index
-        s = [0]
-        for i, t in enumerate(mjd):
-            if t - mjd[s[-1]] < evaluate_interp_len:
-                continue
-            s.append(i)
-        # ensure the last index is in the subsample
-        if s[-1] != len(mjd) - 1:
-            s.append(-1)
+        s = subsample_planner.get_subsample_index(mjd_day)
         logger.debug(
-            f"prepare sky_proj_model for {len(s)}/{len(mjd)} time steps")
+            f"prepare sky_proj_model for {len(s)}/{len(mjd_day)} time steps")
         time_obs_s = time_obs[s]
         bs_coords_altaz_s = bs_coords_altaz[s]
         bs_coords_icrs_s = bs_coords_icrs[s]
+        if bs_parallactic_angle is not None:
+            bs_parallactic_angle = bs_parallactic_angle[s]
         # evaluate with the subsample data
         det_sky_traj_s = self._get_detector_sky_traj(
             time_obs=time_obs_s,
             bs_coords_altaz=bs_coords_altaz_s,
             bs_coords_icrs=bs_coords_icrs_s,
-            evaluate_interp_len=None
+            evaluate_interp_len=None,
+            sky_proj_engine=sky_proj_engine,
+            bs_parallactic_angle=bs_parallactic_angle,
             )
         # now build the interp along the time dim.
         # note that the longitude interp has to work outside of the
         # wrap angle. We determine the wrap angle and re-wrap it for interp
         det_az = det_sky_traj_s['az']
         _, _, det_az_wrap_angle = get_lon_extent(det_az)
-        det_az = Longitude(det_az, wrap_angle=det_az_wrap_angle)
+        det_sky_traj_s['az'] = Longitude(
+            det_az, wrap_angle=det_az_wrap_angle)
         det_ra = det_sky_traj_s['ra']
         _, _, det_ra_wrap_angle = get_lon_extent(det_ra)
-        det_ra = Longitude(det_ra, wrap_angle=det_ra_wrap_angle)
-
-        mjd_day_s = mjd[s].to_value(u.day)
-        interp_kwargs = dict(kind='linear', axis=1)
-        az_deg_interp = interp1d(
-                mjd_day_s,
-                det_az.degree, **interp_kwargs)
-        alt_deg_interp = interp1d(
-                mjd_day_s,
-                det_sky_traj_s['alt'].degree, **interp_kwargs)
-        pa_altaz_deg_interp = interp1d(
-            mjd_day_s,
-            det_sky_traj_s['pa_altaz'].to_value(u.deg), **interp_kwargs)
-
-        ra_deg_interp = interp1d(
-                mjd_day_s,
-                det_ra.degree, **interp_kwargs)
-        dec_deg_interp = interp1d(
-                mjd_day_s,
-                det_sky_traj_s['dec'].degree, **interp_kwargs)
-        pa_icrs_deg_interp = interp1d(
-            mjd_day_s,
-            det_sky_traj_s['pa_icrs'].to_value(u.deg), **interp_kwargs)
-        # interp for full time steps
+        det_sky_traj_s['ra'] = Longitude(
+            det_ra, wrap_angle=det_ra_wrap_angle)
+        # interp for full time steps into the output buffers
+        if out is None:
+            shape = (len(self.array_prop_table), len(mjd_day))
+            out = {
+                k: np.empty(shape, dtype='d')
+                for k in self._det_sky_traj_names
+                }
+        mjd_day_s = mjd_day[s]
+        for k in self._det_sky_traj_names:
+            interp_linear_into(
+                mjd_day, mjd_day_s,
+                np.broadcast_to(
+                    det_sky_traj_s[k].to_value(u.rad),
+                    (out[k].shape[0], len(mjd_day_s))),
+                out=out[k])
         # we use the wrap angle when it is not specified
         if lon_wrap_angle_altaz is None:
             lon_wrap_angle_altaz = det_az_wrap_angle
         if lon_wrap_angle_icrs is None:
             lon_wrap_angle_icrs = det_ra_wrap_angle
-        mjd_day = mjd.to_value(u.day)
-        det_sky_traj = dict()
-        det_sky_traj['az'] = Longitude(
-            az_deg_interp(mjd_day) << u.deg,
-            wrap_angle=lon_wrap_angle_altaz)
-        det_sky_traj['alt'] = Latitude(alt_deg_interp(mjd_day) << u.deg)
-        det_sky_traj['pa_altaz'] = Angle(pa_altaz_deg_interp(mjd_day) << u.deg)
-        det_sky_traj['ra'] = Longitude(
-            ra_deg_interp(mjd_day) << u.deg,
-            wrap_angle=lon_wrap_angle_icrs)
-        det_sky_traj['dec'] = Latitude(dec_deg_interp(mjd_day) << u.deg)
-        det_sky_traj['pa_icrs'] = Angle(pa_icrs_deg_interp(mjd_day) << u.deg)
-        return det_sky_traj
+        return self._make_det_sky_traj_from_buffers(
+            out,
+            lon_wrap_angle_altaz=lon_wrap_angle_altaz,
+            lon_wrap_angle_icrs=lon_wrap_angle_icrs,
+            )
+
+    def get_sky_proj_accuracy_report(
+            self, time_obs, bs_coords_altaz, bs_coords_icrs,
+            sky_proj_engine, bs_parallactic_angle=None, n_samples=10):
+        """Return a table of the difference of the detector positions
+        computed with `sky_proj_engine` with respect to the exact engine.
+
+        The comparison is done on `n_samples` time steps evenly selected
+        from `time_obs`.
+        """
+        s = np.unique(np.linspace(
+            0, len(time_obs) - 1, n_samples).astype(int))
+        if bs_parallactic_angle is not None:
+            bs_parallactic_angle = bs_parallactic_angle[s]
+        traj = dict()
+        for engine in ['exact', sky_proj_engine]:
+            traj[engine] = self._get_detector_sky_traj(
+                time_obs=time_obs[s],
+                bs_coords_altaz=bs_coords_altaz[s],
+                bs_coords_icrs=bs_coords_icrs[s],
+                evaluate_interp_len=None,
+                sky_proj_engine=engine,
+                bs_parallactic_angle=bs_parallactic_angle,
+                )
+        t0 = traj['exact']
+        t1 = traj[sky_proj_engine]
+
+        def _wrap(a):
+            return (a + np.pi) % (2 * np.pi) - np.pi
+
+        diffs = {
+            'az': _wrap(t1['az'].radian - t0['az'].radian) * np.cos(
+                t0['alt'].radian),
+            'alt': t1['alt'].radian - t0['alt'].radian,
+            'pa_altaz': _wrap(
+                t1['pa_altaz'].radian - t0['pa_altaz'].radian),
+            'ra': _wrap(t1['ra'].radian - t0['ra'].radian) * np.cos(
+                t0['dec'].radian),
+            'dec': t1['dec'].radian - t0['dec'].radian,
+            'pa_icrs': _wrap(
+                t1['pa_icrs'].radian - t0['pa_icrs'].radian),
+            }
+        tbl = QTable()
+        tbl['name'] = list(diffs.keys())
+        tbl['max_abs_diff'] = [
+            np.max(np.abs(d)) for d in diffs.values()] << u.rad
+        tbl['mean_abs_diff'] = [
+            np.mean(np.abs(d)) for d in diffs.values()] << u.rad
+        for c in ['max_abs_diff', 'mean_abs_diff']:
+            tbl[c] = tbl[c].to(u.arcsec)
+        tbl.meta['sky_proj_engine'] = sky_proj_engine
+        tbl.meta['n_samples'] = len(s)
+        return tbl
 
     def probing_evaluator(
             self,
@@ -558,13 +806,38 @@ class ToltecObsSimulator(object):
             pointing_model_altaz=None,
             erfa_interp_len=300. << u.s,
             eval_interp_len=0.1 << u.s,
-            catalog_model_render_pixel_size=0.5 << u.arcsec):
+            catalog_model_render_pixel_size=0.5 << u.arcsec,
+            traj_store=None,
+            sky_proj_engine='exact',
+            catalog_model_eval_method='render'):
+        """Return a function that can be used to evaluate the mapping
+        trajectory and the source surface brightness.
+
+        When `traj_store` is set, the boresight trajectory of each chunk is
+        saved to it as float64 arrays, which are read by the output writer.
+        The detector trajectories are only used in the evaluation and are
+        kept in the process memory.
+
+        The `sky_proj_engine` is passed to
+        :meth:`_get_detector_sky_traj`.
+
+        The `catalog_model_eval_method` is one of ``render`` and ``direct``.
+        The ``render`` method converts catalog source models to image source
+        models, and the ``direct`` method sums the beam response of the
+        catalog sources near each detector sample.
+        """
         if sources is None:
             sources = list()
         t0 = mapping.t0
         apt = self.array_prop_table
 
         hwp_cfg = self.hwp_config
+        # the subsample planner is anchored at t0 so that it picks
+        # consistent knots for all chunks.
+        if eval_interp_len is None:
+            subsample_planner = None
+        else:
+            subsample_planner = SubsamplePlanner(eval_interp_len, t_ref=t0)
 
         def get_hwp_pa_t(t):
             # return the hwp position angle at time t
@@ -575,18 +848,21 @@ class ToltecObsSimulator(object):
             # just a constant
             return Angle(np.full(t.shape, 0.) << u.rad)
 
-        # convert the catalog source model to image source model, if any
+        if catalog_model_eval_method not in ('render', 'direct'):
+            raise ValueError(
+                f"invalid catalog_model_eval_method "
+                f"{catalog_model_eval_method}")
+        # get fwhms from toltec_info
+        fwhms = dict()
+        for array_name in self.array_names:
+            fwhms[array_name] = toltec_info[
+                array_name]['a_fwhm']
+        # convert the catalog source model to image source model, if
+        # the render method is used.
         source_models_for_eval = list()
         for m_source in sources:
-            # TODO maybe there is a faster way of handling the
-            # catalog source model directly. For now
-            # we just convert it to image model
-            if isinstance(m_source, CatalogSourceModel):
-                # get fwhms from toltec_info
-                fwhms = dict()
-                for array_name in self.array_names:
-                    fwhms[array_name] = toltec_info[
-                        array_name]['a_fwhm']
+            if isinstance(m_source, CatalogSourceModel) and (
+                    catalog_model_eval_method == 'render'):
                 m_source = m_source.make_image_model(
                     fwhms=fwhms,
                     pixscale=catalog_model_render_pixel_size / u.pix
@@ -647,6 +923,21 @@ class ToltecObsSimulator(object):
                     self.logger.debug(
                         f"sky_bbox icrs={bs_sky_bbox_icrs} "
                         f"altaz={bs_sky_bbox_altaz}")
+                # save the boresight trajectory for the output writer
+                if traj_store is None:
+                    traj_key = None
+                else:
+                    traj_key = traj_store.make_key(mapping, t)
+                    bs_traj = traj_store.create(
+                        traj_key, self._bs_traj_names, shape=(n_times, ))
+                    bs_traj['bs_ra'][:] = bs_coords_icrs.ra.radian
+                    bs_traj['bs_dec'][:] = bs_coords_icrs.dec.radian
+                    bs_traj['bs_az'][:] = bs_coords_altaz.az.radian
+                    bs_traj['bs_alt'][:] = bs_coords_altaz.alt.radian
+                    bs_traj['bs_pa'][:] = bs_parallactic_angle.radian
+                    bs_traj['target_az'][:] = target_altaz.az.radian
+                    bs_traj['target_alt'][:] = target_altaz.alt.radian
+                    bs_traj['hwp_pa_t'][:] = hwp_pa_t.radian
                 # make the model to project detector positions
                 det_sky_traj = self._get_detector_sky_traj(
                     time_obs=time_obs,
@@ -655,6 +946,9 @@ class ToltecObsSimulator(object):
                     evaluate_interp_len=eval_interp_len,
                     lon_wrap_angle_altaz=lon_wrap_angle_altaz,
                     lon_wrap_angle_icrs=lon_wrap_angle_icrs,
+                    subsample_planner=subsample_planner,
+                    sky_proj_engine=sky_proj_engine,
+                    bs_parallactic_angle=bs_parallactic_angle,
                     )
                 det_ra = det_sky_traj['ra']
                 det_dec = det_sky_traj['dec']
@@ -689,22 +983,19 @@ class ToltecObsSimulator(object):
                     return locals()
                 # get source flux from models
                 s_additive = list()
+                # we only pass the pa and hwp when we want
+                # them to be eval for polarimetry
+                source_eval_kw = dict()
+                if self.polarized:
+                    source_eval_kw['det_pa_icrs'] = det_pa_icrs
+                    if hwp_cfg.installed:
+                        source_eval_kw['hwp_pa_icrs'] = hwp_pa_icrs
                 for m_source in source_models_for_eval:
-                    # TODO maybe there is a faster way of handling the
-                    # catalog source model directly. For now
-                    # we converted it to image model
                     if isinstance(m_source, ImageSourceModel):
                         # TODO support more types of wcs. For now
                         # only ICRS is supported
                         with timeit(
                                 "extract flux from source image model"):
-                            # we only pass the pa and hwp when we want
-                            # them to be eval for polarimetry
-                            source_eval_kw = dict()
-                            if self.polarized:
-                                source_eval_kw['det_pa_icrs'] = det_pa_icrs
-                                if hwp_cfg.installed:
-                                    source_eval_kw['hwp_pa_icrs'] = hwp_pa_icrs
                             s = m_source.evaluate_tod_icrs(
                                 apt['array_name'],
                                 det_ra,
@@ -712,6 +1003,17 @@ class ToltecObsSimulator(object):
                                 **source_eval_kw
                                 )
                         s_additive.append(s)
+                    elif isinstance(m_source, CatalogSourceModel):
+                        with timeit(
+                                "evaluate flux from source catalog model"):
+                            s = m_source.evaluate_tod_icrs(
+                                apt['array_name'],
+                                det_ra,
+                                det_dec,
+                                fwhms=fwhms,
+                                **source_eval_kw
+                                )
+                        s_additive.append(s)
                 if len(s_additive) <= 0:
                     self.logger.debug("no surface brightness model available")
                     s = np.zeros(det_ra.shape) << u.MJy / u.sr
@@ -770,20 +1072,47 @@ class ToltecObsSimulator(object):
         # create the mapping evaluator first so that we can get full
         # sky bbox for the observation
         # the altitude is needed to create the probing evaluator
+        # the trajectories of the chunks are kept in the traj store
+        # and are shared with the output context. The store only pays off
+        # when the chunks are evaluated in worker processes, or when asked
+        # for explicitly.
+        if perf_params.traj_store_dir is not None \
+                or perf_params.n_workers > 1:
+            traj_store = SkyTrajStore(rootpath=perf_params.traj_store_dir)
+        else:
+            traj_store = None
         mapping_evaluator, mapping_eval_ctx = self.mapping_evaluator(
             mapping=mapping_model, sources=sources_sb,
             erfa_interp_len=perf_params.mapping_erfa_interp_len,
             eval_interp_len=perf_params.mapping_eval_interp_len,
             catalog_model_render_pixel_size=(
                 perf_params.catalog_model_render_pixel_size),
+            traj_store=traj_store,
+            sky_proj_engine=perf_params.sky_proj_engine,
+            catalog_model_eval_method=(
+                perf_params.catalog_model_eval_method),
             )
         # this context es is to hold any contexts during the iterative
         # eval
         es = ExitStack()
+        if traj_store is not None:
+            es.enter_context(traj_store)
         # we run the mapping eval to get the det_sky_traj for the entire
         # simu
         mapping_info = mapping_evaluator(
             t_grid_pre_eval, mapping_only=True)
+        if perf_params.sky_proj_engine != 'exact':
+            sky_proj_accuracy_report = self.get_sky_proj_accuracy_report(
+                time_obs=mapping_info['time_obs'],
+                bs_coords_altaz=mapping_info['bs_coords_altaz'],
+                bs_coords_icrs=mapping_info['bs_coords_icrs'],
+                sky_proj_engine=perf_params.sky_proj_engine,
+                bs_parallactic_angle=mapping_info['bs_parallactic_angle'],
+                )
+            self.logger.info(
+                f"sky projection accuracy of "
+                f"sky_proj_engine={perf_params.sky_proj_engine}:\n"
+                f"{sky_proj_accuracy_report}")
         # compute the extent for detectors
         bbox_padding = (
                 perf_params.pre_eval_sky_bbox_padding_size,
@@ -1001,13 +1330,22 @@ class ToltecSimuOutputContext(ExitStack):
     _lockfile = 'simu.lock'
     _statefile = 'simustate.yaml'
 
-    def __init__(self, simulator, rootpath, state_init=None):
+    def __init__(self, simulator, rootpath, state_init=None, nc_layout=None):
         super().__init__()
         self._simulator = simulator
         self._rootpath = rootpath
         self._state = None
         self._nms = dict()
         self._state_init = state_init
+        if nc_layout is None:
+            nc_layout = ToltecNcLayoutConfig()
+        elif isinstance(nc_layout, str):
+            nc_layout = ToltecNcLayoutConfig.from_preset(nc_layout)
+        elif isinstance(nc_layout, dict):
+            nc_layout = ToltecNcLayoutConfig.from_dict(nc_layout)
+        self._nc_layout = nc_layout
+        # the next time index to write for each interface
+        self._write_idx = dict()
 
     @property
     def simulator(self):
@@ -1026,6 +1364,36 @@ class ToltecSimuOutputContext(ExitStack):
         """The dict of nc file mappers."""
         return self._nms
 
+    @property
+    def nc_layout(self):
+        return self._nc_layout
+
+    def _get_n_times(self):
+        """Return the total number of samples and the number of samples per
+        chunk to be written."""
+        eval_ctx = self._ensure_sim_eval_context()
+        t_chunks = eval_ctx['t_chunks']
+        if isinstance(t_chunks, list):
+            return sum(len(t) for t in t_chunks), len(t_chunks[0])
+        return len(t_chunks), len(t_chunks)
+
+    def _create_time_dim(self, nc_node):
+        """Create the time dimension according to the layout."""
+        n_times, _ = self._get_n_times()
+        nc_node.createDimension(
+            'time', self.nc_layout.get_time_dim_size(n_times))
+
+    def _get_time_var_kwargs(self, *chunk_sizes):
+        _, n_times_per_chunk = self._get_n_times()
+        return self.nc_layout.get_var_kwargs(
+            n_times_per_chunk, chunk_sizes=chunk_sizes)
+
+    def _next_write_slice(self, interface, n_times):
+        """Return the slice to write `n_times` samples for `interface`."""
+        idx = self._write_idx.get(interface, 0)
+        self._write_idx[interface] = idx + n_times
+        return slice(idx, idx + n_times)
+
     def _create_nm(self, interface, suffix):
         if interface in self.nms:
             raise ValueError(f"NcNodeMapper already exists for {interface}")
@@ -1111,78 +1479,78 @@ class ToltecSimuOutputContext(ExitStack):
 
         # setup data variables for write_data
         d_time = 'time'
-        nc_tel.createDimension(d_time, None)
+        self._create_time_dim(nc_tel)
+        var_kw = self._get_time_var_kwargs()
         m = dict()  # this get added to the node mapper
         m['time'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.TelTime', 'f8', (d_time, ))
+                'Data.TelescopeBackend.TelTime', 'f8', (d_time, ), **var_kw)
         m['pps_time'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.PpsTime', 'f8', (d_time, ))
+                'Data.TelescopeBackend.PpsTime', 'f8', (d_time, ), **var_kw)
 
         v_ra = m['ra'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.TelRaAct', 'f8', (d_time, ))
+                'Data.TelescopeBackend.TelRaAct', 'f8', (d_time, ), **var_kw)
         v_ra.unit = 'rad'
         v_dec = m['dec'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.TelDecAct', 'f8', (d_time, ))
+                'Data.TelescopeBackend.TelDecAct', 'f8', (d_time, ), **var_kw)
         v_dec.unit = 'rad'
 
         v_ra_src = m['ra_src'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.SourceRaAct', 'f8', (d_time, ))
+                'Data.TelescopeBackend.SourceRaAct', 'f8', (d_time, ), **var_kw)
         v_ra_src.unit = 'rad'
         v_dec_src = m['dec_src'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.SourceDecAct', 'f8', (d_time, ))
+                'Data.TelescopeBackend.SourceDecAct', 'f8', (d_time, ), **var_kw)
         v_dec_src.unit = 'rad'
 
         v_alt = m['alt'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.TelElAct', 'f8', (d_time, ))
+                'Data.TelescopeBackend.TelElAct', 'f8', (d_time, ), **var_kw)
         v_alt.unit = 'rad'
         v_az = m['az'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.TelAzAct', 'f8', (d_time, ))
+                'Data.TelescopeBackend.TelAzAct', 'f8', (d_time, ), **var_kw)
         v_az.unit = 'rad'
 
         v_alt_cor = m['alt_cor'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.TelElCor', 'f8', (d_time, ))
+                'Data.TelescopeBackend.TelElCor', 'f8', (d_time, ), **var_kw)
         v_alt_cor.unit = 'rad'
         v_az_cor = m['az_cor'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.TelAzCor', 'f8', (d_time, ))
+                'Data.TelescopeBackend.TelAzCor', 'f8', (d_time, ), **var_kw)
         v_az_cor.unit = 'rad'
 
         v_alt_des = m['alt_des'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.TelElDes', 'f8', (d_time, ))
+                'Data.TelescopeBackend.TelElDes', 'f8', (d_time, ), **var_kw)
         v_alt_des.unit = 'rad'
         v_az_des = m['az_des'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.TelAzDes', 'f8', (d_time, ))
+                'Data.TelescopeBackend.TelAzDes', 'f8', (d_time, ), **var_kw)
         v_az_des.unit = 'rad'
 
         v_alt_map = m['alt_map'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.TelElMap', 'f8', (d_time, ))
+                'Data.TelescopeBackend.TelElMap', 'f8', (d_time, ), **var_kw)
         v_alt_map.unit = 'rad'
         v_az_map = m['az_map'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.TelAzMap', 'f8', (d_time, ))
+                'Data.TelescopeBackend.TelAzMap', 'f8', (d_time, ), **var_kw)
         v_az_map.unit = 'rad'
 
         v_pa = m['pa'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.ActParAng', 'f8', (d_time, ))
+                'Data.TelescopeBackend.ActParAng', 'f8', (d_time, ), **var_kw)
         v_pa.unit = 'rad'
         # the _sky az alt and pa are the corrected positions of telescope
         # they are the same as the above when no pointing correction
         # is applied.
         v_alt_sky = m['alt_sky'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.TelElSky', 'f8', (d_time, ))
+                'Data.TelescopeBackend.TelElSky', 'f8', (d_time, ), **var_kw)
         v_alt_sky.unit = 'rad'
         v_az_sky = m['az_sky'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.TelAzSky', 'f8', (d_time, ))
+                'Data.TelescopeBackend.TelAzSky', 'f8', (d_time, ), **var_kw)
         v_az_sky.unit = 'rad'
         v_pa_sky = m['pa_sky'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.ParAng', 'f8', (d_time, ))
+                'Data.TelescopeBackend.ParAng', 'f8', (d_time, ), **var_kw)
         v_pa_sky.unit = 'rad'
         m['hold'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.Hold', 'f8', (d_time, )
-                )
+                'Data.TelescopeBackend.Hold', 'f8', (d_time, ), **var_kw)
         v_source_alt = m['source_alt'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.SourceEl', 'f8', (d_time, ))
+                'Data.TelescopeBackend.SourceEl', 'f8', (d_time, ), **var_kw)
         v_source_alt.unit = 'rad'
         v_source_az = m['source_az'] = nc_tel.createVariable(
-                'Data.TelescopeBackend.SourceAz', 'f8', (d_time, ))
+                'Data.TelescopeBackend.SourceAz', 'f8', (d_time, ), **var_kw)
         v_source_az.unit = 'rad'
         nm_tel.update(m)
         return nm_tel
@@ -1292,15 +1660,23 @@ class ToltecSimuOutputContext(ExitStack):
         nc_toltec.createDimension('loclen', len(mapt))
         nc_toltec.createDimension('iqlen', len(mapt))
         nc_toltec.createDimension('tlen', 6)
-        nc_toltec.createDimension('time', None)
+        self._create_time_dim(nc_toltec)
+        chunk_tones = self.nc_layout.chunk_tones
+        if chunk_tones is None:
+            chunk_tones = len(mapt)
+        chunk_tones = min(chunk_tones, len(mapt))
         m['flo'] = nc_toltec.createVariable(
-                'Data.Toltec.LoFreq', 'i4', ('time', ))
+                'Data.Toltec.LoFreq', 'i4', ('time', ),
+                **self._get_time_var_kwargs())
         m['time'] = nc_toltec.createVariable(
-                'Data.Toltec.Ts', 'i4', ('time', 'tlen'))
+                'Data.Toltec.Ts', 'i4', ('time', 'tlen'),
+                **self._get_time_var_kwargs(6))
         m['I'] = nc_toltec.createVariable(
-                'Data.Toltec.Is', 'i4', ('time', 'iqlen'))
+                'Data.Toltec.Is', 'i4', ('time', 'iqlen'),
+                **self._get_time_var_kwargs(chunk_tones))
         m['Q'] = nc_toltec.createVariable(
-                'Data.Toltec.Qs', 'i4', ('time', 'iqlen'))
+                'Data.Toltec.Qs', 'i4', ('time', 'iqlen'),
+                **self._get_time_var_kwargs(chunk_tones))
         nm_toltec.update(m)
         return nm_toltec
 
@@ -1356,11 +1732,13 @@ class ToltecSimuOutputContext(ExitStack):
         # data variables
         m = dict()
         nc_hwp.createDimension('tlen', 6)
-        nc_hwp.createDimension('time', None)
+        self._create_time_dim(nc_hwp)
         m['pa'] = nc_hwp.createVariable(
-                'Data.Hwp.', 'f8', ('time', ))
+                'Data.Hwp.', 'f8', ('time', ),
+                **self._get_time_var_kwargs())
         m['time'] = nc_hwp.createVariable(
-                'Data.Toltec.Ts', 'i4', ('time', 'tlen'))
+                'Data.Toltec.Ts', 'i4', ('time', 'tlen'),
+                **self._get_time_var_kwargs(6))
         nm_hwp.update(m)
         return nm_hwp
 
@@ -1399,6 +1777,60 @@ class ToltecSimuOutputContext(ExitStack):
         nm_tel.setscalar(
                 'Header.Sim.Tau_a2000', tau_values['tau_a2000'], dtype='f8', exist_ok=True)
 
+    @staticmethod
+    def make_sim_data_payload(data):
+        """Return the subset of the chunk eval `data` used by
+        :meth:`write_sim_data`.
+
+        Unlike `data` which holds the full eval context, the returned dict
+        is picklable, and is what get sent back from the worker processes
+        when the chunks are evaluated in parallel.
+        """
+        mapping_info = data['mapping_info']
+        if mapping_info.get('traj_key', None) is not None:
+            # the trajectories are read from the traj store
+            mapping_info_keys = [
+                'traj_key', 'time_obs', 'holdflag',
+                ]
+        else:
+            mapping_info_keys = [
+                'bs_coords_icrs', 'bs_coords_altaz',
+                'bs_parallactic_angle', 'target_altaz',
+                'hwp_pa_t', 'time_obs', 'holdflag',
+                ]
+        return {
+            't': data['t'],
+            'mapping_info': {k: mapping_info[k] for k in mapping_info_keys},
+            'probing_info': {
+                'iqs': data['probing_info']['iqs'],
+                },
+            }
+
+    def _get_bs_traj(self, eval_ctx, mapping_info):
+        """Return the boresight trajectory as radian arrays."""
+        traj_key = mapping_info.get('traj_key', None)
+        if traj_key is not None:
+            traj_store = eval_ctx['traj_store']
+            bs_traj = traj_store.get(
+                traj_key, self._simulator._bs_traj_names)
+            if bs_traj is None:
+                raise ValueError(
+                    f"unable to get trajectory {traj_key} from traj store.")
+            return bs_traj
+        bs_coords_icrs = mapping_info['bs_coords_icrs']
+        bs_coords_altaz = mapping_info['bs_coords_altaz']
+        target_altaz = mapping_info['target_altaz']
+        return {
+            'bs_ra': bs_coords_icrs.ra.radian,
+            'bs_dec': bs_coords_icrs.dec.radian,
+            'bs_az': bs_coords_altaz.az.radian,
+            'bs_alt': bs_coords_altaz.alt.radian,
+            'bs_pa': mapping_info['bs_parallactic_angle'].radian,
+            'target_az': target_altaz.az.radian,
+            'target_alt': target_altaz.alt.radian,
+            'hwp_pa_t': mapping_info['hwp_pa_t'].radian,
+            }
+
     def write_sim_data(self, data):
         eval_ctx = self._ensure_sim_eval_context()
         # apt.ecsv
@@ -1406,64 +1838,64 @@ class ToltecSimuOutputContext(ExitStack):
 
         nm_tel = self.nms[self._get_tel_interface()]
         nc_tel = nm_tel.nc_node
-        d_time = 'time'
 
-        bs_coords_icrs = data['mapping_info']['bs_coords_icrs']
-        bs_coords_altaz = data['mapping_info']['bs_coords_altaz']
-        bs_parallactic_angle = data['mapping_info']['bs_parallactic_angle']
-        target_altaz = data['mapping_info']['target_altaz']
-        # hwp_pa_altaz = data['mapping_info']['hwp_pa_altaz']
-        hwp_pa_t = data['mapping_info']['hwp_pa_t']
-        # hwp_pa_icrs = data['mapping_info']['hwp_pa_icrs']
-        time_obs = data['mapping_info']['time_obs']
-        holdflag = data['mapping_info']['holdflag']
+        mapping_info = data['mapping_info']
+        bs_traj = self._get_bs_traj(eval_ctx, mapping_info)
+        time_obs = mapping_info['time_obs']
+        holdflag = mapping_info['holdflag']
         t_grid = data['t']
         iqs = data['probing_info']['iqs']
 
-        idx = nc_tel.dimensions[d_time].size
-        nm_tel.getvar('time')[idx:] = time_obs.unix
+        # the time dimension may be preallocated so the write positions
+        # are tracked per interface.
+        n_times = len(time_obs)
+        sl = self._next_write_slice(self._get_tel_interface(), n_times)
+        idx = sl.start
+        nm_tel.getvar('time')[sl] = time_obs.unix
 
         t_grid_sec = t_grid.to_value(u.s)
         t_grid_sec_int = t_grid_sec.astype(int)
-        nm_tel.getvar('pps_time')[idx:] = t_grid_sec_int + time_obs.unix[0]
+        nm_tel.getvar('pps_time')[sl] = t_grid_sec_int + time_obs.unix[0]
 
-        nm_tel.getvar('ra')[idx:] = bs_coords_icrs.ra.radian
-        nm_tel.getvar('dec')[idx:] = bs_coords_icrs.dec.radian
+        nm_tel.getvar('ra')[sl] = bs_traj['bs_ra']
+        nm_tel.getvar('dec')[sl] = bs_traj['bs_dec']
 
-        nm_tel.getvar('ra_src')[idx:] = bs_coords_icrs.ra.radian
-        nm_tel.getvar('dec_src')[idx:] = bs_coords_icrs.dec.radian
+        nm_tel.getvar('ra_src')[sl] = bs_traj['bs_ra']
+        nm_tel.getvar('dec_src')[sl] = bs_traj['bs_dec']
 
-        nm_tel.getvar('az')[idx:] = bs_coords_altaz.az.radian
-        nm_tel.getvar('alt')[idx:] = bs_coords_altaz.alt.radian
-        nm_tel.getvar('pa')[idx:] = bs_parallactic_angle.radian
+        nm_tel.getvar('az')[sl] = bs_traj['bs_az']
+        nm_tel.getvar('alt')[sl] = bs_traj['bs_alt']
+        nm_tel.getvar('pa')[sl] = bs_traj['bs_pa']
         # no pointing model
-        nm_tel.getvar('az_cor')[idx:] = 0.
-        nm_tel.getvar('alt_cor')[idx:] = 0.
-        nm_tel.getvar('az_des')[idx:] = bs_coords_altaz.az.radian
-        nm_tel.getvar('alt_des')[idx:] = bs_coords_altaz.alt.radian
-        nm_tel.getvar('az_map')[idx:] = 0.
-        nm_tel.getvar('alt_map')[idx:] = 0.
-
-        nm_tel.getvar('az_sky')[idx:] = bs_coords_altaz.az.radian
-        nm_tel.getvar('alt_sky')[idx:] = bs_coords_altaz.alt.radian
-        nm_tel.getvar('pa_sky')[idx:] = bs_parallactic_angle.radian
-
-        nm_tel.getvar('source_az')[idx:] = target_altaz.az.radian
-        nm_tel.getvar('source_alt')[idx:] = target_altaz.alt.radian
-        nm_tel.getvar('hold')[idx:] = holdflag
+        nm_tel.getvar('az_cor')[sl] = 0.
+        nm_tel.getvar('alt_cor')[sl] = 0.
+        nm_tel.getvar('az_des')[sl] = bs_traj['bs_az']
+        nm_tel.getvar('alt_des')[sl] = bs_traj['bs_alt']
+        nm_tel.getvar('az_map')[sl] = 0.
+        nm_tel.getvar('alt_map')[sl] = 0.
+
+        nm_tel.getvar('az_sky')[sl] = bs_traj['bs_az']
+        nm_tel.getvar('alt_sky')[sl] = bs_traj['bs_alt']
+        nm_tel.getvar('pa_sky')[sl] = bs_traj['bs_pa']
+
+        nm_tel.getvar('source_az')[sl] = bs_traj['target_az']
+        nm_tel.getvar('source_alt')[sl] = bs_traj['target_alt']
+        nm_tel.getvar('hold')[sl] = holdflag
         self.logger.info(
                 f'write [{idx}:{idx + len(time_obs)}] to'
                 f' {nc_tel.filepath()}')
         for nw in np.unique(apt['nw']):
             nm_toltec = self.nms[self._get_kidsdata_interface(nw)]
             nc_toltec = nm_toltec.nc_node
-            idx = nc_toltec.dimensions[d_time].size
+            sl = self._next_write_slice(
+                self._get_kidsdata_interface(nw), n_times)
+            idx = sl.start
             self.logger.info(
                 f'write [{nc_toltec.dimensions["iqlen"].size}]'
                 f'[{idx}:{idx + len(time_obs)}] to'
                 f' {nc_toltec.filepath()}')
             m = (apt['nw'] == nw)
-            nm_toltec.getvar('flo')[idx:] = 0
+            nm_toltec.getvar('flo')[sl] = 0
             # 0  ClockTime (sec)
             # 1  PpsCount (pps ticks)
             # 2  ClockCount (clock ticks)
@@ -1475,39 +1907,46 @@ class ToltecSimuOutputContext(ExitStack):
             # The actual time stamp of each sample is to be computed
             # with clock count and clock frequency.
             t00 = time_obs[0].unix
-            nm_toltec.getvar('time')[idx:, 0] = np.full(
+            nm_toltec.getvar('time')[sl, 0] = np.full(
                 t_grid.shape, int(t00))
-            nm_toltec.getvar('time')[idx:, 5] = np.full(
+            nm_toltec.getvar('time')[sl, 5] = np.full(
                 t_grid.shape, int((t00 - int(t00)) * 1e9))
             # package count, increment for each sample
-            nm_toltec.getvar('time')[idx:, 3] = range(len(t_grid))
+            nm_toltec.getvar('time')[sl, 3] = range(len(t_grid))
             # pps count and pps time
             # since we set t00 to be the t0, this is just simple
             # int sequence of t_grid
             t_grid_sec = t_grid.to_value(u.s)
             t_grid_sec_int = t_grid_sec.astype(int)
-            nm_toltec.getvar('time')[idx:, 1] = t_grid_sec_int
+            nm_toltec.getvar('time')[sl, 1] = t_grid_sec_int
             f_fpga_Hz = nm_toltec.getany('Header.Toltec.FpgaFreq')
             # pps time is the clock count of the pps tick
-            nm_toltec.getvar('time')[idx:, 4] = (t_grid_sec_int * f_fpga_Hz)
+            nm_toltec.getvar('time')[sl, 4] = (t_grid_sec_int * f_fpga_Hz)
             # clock count
-            nm_toltec.getvar('time')[idx:, 2] = t_grid_sec * f_fpga_Hz
+            nm_toltec.getvar('time')[sl, 2] = t_grid_sec * f_fpga_Hz
 
-            nm_toltec.getvar('I')[idx:, :] = iqs.real[m, :].T
-            nm_toltec.getvar('Q')[idx:, :] = iqs.imag[m, :].T
+            # select the network once and write I and Q as views
+            iqs_nw = iqs[m]
+            nm_toltec.getvar('I')[sl, :] = iqs_nw.real.T
+            nm_toltec.getvar('Q')[sl, :] = iqs_nw.imag.T
 
         # hwp
         nm_hwp = self.nms[self._get_hwp_interface()]
         nc_hwp = nm_hwp.nc_node
-        idx = nc_hwp.dimensions[d_time].size
+        sl = self._next_write_slice(self._get_hwp_interface(), n_times)
+        idx = sl.start
         self.logger.info(
             f'write '
             f'[{idx}:{idx + len(time_obs)}] to'
             f' {nc_hwp.filepath()}')
-        nm_hwp.getvar('time')[idx:, 0] = time_obs.unix
-        # nm_hwp.getvar('pa')[idx:] = hwp_pa_altaz.radian
-        nm_hwp.getvar('pa')[idx:] = hwp_pa_t.radian
-        # nm_hwp.getvar('pa')[idx:] = hwp_pa_icrs.radian
+        nm_hwp.getvar('time')[sl, 0] = time_obs.unix
+        # nm_hwp.getvar('pa')[sl] = hwp_pa_altaz.radian
+        nm_hwp.getvar('pa')[sl] = bs_traj['hwp_pa_t']
+        # nm_hwp.getvar('pa')[sl] = hwp_pa_icrs.radian
+        # the chunk trajectories are no longer needed
+        traj_key = mapping_info.get('traj_key', None)
+        if traj_key is not None:
+            eval_ctx['traj_store'].discard(traj_key)
 
     def open(self, overwrite=False):
         """Open files to save data.
@@ -1548,6 +1987,7 @@ class ToltecSimuOutputContext(ExitStack):
         for nm in self.nms.values():
             nm.close()
         self.nms.clear()
+        self._write_idx.clear()
 
     @contextmanager
     def writelock(self):
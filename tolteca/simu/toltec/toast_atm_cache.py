@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import astropy.units as u
+
+from tollan.utils.log import get_logger
+
+
+__all__ = ['ToastAtmSlabCache']
+
+
+class ToastAtmSlabCache(object):
+    """A content-addressed on-disk cache of the TOAST atmosphere slabs.
+
+    Each cache entry is a directory that is used as the TOAST cache dir
+    for one set of slabs. The entries are keyed by the hash of the atm
+    model params, the start time, the time range and the az/el bbox,
+    and are recorded in an index file in `rootpath`.
+
+    An entry can be reused for a request with the same params and start
+    time, if its time range and bbox contain the requested ones.
+    When `max_size` is set, the least recently used entries are removed
+    to keep the total size of the cache below it.
+
+    The updates of the index are done with an exclusive lock on the lock
+    file in `rootpath`, so that the cache can be shared by multiple
+    processes. A new entry is built in a per-process directory, which is
+    renamed to the entry directory on :meth:`commit`. The entries
+    returned by :meth:`lookup` are pinned by the process until
+    :meth:`release`, and are not evicted while pinned.
+
+    Parameters
+    ----------
+    rootpath : str, `pathlib.Path`
+        The root directory of the cache.
+    max_size : `astropy.units.Quantity`, optional
+        The max total size of the cache.
+    """
+
+    logger = get_logger()
+
+    _index_filename = 'index.json'
+    _lock_filename = 'index.lock'
+
+    def __init__(self, rootpath, max_size=None):
+        self._rootpath = Path(rootpath)
+        self._rootpath.mkdir(parents=True, exist_ok=True)
+        self._max_size = max_size
+
+    @property
+    def rootpath(self):
+        return self._rootpath
+
+    @property
+    def index_filepath(self):
+        return self._rootpath.joinpath(self._index_filename)
+
+    @contextmanager
+    def _lock(self):
+        # hold the lock for the read-modify-write of the index.
+        with open(self._rootpath.joinpath(self._lock_filename), 'a') as fo:
+            fcntl.flock(fo, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fo, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        if not self.index_filepath.exists():
+            return dict()
+        with open(self.index_filepath, 'r') as fo:
+            return json.load(fo)
+
+    def _save_index(self, index):
+        # write to a temporary file first to keep the index consistent
+        tmp_filepath = self.index_filepath.with_suffix(
+            f'.json.{os.getpid()}')
+        with open(tmp_filepath, 'w') as fo:
+            json.dump(index, fo, indent=2, sort_keys=True)
+        os.replace(tmp_filepath, self.index_filepath)
+
+    @staticmethod
+    def make_params_hash(params, t0):
+        """Return the hash of the atm model `params` and start time `t0`."""
+        # quantities are hashed by their string representations.
+        content = json.dumps(
+            {'params': params, 't0': t0.isot},
+            sort_keys=True, default=str)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    @staticmethod
+    def _make_range_info(tmin, tmax, sky_bbox_altaz):
+        return {
+            'tmin': float(tmin),
+            'tmax': float(tmax),
+            'azmin': sky_bbox_altaz.w.to_value(u.deg),
+            'azmax': sky_bbox_altaz.e.to_value(u.deg),
+            'elmin': sky_bbox_altaz.s.to_value(u.deg),
+            'elmax': sky_bbox_altaz.n.to_value(u.deg),
+            }
+
+    @staticmethod
+    def _contains(entry, range_info):
+        """Return True if the ranges of `entry` contain `range_info`."""
+        if not (
+                entry['tmin'] <= range_info['tmin']
+                and entry['tmax'] >= range_info['tmax']
+                and entry['elmin'] <= range_info['elmin']
+                and entry['elmax'] >= range_info['elmax']):
+            return False
+        # check az ranges with wrapping taken into account
+        az_width = (entry['azmax'] - entry['azmin']) % 360.
+        req_az_width = (range_info['azmax'] - range_info['azmin']) % 360.
+        d_az = (range_info['azmin'] - entry['azmin']) % 360.
+        return d_az + req_az_width <= az_width
+
+    def get_entry_dir(self, key):
+        """Return the directory of the cache entry `key`."""
+        return self._rootpath.joinpath(key)
+
+    def get_build_dir(self, key):
+        """Return the directory to build the new cache entry `key` in."""
+        return self._rootpath.joinpath(f'{key}.{os.getpid()}.tmp')
+
+    @staticmethod
+    def _is_pid_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _get_pins(self, entry):
+        # the pins of the processes that no longer exist are ignored.
+        return [
+            pid for pid in entry.get('pins', list())
+            if self._is_pid_alive(pid)]
+
+    def _remove_stale_build_dirs(self):
+        for path in self._rootpath.glob('*.*.tmp'):
+            pid = path.name.split('.')[1]
+            if pid.isdigit() and not self._is_pid_alive(int(pid)):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def lookup(self, params_hash, tmin, tmax, sky_bbox_altaz):
+        """Return the key and info of the cache entry that can be reused.
+
+        The smallest entry is returned if multiple are found. None is
+        returned if no entry is found. The returned entry is pinned so it
+        is not evicted, and has to be released with :meth:`release`.
+        """
+        range_info = self._make_range_info(tmin, tmax, sky_bbox_altaz)
+        with self._lock():
+            index = self._load_index()
+            candidates = [
+                (key, entry) for key, entry in index.items()
+                if entry['params_hash'] == params_hash
+                and self._contains(entry, range_info)
+                and self.get_entry_dir(key).exists()
+                ]
+            if not candidates:
+                return None
+            key, entry = min(candidates, key=lambda c: c[1]['size'])
+            entry['atime'] = time.time()
+            entry['pins'] = self._get_pins(entry) + [os.getpid()]
+            self._save_index(index)
+        return key, entry
+
+    def release(self, key):
+        """Release the pin of the cache entry `key` by this process."""
+        with self._lock():
+            index = self._load_index()
+            entry = index.get(key, None)
+            if entry is None:
+                return
+            pins = self._get_pins(entry)
+            if os.getpid() in pins:
+                pins.remove(os.getpid())
+            entry['pins'] = pins
+            self._save_index(index)
+
+    def create(self, params_hash, tmin, tmax, sky_bbox_altaz):
+        """Return the key and info of a new cache entry.
+
+        The entry shall be built in :meth:`get_build_dir`, and is added to
+        the index by :meth:`commit`.
+        """
+        range_info = self._make_range_info(tmin, tmax, sky_bbox_altaz)
+        key = hashlib.sha1(json.dumps(
+            {'params_hash': params_hash, **range_info},
+            sort_keys=True).encode()).hexdigest()
+        build_dir = self.get_build_dir(key)
+        with self._lock():
+            self._remove_stale_build_dirs()
+            if build_dir.exists():
+                # an incomplete entry from a previous attempt
+                shutil.rmtree(build_dir)
+            build_dir.mkdir(parents=True)
+        entry = dict(
+            params_hash=params_hash, size=0, atime=time.time(),
+            **range_info)
+        return key, entry
+
+    def commit(self, key, entry):
+        """Add the entry to the index and evict old entries if needed.
+
+        The build directory is moved to the entry directory. If the same
+        entry has been committed by another process, the build directory
+        is removed instead.
+        """
+        build_dir = self.get_build_dir(key)
+        entry['size'] = sum(
+            p.stat().st_size
+            for p in build_dir.rglob('*') if p.is_file())
+        entry['atime'] = time.time()
+        with self._lock():
+            index = self._load_index()
+            entry_dir = self.get_entry_dir(key)
+            if key in index and entry_dir.exists():
+                self.logger.debug(
+                    f"atm slab cache entry {key} exists, discard the new one")
+                shutil.rmtree(build_dir, ignore_errors=True)
+                index[key]['atime'] = entry['atime']
+            else:
+                if entry_dir.exists():
+                    # not in the index, so it is not in use
+                    shutil.rmtree(entry_dir)
+                os.replace(build_dir, entry_dir)
+                index[key] = entry
+                self.logger.debug(
+                    f"add atm slab cache entry {key} of size "
+                    f"{entry['size']}B")
+            self._evict(index, keep=key)
+            self._save_index(index)
+
+    def _evict(self, index, keep=None):
+        if self._max_size is None:
+            return
+        max_size = self._max_size.to_value(u.byte)
+        total_size = sum(entry['size'] for entry in index.values())
+        for key, entry in sorted(
+                index.items(), key=lambda item: item[1]['atime']):
+            if total_size <= max_size:
+                break
+            if key == keep or self._get_pins(entry):
+                continue
+            self.logger.debug(
+                f"evict atm slab cache entry {key} of size "
+                f"{entry['size']}B")
+            shutil.rmtree(self.get_entry_dir(key), ignore_errors=True)
+            total_size -= entry['size']
+            del index[key]
@@ -1,8 +1,18 @@
 #!/usr/bin/env python
 
 import yaml
+import collections
+import hashlib
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
 from collections import UserDict
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from pathlib import Path
 from typing import ClassVar
 
 import astropy.units as u
@@ -16,7 +26,9 @@ from tollan.utils.log import get_logger
 
 
 __all__ = [
-    'PersistentState', 'SkyBoundingBox', 'get_lon_extent', 'make_time_grid']
+    'PersistentState', 'SkyBoundingBox', 'get_lon_extent', 'make_time_grid',
+    'iter_eval_chunks', 'SubsamplePlanner', 'interp_linear_into',
+    'SkyTrajStore', 'WriteBehindWriter']
 
 
 class PersistentState(UserDict):
@@ -191,6 +203,187 @@ def make_time_grid(t, f_smp, chunk_len=None):
     return t_chunks
 
 
+class SubsamplePlanner(object):
+    """A helper class to select subsample indices for interpolation.
+
+    The subsample (knots) are the first samples at or after the nodes of a
+    regular time grid of step `interp_len`. The grid is anchored at
+    `t_ref`, so that the same instance can be reused for consecutive time
+    chunks and the knots are placed consistently across the chunk
+    boundaries.
+
+    Parameters
+    ----------
+    interp_len : `astropy.units.Quantity`
+        The step of the time grid.
+    t_ref : `astropy.time.Time`, optional
+        The anchor of the time grid. When not set, the first sample of
+        each input is used.
+    """
+
+    def __init__(self, interp_len, t_ref=None):
+        self._interp_len = interp_len
+        self._interp_len_day = interp_len.to_value(u.day)
+        if self._interp_len_day <= 0:
+            raise ValueError("interp_len has to be positive.")
+        self._mjd_ref = None if t_ref is None else t_ref.mjd
+
+    @property
+    def interp_len(self):
+        return self._interp_len
+
+    def get_subsample_index(self, mjd):
+        """Return the subsample indices for sorted `mjd`.
+
+        Parameters
+        ----------
+        mjd : `numpy.ndarray`
+            The MJD in days, unit stripped and sorted ascending.
+
+        Returns
+        -------
+        `numpy.ndarray`
+            The sorted indices, which always includes the first and
+            last samples.
+        """
+        mjd = np.asarray(mjd, dtype='d')
+        n = len(mjd)
+        if n == 0:
+            return np.array([], dtype=int)
+        mjd_ref = mjd[0] if self._mjd_ref is None else self._mjd_ref
+        dt = self._interp_len_day
+        k0 = np.floor((mjd[0] - mjd_ref) / dt)
+        k1 = np.ceil((mjd[-1] - mjd_ref) / dt)
+        mjd_grid = mjd_ref + np.arange(k0, k1 + 1) * dt
+        s = np.searchsorted(mjd, mjd_grid, side='left')
+        # unique also removes duplicated knots of grid nodes that
+        # fall in the same sample interval.
+        return np.unique(np.concatenate([[0], s[s < n], [n - 1]]))
+
+    def __call__(self, time_obs):
+        """Return the subsample indices for `time_obs`."""
+        return self.get_subsample_index(time_obs.mjd)
+
+
+def interp_linear_into(x, xp, fp, out, block_size=1024):
+    """Linearly interpolate `fp` along the last axis into `out`.
+
+    This is equivalent to ``interp1d(xp, fp, axis=1)(x)`` but fills the
+    preallocated `out` block-by-block, so that no full size temporary
+    array is created.
+
+    Parameters
+    ----------
+    x : `numpy.ndarray`
+        The 1-d coordinates to evaluate at.
+    xp : `numpy.ndarray`
+        The 1-d sorted coordinates of the data points.
+    fp : `numpy.ndarray`
+        The data of shape ``(n, len(xp))``.
+    out : `numpy.ndarray`
+        The output array of shape ``(n, len(x))``.
+    block_size : int
+        The number of rows to process at a time.
+    """
+    if len(xp) < 2:
+        raise ValueError("at least two data points are required for interp.")
+    i = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, len(xp) - 2)
+    w = (x - xp[i]) / (xp[i + 1] - xp[i])
+    for j0 in range(0, fp.shape[0], block_size):
+        j1 = min(j0 + block_size, fp.shape[0])
+        f0 = fp[j0:j1, i]
+        f1 = fp[j0:j1, i + 1]
+        np.subtract(f1, f0, out=f1)
+        f1 *= w
+        np.add(f0, f1, out=out[j0:j1])
+    return out
+
+
+class SkyTrajStore(object):
+    """A store of sky trajectory arrays backed by memory-mapped files.
+
+    The arrays are saved as float64 ``.npy`` files under a per-key
+    sub-directory of `rootpath`, so that they can be created by one
+    process and read zero-copy by others.
+
+    Parameters
+    ----------
+    rootpath : str or `pathlib.Path`, optional
+        The directory to hold the files. Default is ``/dev/shm`` if it
+        exists, so that the store is in shared memory, and the system
+        temporary directory otherwise. A temporary sub-directory is
+        created in it and is removed on :meth:`close`.
+    """
+
+    logger = get_logger()
+
+    _shm_rootpath = Path('/dev/shm')
+
+    def __init__(self, rootpath=None):
+        if rootpath is None and self._shm_rootpath.is_dir():
+            rootpath = self._shm_rootpath
+        if rootpath is not None:
+            Path(rootpath).mkdir(parents=True, exist_ok=True)
+        self._rootpath = Path(tempfile.mkdtemp(
+            prefix='tolteca_traj_store_', dir=rootpath))
+        # only the creator process cleans up the files, this allows
+        # the store to be shared with forked worker processes.
+        self._owner_pid = os.getpid()
+        self.logger.debug(f"create sky traj store in {self._rootpath}")
+
+    @property
+    def rootpath(self):
+        return self._rootpath
+
+    @staticmethod
+    def make_key(model, t):
+        """Return the key for time chunk `t` evaluated with `model`."""
+        t_s = t.to_value(u.s)
+        h = hashlib.sha1(repr(model).encode())
+        h.update(np.array([t_s[0], t_s[-1], len(t_s)], dtype='d').tobytes())
+        return h.hexdigest()
+
+    def _get_path(self, key, name):
+        return self._rootpath.joinpath(key, f'{name}.npy')
+
+    def create(self, key, names, shape):
+        """Return a dict of writable arrays for `key`."""
+        self._rootpath.joinpath(key).mkdir(exist_ok=True)
+        return {
+            name: np.lib.format.open_memmap(
+                self._get_path(key, name), mode='w+',
+                dtype='d', shape=shape)
+            for name in names
+            }
+
+    def get(self, key, names):
+        """Return a dict of read-only arrays for `key`.
+
+        None is returned if any of `names` is not found.
+        """
+        paths = {name: self._get_path(key, name) for name in names}
+        if not all(p.exists() for p in paths.values()):
+            return None
+        return {
+            name: np.load(p, mmap_mode='r')
+            for name, p in paths.items()
+            }
+
+    def discard(self, key):
+        """Remove the arrays for `key`."""
+        shutil.rmtree(self._rootpath.joinpath(key), ignore_errors=True)
+
+    def close(self):
+        if os.getpid() == self._owner_pid:
+            shutil.rmtree(self._rootpath, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 def make_wcs(
         sky_bbox, pixscale,
         crval=None,
@@ -237,4 +430,200 @@ def make_wcs(
     else:
         crval = [v.degree for v in sky_bbox.center]
     wcsobj.wcs.crval = crval 
-    return wcsobj
\ No newline at end of file
+    return wcsobj
+
+
+# the chunk eval state to be inherited by the forked worker processes.
+_chunk_eval_state = dict()
+
+
+def _init_chunk_eval_worker():
+    # the forked workers share the parent RNG state, re-seed so that
+    # the noise realizations of the chunks are independent.
+    np.random.seed()
+
+
+def _eval_chunk_in_worker(ci):
+    eval_func = _chunk_eval_state['eval_func']
+    reduce_func = _chunk_eval_state['reduce_func']
+    t = _chunk_eval_state['t_chunks'][ci]
+    return ci, reduce_func(eval_func(t))
+
+
+def iter_eval_chunks(
+        eval_func, t_chunks,
+        reduce_func=None,
+        n_workers=1,
+        max_inflight_chunks=None):
+    """Evaluate `eval_func` for each of `t_chunks` and yield the results.
+
+    When `n_workers` is larger than 1, the chunks are evaluated
+    concurrently in a pool of forked worker processes. The results are
+    yielded in the order of `t_chunks`, and at most `max_inflight_chunks`
+    chunks are submitted at any time, which bounds the number of finished
+    chunks waiting in the reorder buffer.
+
+    Because the workers are forked, `eval_func` and `reduce_func` do not
+    have to be picklable, but the return value of `reduce_func` does.
+
+    Parameters
+    ----------
+    eval_func : callable
+        The function to evaluate a time chunk.
+    t_chunks : list
+        The list of time chunks.
+    reduce_func : callable, optional
+        If set, this is applied to the result of `eval_func` before
+        sending it back to the main process.
+    n_workers : int
+        The number of worker processes.
+    max_inflight_chunks : int, optional
+        The max number of chunks submitted but not yet yielded. Default
+        is ``2 * n_workers``.
+
+    Yields
+    ------
+    ci : int
+        The chunk index.
+    data :
+        The evaluated (and reduced) chunk data.
+    """
+    logger = get_logger()
+    if reduce_func is None:
+        def reduce_func(data):
+            return data
+    if n_workers > 1 and \
+            'fork' not in multiprocessing.get_all_start_methods():
+        logger.warning(
+            "parallel chunk eval requires fork start method, "
+            "fallback to serial eval.")
+        n_workers = 1
+    if n_workers <= 1:
+        for ci, t in enumerate(t_chunks):
+            yield ci, reduce_func(eval_func(t))
+        return
+    if max_inflight_chunks is None:
+        max_inflight_chunks = 2 * n_workers
+    if max_inflight_chunks < 1:
+        raise ValueError("max_inflight_chunks has to be at least 1.")
+    n_chunks = len(t_chunks)
+    logger.info(
+        f"eval {n_chunks} chunks with n_workers={n_workers} "
+        f"max_inflight_chunks={max_inflight_chunks}")
+    _chunk_eval_state.update(
+        eval_func=eval_func, reduce_func=reduce_func, t_chunks=t_chunks)
+    try:
+        with ProcessPoolExecutor(
+                max_workers=n_workers,
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_chunk_eval_worker,
+                ) as executor:
+            # futures are kept in submit order so the head of the queue
+            # is always the next chunk to yield.
+            inflight = collections.deque()
+            ci_next = 0
+            try:
+                while inflight or ci_next < n_chunks:
+                    while ci_next < n_chunks \
+                            and len(inflight) < max_inflight_chunks:
+                        inflight.append(executor.submit(
+                            _eval_chunk_in_worker, ci_next))
+                        ci_next += 1
+                    yield inflight.popleft().result()
+            finally:
+                for f in inflight:
+                    f.cancel()
+    finally:
+        _chunk_eval_state.clear()
+
+
+class WriteBehindWriter(object):
+    """A helper to run `write_func` in a background thread.
+
+    Items passed to :meth:`submit` are put in a bounded queue and are
+    consumed by the writer thread in order. :meth:`submit` blocks when
+    the queue is full, which limits the memory held by pending items.
+    Errors raised in the writer thread are re-raised in the submitting
+    thread on the next :meth:`submit` or on exit of the context.
+
+    When `max_queued` is None, `write_func` is called synchronously in
+    :meth:`submit`.
+
+    Parameters
+    ----------
+    write_func : callable
+        The function to write one item.
+    max_queued : int, optional
+        The max number of items waiting to be written.
+    """
+
+    logger = get_logger()
+
+    # a special value to stop the writer thread.
+    _stop = object()
+
+    def __init__(self, write_func, max_queued=None):
+        if max_queued is not None and max_queued < 1:
+            raise ValueError("max_queued has to be at least 1.")
+        self._write_func = write_func
+        self._max_queued = max_queued
+        self._queue = None
+        self._thread = None
+        self._error = None
+        self._cancelled = threading.Event()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._stop:
+                return
+            if self._cancelled.is_set():
+                continue
+            try:
+                self._write_func(item)
+            except BaseException as e:
+                self._error = e
+                # stop consuming the rest of the items, but keep
+                # draining the queue so that submit does not block.
+                self._cancelled.set()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise RuntimeError("write-behind writer failed") from self._error
+
+    def submit(self, item):
+        """Write `item`, or put it in the queue in the write-behind mode."""
+        if self._thread is None:
+            self._write_func(item)
+            return
+        self._check_error()
+        while True:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                self._check_error()
+
+    def __enter__(self):
+        if self._max_queued is not None:
+            self._queue = queue.Queue(maxsize=self._max_queued)
+            self._thread = threading.Thread(
+                target=self._run, name='write_behind_writer', daemon=True)
+            self._thread.start()
+            self.logger.debug(
+                f"start write-behind writer with "
+                f"max_queued={self._max_queued}")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._thread is None:
+            return
+        if exc_type is not None:
+            # skip the pending items
+            self._cancelled.set()
+        self._queue.put(self._stop)
+        self._thread.join()
+        self._thread = None
+        self._queue = None
+        if exc_type is None:
+            self._check_error()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 
-from .misc import (get_pkg_data_path, get_user_data_dir)
+from .misc import (get_pkg_data_path, get_user_data_dir, get_cpu_slots)
 from .runtime_context import (
     ConfigInfo, yaml_load, yaml_dump,
     RuntimeContext, RuntimeContextError, RuntimeBase, RuntimeBaseError)
@@ -16,7 +16,7 @@ import argparse
 
 
 __all__ = [
-    'get_user_data_dir', 'get_pkg_data_path',
+    'get_user_data_dir', 'get_pkg_data_path', 'get_cpu_slots',
     'yaml_load', 'yaml_dump',
     'RuntimeContext', 'RuntimeContextError',
     'RuntimeBase', 'RuntimeBaseError',
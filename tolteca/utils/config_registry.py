@@ -33,9 +33,14 @@ class ConfigRegistry(Registry):
             self, key, aliases=None,
             dispatcher_key=None,
             dispatcher_description=None,
+            info=None,
             ):
         """Register(or return decorator to register) item with `key` with
-        optional aliases."""
+        optional aliases.
+
+        `info` is an optional dict of additional info of the item, which
+        can be retrieved with :meth:`get_info`.
+        """
         dispatcher_value = key
         if aliases is None:
             dispatcher_value_schema = key
@@ -46,7 +51,7 @@ class ConfigRegistry(Registry):
             dispatcher_key = self.dispatcher_key
         if dispatcher_description is None:
             dispatcher_description = self.dispatcher_description
-        self._register_info[key] = dict(aliases=aliases)
+        self._register_info[key] = dict(aliases=aliases, info=info or dict())
 
         def decorator(item):
             super(Registry, self).register(key, item)
@@ -74,6 +79,14 @@ class ConfigRegistry(Registry):
             return item
         return decorator
 
+    def get_info(self, key):
+        """Return the info dict of item registered with `key` or its
+        aliases."""
+        for k, v in self._register_info.items():
+            if key == k or (v['aliases'] is not None and key in v['aliases']):
+                return v['info']
+        raise KeyError(f"{key} is not registered in {self.name}")
+
     @property
     def item_schemas(self):
         """The generator for all item schemas."""
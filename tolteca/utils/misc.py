@@ -1,13 +1,15 @@
 #!/usr/bin/env python
 
 
+import os
 import appdirs
 from pathlib import Path
 from art import text2art
 
 
 __all__ = [
-    'get_pkg_data_path', 'get_user_data_dir', 'get_nested_keys']
+    'get_pkg_data_path', 'get_user_data_dir', 'get_nested_keys',
+    'get_cpu_slots']
 
 
 def get_pkg_data_path():
@@ -19,6 +21,25 @@ def get_user_data_dir():
     return Path(appdirs.user_data_dir('tolteca', 'toltec'))
 
 
+def get_cpu_slots(n_procs, n_cpus_per_proc):
+    """Return disjoint lists of CPUs to pin `n_procs` processes to.
+
+    Returns None if `n_cpus_per_proc` is None, or there are not enough
+    CPUs available to the current process.
+    """
+    if n_cpus_per_proc is None:
+        return None
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count()))
+    if n_procs * n_cpus_per_proc > len(cpus):
+        return None
+    return [
+        cpus[i * n_cpus_per_proc:(i + 1) * n_cpus_per_proc]
+        for i in range(n_procs)]
+
+
 def make_ascii_banner(title, subtitle):
     """Return a textual banner."""
     title_lines = text2art(title, "avatar").split('\n')
@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+
+import os
+
+from ..misc import get_cpu_slots
+
+
+def test_get_cpu_slots():
+    assert get_cpu_slots(3, None) is None
+    if hasattr(os, 'sched_getaffinity'):
+        n_cpus = len(os.sched_getaffinity(0))
+    else:
+        n_cpus = os.cpu_count()
+    assert get_cpu_slots(n_cpus + 1, 1) is None
+    cpu_slots = get_cpu_slots(n_cpus, 1)
+    assert all(len(cpus) == 1 for cpus in cpu_slots)
+    # the slots are disjoint
+    assert len({cpus[0] for cpus in cpu_slots}) == n_cpus
@@ -133,6 +133,10 @@ if celery_app is not None:
 
     QueueOnce = celery_app.QueueOnce
 
+    @celery_app.task(base=QueueOnce, once={'timeout': 60})
+    def update_toltec_file_index():
+        SharedToltecDataset.datafiles.update_index()
+
     @celery_app.task(base=QueueOnce, once={'timeout': 10}, time_limit=5)
     def update_shared_toltec_dataset():
         logger = get_logger()
@@ -201,5 +205,6 @@ if celery_app is not None:
     q = Q.normal_priority
     # lower number indicates higher priority, per
     # https://github.com/celery/celery/issues/4028#issuecomment-537587618
+    schedule_task(update_toltec_file_index, schedule=5, args=tuple(), options={'queue': q, 'priority': 0, 'expires': 5})
     schedule_task(update_shared_toltec_dataset, schedule=1, args=tuple(), options={'queue': q, 'priority': 0, 'expires': 1})
     schedule_task(reduce_kidsdata_on_db, schedule=1, args=tuple(), options={'queue': q, 'priority': 3, 'expires': 1})
@@ -7,6 +7,7 @@ across workers through the IPC extension."""
 
 from dasha.web.extensions.ipc import ipc
 import pandas as pd
+from pathlib import Path
 from dasha.web.extensions.cache import cache
 from tollan.utils.log import get_logger
 
@@ -67,12 +68,20 @@ class SharedToltecDataset(object):
     @cache.memoize(timeout=1)
     def files_from_info(cls, entry, master=None):
         logger = get_logger()
-        if master is None:
-            master = '**'
-        pattern = \
-            f'{master}/toltec*_' \
-            f'{entry["Obsnum"]:06d}' \
-            f'_{entry["SubObsNum"]:03d}_{entry["ScanNum"]:04d}*'
-        rpath = SharedToltecDataset.datafiles.rootpath
-        logger.info(f"query {rpath} with pattern {pattern}")
-        return list(map(str, rpath.glob(pattern)))
+        datafiles = SharedToltecDataset.datafiles
+        logger.info(
+            f"query {datafiles.rootpath} for {entry} master={master}")
+        # master is the glob pattern of the sub directory to look in,
+        # e.g., "ics/**" or "reduced".
+        if master is not None:
+            master = master.rstrip('/*') or None
+        # the index is updated by the update_toltec_file_index task.
+        files = datafiles.query_files(
+            update=False,
+            obsnum=entry["Obsnum"],
+            subobsnum=entry["SubObsNum"],
+            scannum=entry["ScanNum"],
+            subdir=master)
+        return [
+            f['path'] for f in files
+            if Path(f['path']).name.startswith('toltec')]
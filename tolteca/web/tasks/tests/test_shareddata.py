@@ -0,0 +1,31 @@
+#! /usr/bin/env python
+
+from ..shareddata import SharedToltecDataset
+from ....datamodels.fs.toltec import ToltecDataFileStore
+
+
+def test_files_from_info(tmp_path, monkeypatch):
+    rootpath = tmp_path.joinpath('data_lmt')
+    filenames = [
+        'ics/toltec0/toltec0_010943_000_0000_2020_07_13_22_32_19_targsweep.nc',
+        'ics/toltec1/toltec1_010943_000_0000_2020_07_13_22_32_19_targsweep.nc',
+        'ics/toltec0/toltec0_010944_000_0000_2020_07_13_22_40_19_targsweep.nc',
+        'tcs/toltec0/toltec0_010943_000_0000_2020_07_13_22_32_19_targsweep.nc',
+        'reduced/toltec0_010943_000_0000_2020_07_13_22_32_19_targsweep.txt',
+        ]
+    for f in filenames:
+        p = rootpath.joinpath(f)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.touch()
+    datafiles = ToltecDataFileStore(rootpath)
+    datafiles.update_index()
+    monkeypatch.setattr(SharedToltecDataset, 'datafiles', datafiles)
+    entry = {'Obsnum': 10943, 'SubObsNum': 0, 'ScanNum': 0}
+    # the memoized function requires the app context, so the uncached one
+    # is called. The master values are those used by the kidsreduce task.
+    files_from_info = SharedToltecDataset.files_from_info.uncached
+    assert files_from_info(SharedToltecDataset, entry, master='ics/**') == [
+        rootpath.joinpath(f).as_posix() for f in filenames[:2]]
+    assert files_from_info(SharedToltecDataset, entry, master='reduced') == [
+        rootpath.joinpath(filenames[4]).as_posix()]
+    assert len(files_from_info(SharedToltecDataset, entry)) == 4
@@ -666,10 +666,10 @@ Appendix B.1 of Planck Intermediate Results XIX ([link](https://arxiv.org/pdf/14
             result = {
                 "array_name": an,
                 "alt_mean": alt_mean,
-                "P": aplm._get_P(alt_mean),
+                "P": aplm.get_P(alt_mean),
                 "n_dets_info": n_dets_info,
             }
-            result.update(aplm._get_noise(alt_mean, return_avg=True))
+            result.update(aplm.get_noise(alt_mean))
             result["nefd_I"] = result["nefd"]
             result["nefd_QU"] = _get_pol_noise_factor() * result["nefd_I"]
             result["dsens_I"] = sens_coeff * result["nefd_I"].to(u.mJy * u.s**0.5)
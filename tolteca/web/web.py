@@ -26,6 +26,10 @@ env_registry.register(
         f"{env_prefix}_FS_TOLTEC_ROOTPATH",
         "The root path to TolTEC data files",
         get_user_data_dir())
+env_registry.register(
+        f"{env_prefix}_FS_TOLTEC_INDEX_PATH",
+        "The path to the file index of TolTEC data files",
+        get_user_data_dir().joinpath('toltec_file_index.sqlite'))
 env_registry.register(
         f"{env_prefix}_LMT_OCS3_URL",
         "The OCS3_URL",
@@ -43,8 +47,12 @@ db_tolteca_url = env_registry.get(f"{env_prefix}_DB_TOLTECA_URL")
 redis_url = "redis://localhost:6379"
 fs_toltec_rootpath = env_registry.get(f"{env_prefix}_FS_TOLTEC_ROOTPATH")
 fs_toltec_hk_rootpath = env_registry.get(f"{env_prefix}_FS_TOLTEC_HK_ROOTPATH")
+fs_toltec_index_path = env_registry.get(f"{env_prefix}_FS_TOLTEC_INDEX_PATH")
 lmt_ocs3_url = env_registry.get(f"{env_prefix}_LMT_OCS3_URL")
-toltec_datastore = ToltecDataFileStore(fs_toltec_rootpath)
+# the file index is shared by the workers, and is updated by the
+# update_toltec_file_index task.
+toltec_datastore = ToltecDataFileStore(
+        fs_toltec_rootpath, index_path=fs_toltec_index_path)
 
 
 # site configs